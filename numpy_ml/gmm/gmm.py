@@ -1,5 +1,6 @@
 import numpy as np
 from numpy.testing import assert_allclose
+from scipy.linalg import solve_triangular
 
 
 class GMM(object):
@@ -56,30 +57,19 @@ class GMM(object):
         self.best_sigma = None
         self.best_elbo = -np.inf
 
+        # log N(X_i | mu_c, Sigma_c) under the current parameters
+        self._log_pdf_cache = None
+
     def likelihood_lower_bound(self):
         """
         Compute the LLB under the current GMM parameters.
         """
-        N = self.N
-        C = self.C
-
         eps = np.finfo(float).eps
-        expec1, expec2 = 0.0, 0.0
-        for i in range(N):
-            x_i = self.X[i]
-
-            for c in range(C):
-                pi_k = self.pi[c]
-                z_nk = self.Q[i, c]
-                mu_k = self.mu[c, :]
-                sigma_k = self.sigma[c, :, :]
+        log_pi = np.log(self.pi + eps)
+        log_p_x = self._log_pdfs()
 
-                log_pi_k = np.log(pi_k + eps)
-                log_p_x_i = log_gaussian_pdf(x_i, mu_k, sigma_k)
-                prob = z_nk * (log_p_x_i + log_pi_k)
-
-                expec1 += prob
-                expec2 += z_nk * np.log(z_nk + eps)
+        expec1 = np.sum(self.Q * (log_p_x + log_pi))
+        expec2 = np.sum(self.Q * np.log(self.Q + eps))
 
         loss = expec1 - expec2
         return loss
@@ -144,28 +134,34 @@ class GMM(object):
                 return -1
         return 0
 
-    def _E_step(self):
-        for i in range(self.N):
-            x_i = self.X[i, :]
+    def _log_pdfs(self):
+        """
+        Compute log N(X_i | mu_c, Sigma_c) for every example `i` and mixture
+        component `c`, returned as an array of shape `(N, C)`. Each covariance
+        matrix is factored once and the densities for all examples are
+        computed with a single triangular solve per component.
 
-            denom_vals = []
+        The densities are cached until the next M-step, so that the lower
+        bound and the following E-step share them.
+        """
+        if self._log_pdf_cache is None:
+            L = np.linalg.cholesky(self.sigma)
+            log_pdfs = np.empty((self.N, self.C))
             for c in range(self.C):
-                pi_c = self.pi[c]
-                mu_c = self.mu[c, :]
-                sigma_c = self.sigma[c, :, :]
+                log_pdfs[:, c] = _log_gaussian_pdf_chol(self.X, self.mu[c], L[c])
+            self._log_pdf_cache = log_pdfs
+        return self._log_pdf_cache
 
-                log_pi_c = np.log(pi_c)
-                log_p_x_i = log_gaussian_pdf(x_i, mu_c, sigma_c)
-
-                # log N(X_i | mu_c, Sigma_c) + log pi_c
-                denom_vals.append(log_p_x_i + log_pi_c)
+    def _E_step(self):
+        # log N(X_i | mu_c, Sigma_c) + log pi_c
+        log_probs = self._log_pdfs() + np.log(self.pi)
 
-            # log \sum_c exp{ log N(X_i | mu_c, Sigma_c) + log pi_c } ]
-            log_denom = logsumexp(denom_vals)
-            q_i = np.exp([num - log_denom for num in denom_vals])
-            assert_allclose(np.sum(q_i), 1, err_msg="{}".format(np.sum(q_i)))
+        # log \sum_c exp{ log N(X_i | mu_c, Sigma_c) + log pi_c } ]
+        log_denom = logsumexp(log_probs, axis=1)
+        self.Q = np.exp(log_probs - log_denom[:, None])
 
-            self.Q[i, :] = q_i
+        q_sums = np.sum(self.Q, axis=1)
+        assert_allclose(q_sums, 1, err_msg="{}".format(q_sums))
 
     def _M_step(self):
         C, N, X = self.C, self.N, self.X
@@ -175,26 +171,24 @@ class GMM(object):
         self.pi = denoms / N
 
         # update cluster means
-        nums_mu = [np.dot(self.Q[:, c], X) for c in range(C)]
-        for ix, (num, den) in enumerate(zip(nums_mu, denoms)):
-            self.mu[ix, :] = num / den if den > 0 else np.zeros_like(num)
+        nums_mu = self.Q.T @ X
+        nonempty = denoms > 0
+        self.mu = np.zeros_like(nums_mu)
+        self.mu[nonempty] = nums_mu[nonempty] / denoms[nonempty, None]
 
         # update cluster covariances
+        self.sigma = np.empty((C, self.d, self.d))
         for c in range(C):
-            mu_c = self.mu[c, :]
             n_c = denoms[c]
-
-            outer = np.zeros((self.d, self.d))
-            for i in range(N):
-                wic = self.Q[i, c]
-                xi = self.X[i, :]
-                outer += wic * np.outer(xi - mu_c, xi - mu_c)
-
-            outer = outer / n_c if n_c > 0 else outer
-            self.sigma[c, :, :] = outer
+            diff = X - self.mu[c, :]
+            outer = (self.Q[:, c, None] * diff).T @ diff
+            self.sigma[c, :, :] = outer / n_c if n_c > 0 else outer
 
         assert_allclose(np.sum(self.pi), 1, err_msg="{}".format(np.sum(self.pi)))
 
+        # the parameters have changed, so the cached densities are stale
+        self._log_pdf_cache = None
+
 
 #######################################################################
 #                                Utils                                #
@@ -203,15 +197,29 @@ class GMM(object):
 
 def log_gaussian_pdf(x_i, mu, sigma):
     """
-    Compute log N(x_i | mu, sigma)
+    Compute log N(x_i | mu, sigma). If `x_i` has shape `(N, d)`, return the
+    log density of each of its rows.
+    """
+    return _log_gaussian_pdf_chol(x_i, mu, np.linalg.cholesky(sigma))
+
+
+def _log_gaussian_pdf_chol(x_i, mu, L):
+    """
+    Compute log N(x_i | mu, sigma) given the lower Cholesky factor `L` of
+    `sigma`, for a single example or each row of an `(N, d)` array.
     """
     n = len(mu)
     a = n * np.log(2 * np.pi)
-    _, b = np.linalg.slogdet(sigma)
+    b = 2 * np.sum(np.log(np.diag(L)))
+
+    # with sigma = L L^T, the Mahalanobis term is the squared norm of
+    # y = L^{-1} (x_i - mu)
+    diff = np.atleast_2d(x_i) - mu
+    y = solve_triangular(L, diff.T, lower=True, check_finite=False)
+    c = np.sum(y ** 2, axis=0)
 
-    y = np.linalg.solve(sigma, x_i - mu)
-    c = np.dot(x_i - mu, y)
-    return -0.5 * (a + b + c)
+    log_pdf = -0.5 * (a + b + c)
+    return log_pdf if np.ndim(x_i) > 1 else log_pdf[0]
 
 
 def logsumexp(log_probs, axis=None):
@@ -219,7 +227,9 @@ def logsumexp(log_probs, axis=None):
     Redefine scipy.special.logsumexp
     see: http://bayesjumping.net/log-sum-exp-trick/
     """
-    _max = np.max(log_probs)
-    ds = log_probs - _max
-    exp_sum = np.exp(ds).sum(axis=axis)
+    log_probs = np.asarray(log_probs)
+    _max = np.max(log_probs, axis=axis, keepdims=True)
+    _max[~np.isfinite(_max)] = 0
+    exp_sum = np.exp(log_probs - _max).sum(axis=axis)
+    _max = np.squeeze(_max) if axis is None else np.squeeze(_max, axis=axis)
     return _max + np.log(exp_sum)
@@ -1,7 +1,15 @@
 """Hidden Markov model module"""
 
+import os
+from itertools import islice
+from multiprocessing import Pool
+
 import numpy as np
 
+# the maximum number of (sequence, timestep, state) entries in the trellises
+# for a single batch of sequences
+_MAX_TRELLIS = 2 ** 22
+
 
 class MultinomialHMM:
     def __init__(self, A=None, B=None, pi=None, eps=None):
@@ -38,11 +46,12 @@ class MultinomialHMM:
         V : int
             The number of unique observation types
         O : :py:class:`ndarray <numpy.ndarray>` of shape `(I, T)`
-            The collection of observed training sequences.
+            The collection of observed training sequences, padded to the
+            length of the longest sequence.
         I : int
             The number of sequences in `O`.
         T : int
-            The number of observations in each sequence in `O`.
+            The number of observations in the longest sequence in `O`.
         """
         self.eps = np.finfo(float).eps if eps is None else eps
 
@@ -75,9 +84,13 @@ class MultinomialHMM:
         # number of sequences in O
         self.I = None  # noqa: E741
 
-        # number of observations in each sequence
+        # number of observations in the longest sequence
         self.T = None
 
+        # running expected counts per sequence for stepwise EM
+        self._stats = None
+        self._n_updates = 0
+
     def generate(self, n_steps, latent_state_types, obs_types):
         """
         Sample a sequence from the HMM.
@@ -116,7 +129,7 @@ class MultinomialHMM:
 
         return np.array(states), np.array(emissions)
 
-    def log_likelihood(self, O):
+    def log_likelihood(self, O, lengths=None, batch_size=1024):
         r"""
         Given the HMM parameterized by :math:`(A`, B, \pi)` and an observation
         sequence `O`, compute the marginal likelihood of the observations:
@@ -152,29 +165,39 @@ class MultinomialHMM:
         product of the probability of transitioning from that state to state `i`
         and the probability of emitting observation `j` in state `i`.
 
+        Multiple sequences are processed together, `batch_size` at a time:
+        the forward values for a batch form an `(I, N)` array which is updated
+        once per timestep for the sequences which have not yet ended.
+
         Parameters
         ----------
-        O : :py:class:`ndarray <numpy.ndarray>` of shape `(1, T)`
-            A single set of observations.
+        O : :py:class:`ndarray <numpy.ndarray>` of shape `(I, T)` or list
+            A single observation sequence, an array of `I` sequences (padded
+            to length `T` if `lengths` is not None), or a list of `I`
+            sequences of varying lengths.
+        lengths : :py:class:`ndarray <numpy.ndarray>` of shape `(I,)` or None
+            The length of each sequence in a padded array `O`. If None, each
+            row of `O` is a full sequence. Default is None.
+        batch_size : int
+            The maximum number of sequences to run the forward algorithm on
+            at once. Default is 1024.
 
         Returns
         -------
-        likelihood : float
-            The likelihood of the observations `O` under the HMM.
+        likelihood : float or :py:class:`ndarray <numpy.ndarray>` of shape `(I,)`
+            The log likelihood of each sequence in `O` under the HMM. If `O`
+            holds a single sequence, a float.
         """
-        if O.ndim == 1:
-            O = O.reshape(1, -1)  # noqa: E741
-
-        I, T = O.shape  # noqa: E741
-
-        if I != 1:  # noqa: E741
-            raise ValueError("Likelihood only accepts a single sequence")
-
-        forward = self._forward(O[0])
-        log_likelihood = logsumexp(forward[:, T - 1])
-        return log_likelihood
-
-    def decode(self, O):
+        O, lengths, single = _pad(O, lengths)  # noqa: E741
+        log_likelihood = np.concatenate(
+            [
+                self._forward_batch(O[i : i + batch_size], lengths[i : i + batch_size])
+                for i in range(0, O.shape[0], batch_size)
+            ]
+        )
+        return log_likelihood[0] if single else log_likelihood
+
+    def decode(self, O, lengths=None, batch_size=256):
         r"""
         Given the HMM parameterized by :math:`(A, B, \pi)` and an observation
         sequence :math:`O = o_1, \ldots, o_T`, compute the most probable
@@ -223,65 +246,96 @@ class MultinomialHMM:
         ``back_pointer`` trellis to construct the best path for the full
         sequence of observations.
 
+        Multiple sequences are decoded together, `batch_size` at a time,
+        with the Viterbi values for a batch forming an `(I, N)` array which is
+        updated once per timestep for the sequences which have not yet ended.
+
         Parameters
         ----------
-        O : :py:class:`ndarray <numpy.ndarray>` of shape `(T,)`
-            An observation sequence of length `T`.
+        O : :py:class:`ndarray <numpy.ndarray>` of shape `(I, T)` or list
+            A single observation sequence, an array of `I` sequences (padded
+            to length `T` if `lengths` is not None), or a list of `I`
+            sequences of varying lengths.
+        lengths : :py:class:`ndarray <numpy.ndarray>` of shape `(I,)` or None
+            The length of each sequence in a padded array `O`. If None, each
+            row of `O` is a full sequence. Default is None.
+        batch_size : int
+            The maximum number of sequences to decode at once. The back
+            pointers for a batch take `batch_size * T * N` integers. Default is
+            256.
 
         Returns
         -------
-        best_path : list of length `T`
-            The most probable sequence of latent states for observations `O`.
-        best_path_prob : float
-            The probability of the latent state sequence in `best_path` under
-            the HMM.
+        best_path : list of length `T`, or list of `I` lists
+            The most probable sequence of latent states for each sequence in
+            `O`. If `O` holds a single sequence, a single list.
+        best_path_prob : float or :py:class:`ndarray <numpy.ndarray>` of shape `(I,)`
+            The log probability of each latent state sequence in `best_path`
+            under the HMM. If `O` holds a single sequence, a float.
         """
-        eps = self.eps
+        O, lengths, single = _pad(O, lengths)  # noqa: E741
 
-        if O.ndim == 1:
-            O = O.reshape(1, -1)  # noqa: E741
+        # bound the size of the per-batch back pointer arrays
+        batch_size = max(1, min(batch_size, _MAX_TRELLIS // (O.shape[1] * self.N)))
 
-        # number of observations in each sequence
-        T = O.shape[1]
+        best_paths, best_path_log_probs = [], []
+        for i in range(0, O.shape[0], batch_size):
+            paths, log_probs = self._viterbi_batch(
+                O[i : i + batch_size], lengths[i : i + batch_size]
+            )
+            best_paths.extend(paths)
+            best_path_log_probs.append(log_probs)
 
-        # number of training sequences
-        I = O.shape[0]  # noqa: E741
-        if I != 1:  # noqa: E741
-            raise ValueError("Can only decode a single sequence (O.shape[0] must be 1)")
+        best_path_log_probs = np.concatenate(best_path_log_probs)
+        if single:
+            return best_paths[0], best_path_log_probs[0]
+        return best_paths, best_path_log_probs
 
-        # initialize the viterbi and back_pointer matrices
-        viterbi = np.zeros((self.N, T))
-        back_pointer = np.zeros((self.N, T)).astype(int)
+    def _viterbi_batch(self, O, lengths):
+        """
+        Run the Viterbi algorithm on each of the sequences in the padded array
+        `O`, where sequence `i` has length ``lengths[i]``.
+        """
+        log_A, log_B, log_pi = self._log_params()
 
-        ot = O[0, 0]
-        for s in range(self.N):
-            back_pointer[s, 0] = 0
-            viterbi[s, 0] = np.log(self.pi[s] + eps) + np.log(self.B[s, ot] + eps)
+        # sort the sequences by decreasing length so that the sequences which
+        # have not ended at each timestep are a prefix of the batch
+        order = np.argsort(-lengths, kind="stable")
+        O, lengths = O[order], lengths[order]  # noqa: E741
+        I, T = O.shape  # noqa: E741
+        n_active = np.searchsorted(-lengths, -np.arange(T), side="left")
 
-        for t in range(1, T):
-            ot = O[0, t]
-            for s in range(self.N):
-                seq_probs = [
-                    viterbi[s_, t - 1]
-                    + np.log(self.A[s_, s] + eps)
-                    + np.log(self.B[s, ot] + eps)
-                    for s_ in range(self.N)
-                ]
+        # initialize the viterbi and back_pointer matrices
+        viterbi = log_pi + log_B[:, O[:, 0]].T
+        index_dtype = np.int16 if self.N <= np.iinfo(np.int16).max else np.int32
+        back_pointer = np.zeros((T, I, self.N), dtype=index_dtype)
 
-                viterbi[s, t] = np.max(seq_probs)
-                back_pointer[s, t] = np.argmax(seq_probs)
+        for t in range(1, T):
+            n = n_active[t]
+            best, back_pointer[t, :n] = _max_product(viterbi[:n], log_A)
+            viterbi[:n] = best + log_B[:, O[:n, t]].T
 
-        best_path_log_prob = viterbi[:, T - 1].max()
+        best_path_log_prob = viterbi.max(axis=1)
 
         # backtrack through the trellis to get the most likely sequence of
         # latent states
-        pointer = viterbi[:, T - 1].argmax()
-        best_path = [pointer]
+        best_path = np.zeros((I, T), dtype=int)
+        best_path[np.arange(I), lengths - 1] = viterbi.argmax(axis=1)
         for t in reversed(range(1, T)):
-            pointer = back_pointer[pointer, t]
-            best_path.append(pointer)
-        best_path = best_path[::-1]
-        return best_path, best_path_log_prob
+            n = n_active[t]
+            best_path[:n, t - 1] = back_pointer[t, np.arange(n), best_path[:n, t]]
+
+        inverse = np.argsort(order)
+        best_path = [best_path[i, : lengths[i]].tolist() for i in inverse]
+        return best_path, best_path_log_prob[inverse]
+
+    def _log_params(self):
+        """
+        Return the elementwise log of the transition matrix, emission matrix,
+        and prior, each offset by `eps` to avoid :math:`\log(0)`.
+        """
+        eps = self.eps
+        return np.log(self.A + eps), np.log(self.B + eps), np.log(self.pi + eps)
 
     def _forward(self, Obs):
         r"""
@@ -327,29 +381,63 @@ class MultinomialHMM:
         forward : :py:class:`ndarray <numpy.ndarray>` of shape `(N, T)`
             The forward trellis.
         """
-        eps = self.eps
         T = Obs.shape[0]
+        log_A, log_B, log_pi = self._log_params()
+        A = np.exp(log_A)
 
         # initialize the forward probability matrix
         forward = np.zeros((self.N, T))
-
-        ot = Obs[0]
-        for s in range(self.N):
-            forward[s, 0] = np.log(self.pi[s] + eps) + np.log(self.B[s, ot] + eps)
+        forward[:, 0] = log_pi + log_B[:, Obs[0]]
 
         for t in range(1, T):
-            ot = Obs[t]
-            for s in range(self.N):
-                forward[s, t] = logsumexp(
-                    [
-                        forward[s_, t - 1]
-                        + np.log(self.A[s_, s] + eps)
-                        + np.log(self.B[s, ot] + eps)
-                        for s_ in range(self.N)
-                    ]  # noqa: C812
-                )
+            # logsumexp(forward[:, t - 1, None] + log_A, axis=0), computed as
+            # a matrix-vector product after shifting by the max
+            prev = forward[:, t - 1]
+            _max = prev.max()
+            forward[:, t] = _max + np.log(np.exp(prev - _max) @ A) + log_B[:, Obs[t]]
         return forward
 
+    def _forward_batch(self, O, lengths, return_trellis=False):
+        """
+        Compute the log likelihood of each of the sequences in the padded
+        array `O`, where sequence `i` has length ``lengths[i]``. If
+        `return_trellis` is True, also return the forward trellis for each
+        sequence as an array of shape `(I, T, N)`.
+        """
+        log_A, log_B, log_pi = self._log_params()
+        A = np.exp(log_A)
+
+        # sort the sequences by decreasing length so that the sequences which
+        # have not ended at each timestep are a prefix of the batch
+        order = np.argsort(-lengths, kind="stable")
+        O, lengths = O[order], lengths[order]  # noqa: E741
+        T = O.shape[1]
+        n_active = np.searchsorted(-lengths, -np.arange(T), side="left")
+
+        forward = log_pi + log_B[:, O[:, 0]].T
+        trellis = None
+        if return_trellis:
+            trellis = np.zeros((len(order), T, self.N))
+            trellis[:, 0] = forward
+
+        for t in range(1, T):
+            n = n_active[t]
+            prev = forward[:n]
+            _max = prev.max(axis=1, keepdims=True)
+            forward[:n] = _max + np.log(np.exp(prev - _max) @ A)
+            forward[:n] += log_B[:, O[:n, t]].T
+            if return_trellis:
+                trellis[:n, t] = forward[:n]
+
+        log_likelihood = np.empty(len(order))
+        log_likelihood[order] = logsumexp(forward, axis=1)
+        if not return_trellis:
+            return log_likelihood
+
+        unsorted = np.empty_like(trellis)
+        unsorted[order] = trellis
+        return log_likelihood, unsorted
+
     def _backward(self, Obs):
         r"""
         Compute the backward probability trellis for an HMM parameterized by
@@ -391,28 +479,47 @@ class MultinomialHMM:
         backward : :py:class:`ndarray <numpy.ndarray>` of shape `(N, T)`
             The backward trellis.
         """
-        eps = self.eps
         T = Obs.shape[0]
+        log_A, log_B, _ = self._log_params()
+        A = np.exp(log_A)
 
         # initialize the backward trellis
         backward = np.zeros((self.N, T))
 
-        for s in range(self.N):
-            backward[s, T - 1] = 0
-
         for t in reversed(range(T - 1)):
-            ot1 = Obs[t + 1]
-            for s in range(self.N):
-                backward[s, t] = logsumexp(
-                    [
-                        np.log(self.A[s, s_] + eps)
-                        + np.log(self.B[s_, ot1] + eps)
-                        + backward[s_, t + 1]
-                        for s_ in range(self.N)
-                    ]  # noqa: C812
-                )
+            # logsumexp(log_A + log_B[:, o_{t+1}] + backward[:, t + 1], axis=1)
+            nxt = log_B[:, Obs[t + 1]] + backward[:, t + 1]
+            _max = nxt.max()
+            backward[:, t] = _max + np.log(A @ np.exp(nxt - _max))
         return backward
 
+    def _backward_batch(self, O, lengths):
+        """
+        Compute the backward trellis for each of the sequences in the padded
+        array `O`, where sequence `i` has length ``lengths[i]``, as an array
+        of shape `(I, T, N)`. Entries past the end of a sequence are zero.
+        """
+        log_A, log_B, _ = self._log_params()
+        A = np.exp(log_A)
+
+        order = np.argsort(-lengths, kind="stable")
+        O, lengths = O[order], lengths[order]  # noqa: E741
+        T = O.shape[1]
+        n_active = np.searchsorted(-lengths, -np.arange(T), side="left")
+
+        backward = np.zeros((len(order), T, self.N))
+        for t in reversed(range(T - 1)):
+            # only the sequences which continue past timestep t are updated;
+            # the last entry of each sequence keeps its initial value of 0
+            n = n_active[t + 1]
+            nxt = log_B[:, O[:n, t + 1]].T + backward[:n, t + 1]
+            _max = nxt.max(axis=1, keepdims=True)
+            backward[:n, t] = _max + np.log(np.exp(nxt - _max) @ A.T)
+
+        unsorted = np.empty_like(backward)
+        unsorted[order] = backward
+        return unsorted
+
     def fit(
         self,
         O,
@@ -421,6 +528,9 @@ class MultinomialHMM:
         pi=None,
         tol=1e-5,
         verbose=False,
+        lengths=None,
+        batch_size=1024,
+        n_jobs=1,
     ):
         """
         Given an observation sequence `O` and the set of possible latent states,
@@ -437,10 +547,18 @@ class MultinomialHMM:
         dividing that probability mass among all the paths that contributed to
         it.
 
+        Each E-step accumulates the expected start, transition, and emission
+        counts over batches of sequences, and each M-step normalizes them. If
+        `n_jobs` is greater than 1, the batches are split into shards which
+        are processed by a pool of worker processes and the resulting counts
+        are summed.
+
         Parameters
         ----------
-        O : :py:class:`ndarray <numpy.ndarray>` of shape `(I, T)`
-            The set of `I` training observations, each of length `T`.
+        O : :py:class:`ndarray <numpy.ndarray>` of shape `(I, T)` or list
+            The set of `I` training observations, each of length `T` (or of
+            length ``lengths[i]`` if `lengths` is not None), or a list of `I`
+            sequences of varying lengths.
         latent_state_types : list of length `N`
             The collection of valid latent states.
         observation_types : list of length `V`
@@ -454,6 +572,15 @@ class MultinomialHMM:
             1e-5.
         verbose : bool
             Print training stats after each epoch. Default is True.
+        lengths : :py:class:`ndarray <numpy.ndarray>` of shape `(I,)` or None
+            The length of each sequence in a padded array `O`. If None, each
+            row of `O` is a full sequence. Default is None.
+        batch_size : int
+            The maximum number of sequences to run the forward-backward
+            algorithm on at once. Default is 1024.
+        n_jobs : int or None
+            The number of processes to use for the E-step. If -1, use all
+            available CPUs. If 1 or None, run serially. Default is 1.
 
         Returns
         -------
@@ -464,8 +591,7 @@ class MultinomialHMM:
         pi : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
             The estimated prior probabilities of each latent state.
         """
-        if O.ndim == 1:
-            O = O.reshape(1, -1)  # noqa: E741
+        O, lengths, _ = _pad(O, lengths)  # noqa: E741
 
         # observations
         self.O = O  # noqa: E741
@@ -473,6 +599,171 @@ class MultinomialHMM:
         # number of training examples (I) and their lengths (T)
         self.I, self.T = self.O.shape
 
+        self._initialize_parameters(latent_state_types, observation_types, pi)
+
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        pool, n_shards = None, 1
+        if n_jobs is not None and n_jobs > 1:
+            shared = {"O": O, "lengths": lengths}
+            pool = Pool(n_jobs, initializer=_init_worker, initargs=(shared,))
+            n_shards = 4 * n_jobs
+
+        try:
+            # iterate E and M steps until convergence criteria is met. the
+            # E-step also returns the log likelihood of the sequences under
+            # the current parameters, so it is never recomputed separately
+            step, delta = 0, np.inf
+            *stats, ll_prev = self._Estep(O, lengths, batch_size, pool, n_shards)
+            while delta > tol:
+                self.A, self.B, self.pi = self._Mstep(*stats)
+                *stats, ll = self._Estep(O, lengths, batch_size, pool, n_shards)
+                delta = ll - ll_prev
+                ll_prev = ll
+                step += 1
+
+                if verbose:
+                    fstr = "[Epoch {}] LL: {:.3f} Delta: {:.5f}"
+                    print(fstr.format(step, ll_prev, delta))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        return self.A, self.B, self.pi
+
+    def fit_online(
+        self,
+        sequences,
+        latent_state_types,
+        observation_types,
+        pi=None,
+        minibatch_size=64,
+        decay=0.6,
+        offset=1,
+        verbose=False,
+    ):
+        r"""
+        Learn the HMM parameters `A`, `B`, and `pi` from a stream of
+        observation sequences using stepwise (online) EM.
+
+        Notes
+        -----
+        Stepwise EM (Cappé & Moulines, 2009) replaces the batch E-step with a
+        running average of the expected counts per sequence. After the `k`'th
+        minibatch, the running statistics are updated as
+
+        .. math::
+
+            s_k = (1 - \eta_k) s_{k-1} + \eta_k \bar{s}_k
+
+        where :math:`\bar{s}_k` are the expected start, transition, and
+        emission counts per sequence in the minibatch under the current
+        parameters, and the parameters are then re-estimated from
+        :math:`s_k` as in the batch M-step. The step size decays as
+        :math:`\eta_k = (k + \text{offset})^{-\text{decay}}`, which
+        converges for `decay` in `(0.5, 1]`.
+
+        Only one minibatch is held in memory at a time, so `sequences` may be
+        a generator (e.g., over the lines of a log file).
+
+        Parameters
+        ----------
+        sequences : iterable
+            An iterable of 1D integer arrays, each holding one observation
+            sequence. May be of any (finite) length.
+        latent_state_types : list of length `N`
+            The collection of valid latent states.
+        observation_types : list of length `V`
+            The collection of valid observation states.
+        pi : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The prior probability of each latent state. If None, assume each
+            latent state is equally likely a priori. Default is None.
+        minibatch_size : int
+            The number of sequences in each minibatch. Default is 64.
+        decay : float in `(0.5, 1]`
+            The rate at which the step size decays. Default is 0.6.
+        offset : float
+            A delay applied to the step size schedule. Values larger than 1
+            reduce the weight of the earliest minibatches. Default is 1.
+        verbose : bool
+            Print the average log likelihood of each minibatch. Default is
+            False.
+
+        Returns
+        -------
+        A : :py:class:`ndarray <numpy.ndarray>` of shape `(N, N)`
+            The estimated transition matrix.
+        B : :py:class:`ndarray <numpy.ndarray>` of shape `(N, V)`
+            The estimated emission matrix.
+        pi : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The estimated prior probabilities of each latent state.
+        """
+        if not 0.5 < decay <= 1:
+            raise ValueError("decay must be in (0.5, 1], got {}".format(decay))
+
+        self._initialize_parameters(latent_state_types, observation_types, pi)
+
+        sequences = iter(sequences)
+        minibatch = list(islice(sequences, minibatch_size))
+        while minibatch:
+            ll = self.partial_fit(minibatch, decay=decay, offset=offset)
+
+            if verbose:
+                fstr = "[Minibatch {}] Mean LL: {:.3f}"
+                print(fstr.format(self._n_updates, ll / len(minibatch)))
+
+            minibatch = list(islice(sequences, minibatch_size))
+        return self.A, self.B, self.pi
+
+    def partial_fit(self, O, lengths=None, decay=0.6, offset=1):
+        """
+        Run a single stepwise EM update of `A`, `B`, and `pi` on a minibatch
+        of observation sequences. See :meth:`fit_online` for details.
+
+        The running statistics persist across calls, so repeated calls can be
+        used to keep a model fit with :meth:`fit_online` up to date as new
+        sequences arrive. The first update after the running statistics are
+        reset (by :meth:`fit` or :meth:`fit_online`) uses a step size of 1
+        when `offset` is 1.
+
+        Parameters
+        ----------
+        O : :py:class:`ndarray <numpy.ndarray>` of shape `(I, T)` or list
+            A single observation sequence, an array of `I` sequences (padded
+            to length `T` if `lengths` is not None), or a list of `I`
+            sequences of varying lengths.
+        lengths : :py:class:`ndarray <numpy.ndarray>` of shape `(I,)` or None
+            The length of each sequence in a padded array `O`. If None, each
+            row of `O` is a full sequence. Default is None.
+        decay : float in `(0.5, 1]`
+            The rate at which the step size decays. Default is 0.6.
+        offset : float
+            A delay applied to the step size schedule. Default is 1.
+
+        Returns
+        -------
+        log_likelihood : float
+            The total log likelihood of the sequences in `O` under the
+            parameters before the update.
+        """
+        O, lengths, _ = _pad(O, lengths)  # noqa: E741
+        *stats, ll = self._Estep(O, lengths)
+
+        step_size = (self._n_updates + offset) ** -decay
+        stats = [s / O.shape[0] for s in stats]
+        if self._stats is not None:
+            running = zip(self._stats, stats)
+            stats = [(1 - step_size) * r + step_size * s for r, s in running]
+
+        self._stats = stats
+        self._n_updates += 1
+        self.A, self.B, self.pi = self._Mstep(*stats)
+        return ll
+
+    def _initialize_parameters(self, latent_state_types, observation_types, pi=None):
+        """
+        Initialize the HMM parameters before fitting and reset the running
+        statistics used by :meth:`partial_fit`.
+        """
         # number of types of observation
         self.V = len(observation_types)
 
@@ -493,112 +784,141 @@ class MultinomialHMM:
         self.B = np.random.rand(self.N, self.V)
         self.B = self.B / self.B.sum(axis=1)[:, None]
 
-        # iterate E and M steps until convergence criteria is met
-        step, delta = 0, np.inf
-        ll_prev = np.sum([self.log_likelihood(o) for o in self.O])
-        while delta > tol:
-            gamma, xi, phi = self._Estep()
-            self.A, self.B, self.pi = self._Mstep(gamma, xi, phi)
-            ll = np.sum([self.log_likelihood(o) for o in self.O])
-            delta = ll - ll_prev
-            ll_prev = ll
-            step += 1
+        # running expected counts per sequence for stepwise EM
+        self._stats = None
+        self._n_updates = 0
 
-            if verbose:
-                fstr = "[Epoch {}] LL: {:.3f} Delta: {:.5f}"
-                print(fstr.format(step, ll_prev, delta))
-
-        return self.A, self.B, self.pi
-
-    def _Estep(self):
+    def _Estep(self, O, lengths, batch_size=1024, pool=None, n_shards=1):
         r"""
         Run a single E-step update for the Baum-Welch/Forward-Backward
-        algorithm. This step estimates ``xi`` and ``gamma``, the excepted
-        state-state transition counts and the expected state-occupancy counts,
-        respectively.
+        algorithm. This step computes the expected number of times each
+        latent state starts a sequence, the expected number of state-state
+        transitions, and the expected number of times each state emits each
+        observation type, summed over all of the sequences in `O`.
 
-        ``xi[i,j,k]`` gives the probability of being in state `i` at time `k`
+        ``xi[k,i,j]`` gives the probability of being in state `i` at time `k`
         and state `j` at time `k+1` given the observed sequence `O` and the
-        current estimates for transition (`A`) and emission (`B`) matrices::
+        current estimates for transition (`A`) and emission (`B`) matrices:
 
         .. math::
 
-            xi[i,j,k] &= P(q_k=i,q_{k+1}=j \mid O,A,B,pi) \\
-                      &= \frac{
-                            P(q_k=i,q_{k+1}=j,O \mid A,B,pi)
-                         }{P(O \mid A,B,pi)} \\
+            xi[k,i,j] &= P(q_k=i,q_{k+1}=j \mid O,A,B,pi) \\
                       &= \frac{
                             P(o_1,o_2,\ldots,o_k,q_k=i \mid A,B,pi) \times
                             P(q_{k+1}=j \mid q_k=i) \times
                             P(o_{k+1} \mid q_{k+1}=j) \times
                             P(o_{k+2},o_{k+3},\ldots,o_T \mid q_{k+1}=j,A,B,pi)
-                         }{P(O \mid A,B,pi)} \\
-                      &= \frac{
-                            \mathtt{fwd[j, k] * self.A[j, i] *
-                            self.B[i, o_{k+1}] * bwd[i, k + 1]}
-                         }{\mathtt{fwd[:, T].sum()}}
+                         }{P(O \mid A,B,pi)}
+
+        The expected number of transitions from state `i` to state `j` is then
+        ``xi[:,i,j].sum()``. Rather than materializing `xi`, the sum over
+        timesteps (and sequences) is computed as a single matrix product
+        between the rescaled forward values and the rescaled product of the
+        emission probabilities and backward values on the following timestep.
 
-        The expected number of transitions from state `i` to state `j` across the
-        entire sequence is then the sum over all timesteps: ``xi[i,j,:].sum()``.
+        ``gamma[k,i]`` gives the probability of being in state `i` at time `k`
 
-        ``gamma[i,j]`` gives the probability of being in state `i` at time `j`
+        .. math:: \mathtt{gamma[k,i]} = P(q_k = i \mid O, A, B, \pi)
 
-        .. math:: \mathtt{gamma[i,j]} = P(q_j = i \mid O, A, B, \pi)
+        and the expected emission counts are the sums of `gamma` over the
+        timesteps at which each observation type occurs.
+
+        Parameters
+        ----------
+        O : :py:class:`ndarray <numpy.ndarray>` of shape `(I, T)`
+            A padded array of `I` observation sequences.
+        lengths : :py:class:`ndarray <numpy.ndarray>` of shape `(I,)`
+            The length of each sequence in `O`.
+        batch_size : int
+            The maximum number of sequences to run the forward-backward
+            algorithm on at once. Default is 1024.
+        pool : :class:`multiprocessing.pool.Pool` or None
+            A pool of processes sharing `O` and `lengths`, each of which
+            accumulates the counts for a contiguous shard of the sequences. If
+            None, compute the counts in the current process. Default is None.
+        n_shards : int
+            The number of shards to split the sequences into when `pool` is
+            not None. Default is 1.
 
         Returns
         -------
-        gamma : :py:class:`ndarray <numpy.ndarray>` of shape `(I, N, T)`
-            The estimated state-occupancy count matrix.
-        xi : :py:class:`ndarray <numpy.ndarray>` of shape `(I, N, N, T)`
-            The estimated state-state transition count matrix.
-        phi : :py:class:`ndarray <numpy.ndarray>` of shape `(I, N)`
-            The estimated prior counts for each latent state.
+        start : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The expected number of sequences starting in each latent state.
+        trans : :py:class:`ndarray <numpy.ndarray>` of shape `(N, N)`
+            The expected number of transitions between each pair of states.
+        emit : :py:class:`ndarray <numpy.ndarray>` of shape `(N, V)`
+            The expected number of emissions of each observation type by each
+            latent state.
+        log_likelihood : float
+            The total log likelihood of the sequences in `O` under the current
+            parameters.
         """
-        eps = self.eps
+        I, T = O.shape  # noqa: E741
+        if pool is not None:
+            params = (self.A, self.B, self.pi, self.eps, batch_size)
+            bounds = np.linspace(0, I, n_shards + 1).astype(int)
+            shards = [(s, e) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+            stats = pool.map(_estep_shard, [params + shard for shard in shards])
+        else:
+            # bound the size of the per-batch trellises
+            batch_size = max(1, min(batch_size, _MAX_TRELLIS // (T * self.N)))
+            stats = []
+            for i in range(0, I, batch_size):
+                batch = slice(i, i + batch_size)
+                stats.append(self._sufficient_statistics(O[batch], lengths[batch]))
+        return tuple(sum(s) for s in zip(*stats))
+
+    def _sufficient_statistics(self, O, lengths):
+        """
+        Compute the expected start, transition, and emission counts and the
+        total log likelihood for a batch of sequences. See :meth:`_Estep`.
+        """
+        log_A, log_B, _ = self._log_params()
+        log_likelihood, fwd = self._forward_batch(O, lengths, return_trellis=True)
+        bwd = self._backward_batch(O, lengths)
+        ll = log_likelihood[:, None]
 
-        gamma = np.zeros((self.I, self.N, self.T))
-        xi = np.zeros((self.I, self.N, self.N, self.T))
-        phi = np.zeros((self.I, self.N))
-
-        for i in range(self.I):
-            Obs = self.O[i, :]
-            fwd = self._forward(Obs)
-            bwd = self._backward(Obs)
-            log_likelihood = logsumexp(fwd[:, self.T - 1])
-
-            t = self.T - 1
-            for si in range(self.N):
-                gamma[i, si, t] = fwd[si, t] + bwd[si, t] - log_likelihood
-                phi[i, si] = fwd[si, 0] + bwd[si, 0] - log_likelihood
-
-            for t in range(self.T - 1):
-                ot1 = Obs[t + 1]
-                for si in range(self.N):
-                    gamma[i, si, t] = fwd[si, t] + bwd[si, t] - log_likelihood
-                    for sj in range(self.N):
-                        xi[i, si, sj, t] = (
-                            fwd[si, t]
-                            + np.log(self.A[si, sj] + eps)
-                            + np.log(self.B[sj, ot1] + eps)
-                            + bwd[sj, t + 1]
-                            - log_likelihood
-                        )
-
-        return gamma, xi, phi
-
-    def _Mstep(self, gamma, xi, phi):
+        T = O.shape[1]
+        valid = np.arange(T) < lengths[:, None]
+
+        # state occupancy probabilities for each (sequence, timestep) pair
+        ll_valid = np.broadcast_to(ll, valid.shape)[valid]
+        gamma = np.exp(fwd[valid] + bwd[valid] - ll_valid[:, None])
+        start = np.exp(fwd[:, 0] + bwd[:, 0] - ll).sum(axis=0)
+
+        emit = np.zeros((self.V, self.N))
+        np.add.at(emit, O[valid], gamma)
+
+        # sum xi over the (sequence, timestep) pairs for which the next
+        # observation is part of the same sequence. each term is split as
+        # exp(u[s]) * exp(w[s']) * A[s, s'], with u and w shifted by their
+        # max so the products can be accumulated in a single matmul
+        pairs = valid[:, 1:]
+        u = fwd[:, :-1][pairs]
+        w = log_B.T[O[:, 1:][pairs]] + bwd[:, 1:][pairs]
+        u_max = u.max(axis=1, keepdims=True)
+        w_max = w.max(axis=1, keepdims=True)
+        ll_pairs = np.broadcast_to(ll, pairs.shape)[pairs]
+        scale = np.exp(u_max + w_max - ll_pairs[:, None])
+        trans = np.exp(log_A) * ((np.exp(u - u_max) * scale).T @ np.exp(w - w_max))
+        return start, trans, emit.T, log_likelihood.sum()
+
+    def _Mstep(self, start, trans, emit):
         """
         Run a single M-step update for the Baum-Welch/Forward-Backward
-        algorithm.
+        algorithm by normalizing the expected counts from the E-step. Rows
+        of `A` and `B` for states with no expected transitions or emissions
+        are left unchanged.
 
         Parameters
         ----------
-        gamma : :py:class:`ndarray <numpy.ndarray>` of shape `(I, N, T)`
-            The estimated state-occupancy count matrix.
-        xi : :py:class:`ndarray <numpy.ndarray>` of shape `(I, N, N, T)`
-            The estimated state-state transition count matrix.
-        phi : :py:class:`ndarray <numpy.ndarray>` of shape `(I, N)`
-            The estimated starting count matrix for each latent state.
+        start : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The expected number of sequences starting in each latent state.
+        trans : :py:class:`ndarray <numpy.ndarray>` of shape `(N, N)`
+            The expected number of transitions between each pair of states.
+        emit : :py:class:`ndarray <numpy.ndarray>` of shape `(N, V)`
+            The expected number of emissions of each observation type by each
+            latent state.
 
         Returns
         -------
@@ -609,46 +929,37 @@ class MultinomialHMM:
         pi : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
             The estimated prior probabilities for each latent state.
         """
-        eps = self.eps
-
-        # initialize the estimated transition (A) and emission (B) matrices
-        A = np.zeros((self.N, self.N))
-        B = np.zeros((self.N, self.V))
-        pi = np.zeros(self.N)
+        pi = start / start.sum()
+        A = _normalize(trans, self.A)
+        B = _normalize(emit, self.B)
+        return A, B, pi
 
-        count_gamma = np.zeros((self.I, self.N, self.V))
-        count_xi = np.zeros((self.I, self.N, self.N))
 
-        for i in range(self.I):
-            Obs = self.O[i, :]
-            for si in range(self.N):
-                for vk in range(self.V):
-                    if not (Obs == vk).any():
-                        #  count_gamma[i, si, vk] = -np.inf
-                        count_gamma[i, si, vk] = np.log(eps)
-                    else:
-                        count_gamma[i, si, vk] = logsumexp(gamma[i, si, Obs == vk])
+#######################################################################
+#                          Parallel Workers                           #
+#######################################################################
 
-                for sj in range(self.N):
-                    count_xi[i, si, sj] = logsumexp(xi[i, si, sj, :])
+# data shared with each worker process when the pool is created, so that it
+# is not re-sent with every E-step
+_shared = {}
 
-        pi = logsumexp(phi, axis=0) - np.log(self.I + eps)
-        np.testing.assert_almost_equal(np.exp(pi).sum(), 1)
 
-        for si in range(self.N):
-            for vk in range(self.V):
-                B[si, vk] = logsumexp(count_gamma[:, si, vk]) - logsumexp(
-                    count_gamma[:, si, :]  # noqa: C812
-                )
+def _init_worker(shared):
+    _shared.clear()
+    _shared.update(shared)
 
-            for sj in range(self.N):
-                A[si, sj] = logsumexp(count_xi[:, si, sj]) - logsumexp(
-                    count_xi[:, si, :]  # noqa: C812
-                )
 
-            np.testing.assert_almost_equal(np.exp(A[si, :]).sum(), 1)
-            np.testing.assert_almost_equal(np.exp(B[si, :]).sum(), 1)
-        return np.exp(A), np.exp(B), np.exp(pi)
+def _estep_shard(args):
+    """
+    Compute the expected counts and log likelihood for the shared sequences
+    in rows `start` to `end` under the HMM with parameters `A`, `B`, `pi`.
+    """
+    A, B, pi, eps, batch_size, start, end = args
+    hmm = MultinomialHMM(eps=eps)
+    hmm.A, hmm.B, hmm.pi = A, B, pi
+    hmm.N, hmm.V = B.shape
+    O, lengths = _shared["O"][start:end], _shared["lengths"][start:end]  # noqa: E741
+    return hmm._Estep(O, lengths, batch_size)
 
 
 #######################################################################
@@ -656,12 +967,79 @@ class MultinomialHMM:
 #######################################################################
 
 
+def _pad(O, lengths=None):
+    """
+    Convert a single observation sequence, a (padded) array of sequences, or
+    a list of sequences into a padded integer array of shape `(I, T)` and an
+    array of sequence lengths. Also returns whether `O` is a single sequence.
+    """
+    if isinstance(O, (list, tuple)):
+        if lengths is not None:
+            raise ValueError("`lengths` is only valid when `O` is a padded array")
+        if len(O) == 0:
+            raise ValueError("`O` must contain at least one sequence")
+
+        lengths = np.array([len(o) for o in O])
+        if lengths.min() == 0:
+            raise ValueError("Observation sequences must be non-empty")
+
+        padded = np.zeros((len(O), lengths.max()), dtype=int)
+        for i, o in enumerate(O):
+            padded[i, : len(o)] = o
+        return padded, lengths, False
+
+    O = np.asarray(O)  # noqa: E741
+    single = O.ndim == 1 or O.shape[0] == 1
+    if O.ndim == 1:
+        O = O.reshape(1, -1)  # noqa: E741
+    if lengths is None:
+        lengths = np.full(O.shape[0], O.shape[1])
+
+    lengths = np.asarray(lengths)
+    if O.size == 0 or lengths.min() < 1:
+        raise ValueError("Observation sequences must be non-empty")
+    if lengths.shape != (O.shape[0],) or lengths.max() > O.shape[1]:
+        raise ValueError("`lengths` must give the length of each row of `O`")
+    return O, lengths, single
+
+
+def _normalize(counts, fallback):
+    """
+    Normalize each row of `counts` to sum to 1, using the corresponding row
+    of `fallback` for rows with no counts.
+    """
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.where(totals > 0, counts / np.where(totals > 0, totals, 1), fallback)
+
+
+def _max_product(log_probs, log_A, max_elements=2 ** 22):
+    """
+    Compute the max and argmax over `s'` of ``log_probs[i, s'] + log_A[s',
+    s]`` for each row `i` and state `s`, without materializing more than
+    `max_elements` entries at once.
+    """
+    I, N = log_probs.shape  # noqa: E741
+    best = np.empty((I, N))
+    back_pointer = np.empty((I, N), dtype=int)
+
+    # reduce over the last (contiguous) axis of seq_probs[i, s, s']
+    log_A_T = log_A.T
+    step = max(1, max_elements // max(I * N, 1))
+    for s in range(0, N, step):
+        seq_probs = log_probs[:, None, :] + log_A_T[None, s : s + step, :]
+        back_pointer[:, s : s + step] = seq_probs.argmax(axis=2)
+        best[:, s : s + step] = seq_probs.max(axis=2)
+    return best, back_pointer
+
+
 def logsumexp(log_probs, axis=None):
     """
     Redefine scipy.special.logsumexp
     see: http://bayesjumping.net/log-sum-exp-trick/
     """
-    _max = np.max(log_probs)
-    ds = log_probs - _max
-    exp_sum = np.exp(ds).sum(axis=axis)
+    log_probs = np.asarray(log_probs)
+    _max = np.max(log_probs, axis=axis, keepdims=True)
+    _max[~np.isfinite(_max)] = 0
+    exp_sum = np.exp(log_probs - _max).sum(axis=axis)
+    _max = np.squeeze(_max) if axis is None else np.squeeze(_max, axis=axis)
     return _max + np.log(exp_sum)
@@ -1,10 +1,12 @@
 import warnings
 import numpy as np
-from numpy.linalg import slogdet, inv
+from numpy.linalg import cholesky, LinAlgError
 
 try:
     _SCIPY = True
     from scipy.stats import norm
+    from scipy.linalg import solve_triangular
+    from scipy.optimize import minimize
 except:
     _SCIPY = False
     warnings.warn(
@@ -12,9 +14,41 @@ except:
         "for GPRegression are restricted to 95% bounds"
     )
 
+    def solve_triangular(a, b, trans=0, lower=False):
+        """Fallback for :func:`scipy.linalg.solve_triangular`"""
+        return np.linalg.solve(a.T if trans else a, b)
+
 from ..utils.kernels import KernelInitializer
 
 
+def _kernel_diag(kernel, X, chunk_size=512):
+    """
+    Compute the diagonal of ``kernel(X, X)`` without materializing the full
+    matrix.
+    """
+    diag = [
+        np.diag(kernel(X[i : i + chunk_size], X[i : i + chunk_size]))
+        for i in range(0, X.shape[0], chunk_size)
+    ]
+    return np.concatenate(diag)
+
+
+def _jittered_cholesky(cov, max_tries=8):
+    """
+    Compute the lower Cholesky factor of the positive semi-definite matrix
+    `cov`, adding progressively larger multiples of the identity to its
+    diagonal until the factorization succeeds.
+    """
+    scale = np.mean(np.diag(cov))
+    jitter = 1e-10 * (scale if scale > 0 else 1)
+    for _ in range(max_tries):
+        try:
+            return cholesky(cov + np.eye(cov.shape[0]) * jitter)
+        except LinAlgError:
+            jitter *= 10
+    raise LinAlgError("Covariance matrix is not positive semi-definite")
+
+
 class GPRegression:
     def __init__(self, kernel="RBFKernel", alpha=1e-10):
         """
@@ -38,13 +72,30 @@ class GPRegression:
             observed data points. Default is 1e-10.
         """
         self.kernel = KernelInitializer(kernel)()
-        self.parameters = {"GP_mean": None, "GP_cov": None, "X": None}
+        self.parameters = {
+            "GP_mean": None,
+            "GP_cov": None,
+            "GP_chol": None,
+            "K_inv_y": None,
+            "X": None,
+        }
         self.hyperparameters = {"kernel": str(self.kernel), "alpha": alpha}
 
-    def fit(self, X, y):
+    def fit(self, X, y, optimize=False, n_restarts=0, bounds=(1e-5, 1e5), seed=None):
         """
         Fit the GP prior to the training data.
 
+        Notes
+        -----
+        Fitting computes and caches the lower Cholesky factor `L` of
+        :math:`K + \\alpha I` along with :math:`(K + \\alpha I)^{-1} y`, which
+        are reused by :meth:`predict`, :meth:`marginal_log_likelihood`, and
+        :meth:`update` (see Algorithm 2.1 in Rasmussen & Williams (2006)).
+
+        If `optimize` is True, the kernel parameters and `alpha` are first set
+        to the values maximizing the marginal log likelihood of the training
+        data (see :meth:`_optimize_hyperparameters`).
+
         Parameters
         ----------
         X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
@@ -52,14 +103,192 @@ class GPRegression:
         y : :py:class:`ndarray <numpy.ndarray>` of shape `(N, O)`
             A collection of real-valued training targets for the
             examples in `X`, each with dimension `O`.
+        optimize : bool
+            Whether to fit the kernel parameters and `alpha` by maximizing the
+            marginal log likelihood using L-BFGS. Requires scipy and a kernel
+            implementing :meth:`~numpy_ml.utils.kernels.KernelBase.gradient`.
+            Default is False.
+        n_restarts : int
+            The number of additional optimization runs to perform from
+            starting points drawn log-uniformly from `bounds`. The run with
+            the highest marginal log likelihood is kept. Only used if
+            `optimize` is True. Default is 0.
+        bounds : tuple of (float, float)
+            The lower and upper bounds on each optimized hyperparameter. Only
+            used if `optimize` is True. Default is (1e-5, 1e5).
+        seed : int or None
+            Seed for the random restarts. Default is None.
         """
+        if optimize:
+            self._optimize_hyperparameters(X, y, n_restarts, bounds, seed)
+
         mu = np.zeros(X.shape[0])
         K = self.kernel(X, X)
+        L = cholesky(K + np.eye(K.shape[0]) * self.hyperparameters["alpha"])
 
         self.parameters["X"] = X
         self.parameters["y"] = y
         self.parameters["GP_cov"] = K
         self.parameters["GP_mean"] = mu
+        self.parameters["GP_chol"] = L
+        self.parameters["K_inv_y"] = self._chol_solve(L, y)
+
+    def _optimize_hyperparameters(self, X, y, n_restarts, bounds, seed):
+        """
+        Set the kernel parameters and `alpha` to the values maximizing the
+        marginal log likelihood of `y` given `X`.
+
+        Notes
+        -----
+        The optimization is performed over the log of each (strictly
+        positive) hyperparameter using the analytic gradient
+
+        .. math::
+
+            \\frac{\\partial}{\\partial \\theta_j} \\log p(y \\mid X, \\theta) =
+                \\frac{1}{2} \\text{tr} \\left(
+                    (a a^\\top - K_y^{-1}) \\frac{\\partial K_y}{\\partial \\theta_j}
+                \\right)
+
+        where :math:`K_y = K + \\alpha I` and :math:`a = K_y^{-1} y` (eq. 5.9
+        in Rasmussen & Williams (2006)). Each evaluation of the objective and
+        its gradient requires a single Cholesky factorization of :math:`K_y`.
+        Kernel parameters equal to 0 (e.g., the default `c0` for
+        :class:`~numpy_ml.utils.kernels.LinearKernel`) are held fixed.
+        """
+        if not _SCIPY:
+            raise ImportError("Optimizing GP hyperparameters requires scipy")
+
+        kernel = self.kernel
+        _, grads = kernel.gradient(X)
+
+        # collect the positive kernel parameters, flattening array-valued ones
+        names, sizes, theta0 = [], [], [np.log(self.hyperparameters["alpha"])]
+        for name, (value, _) in grads.items():
+            value = np.atleast_1d(np.asarray(value, dtype=float))
+            if np.all(value > 0):
+                names.append(name)
+                sizes.append(value.size)
+                theta0.extend(np.log(value))
+        log_bounds = np.log(bounds)
+        theta0 = np.clip(theta0, *log_bounds)
+
+        def unpack(theta):
+            vals = np.split(np.exp(theta[1:]), np.cumsum(sizes)[:-1])
+            return np.exp(theta[0]), dict(zip(names, vals))
+
+        def set_params(theta):
+            alpha, vals = unpack(theta)
+            for name, val in vals.items():
+                scalar = np.ndim(grads[name][0]) == 0
+                kernel.parameters[name] = float(val[0]) if scalar else val
+            return alpha
+
+        Y = y[:, np.newaxis] if y.ndim == 1 else y
+        N, n_outputs = Y.shape
+
+        def objective(theta):
+            alpha, vals = set_params(theta), unpack(theta)[1]
+            K, dK = kernel.gradient(X)
+            try:
+                L = cholesky(K + np.eye(N) * alpha)
+            except LinAlgError:
+                return np.inf, np.zeros_like(theta)
+
+            a = self._chol_solve(L, Y)
+            K_inv = self._chol_solve(L, np.eye(N))
+            mll = (
+                -0.5 * np.sum(Y * a)
+                - n_outputs * np.sum(np.log(np.diag(L)))
+                - n_outputs * N / 2 * np.log(2 * np.pi)
+            )
+
+            # W = a a^T - O K_y^{-1}, summed over the target dimensions
+            W = a @ a.T - n_outputs * K_inv
+            grad = [0.5 * np.trace(W) * alpha]
+            for name, val in vals.items():
+                dK_name = np.asarray(dK[name][1])
+                if dK_name.ndim == 2:
+                    grad.append(0.5 * np.sum(W * dK_name) * val[0])
+                else:
+                    grad.extend(0.5 * np.einsum("ij,cij->c", W, dK_name) * val)
+            return -mll, -np.array(grad)
+
+        rng = np.random.default_rng(seed)
+        starts = [theta0] + [
+            rng.uniform(*log_bounds, size=theta0.size) for _ in range(n_restarts)
+        ]
+
+        best = None
+        for theta in starts:
+            res = minimize(
+                objective,
+                theta,
+                jac=True,
+                method="L-BFGS-B",
+                bounds=[log_bounds] * theta0.size,
+            )
+            if np.isfinite(res.fun) and (best is None or res.fun < best.fun):
+                best = res
+
+        theta = theta0 if best is None else best.x
+        self.hyperparameters["alpha"] = set_params(theta)
+        self.hyperparameters["kernel"] = str(kernel)
+
+    def update(self, X_new, y_new):
+        """
+        Add new training examples to a fitted GP without refactorizing the
+        covariance matrix. If the GP has not been fit, this is equivalent to
+        calling :meth:`fit` on the new examples.
+
+        Notes
+        -----
+        If `L` is the Cholesky factor of the current (noisy) covariance matrix,
+        the factor of the covariance matrix extended with the new examples is
+
+        .. math::
+
+            \\begin{bmatrix} L & 0 \\\\ B^\\top & D \\end{bmatrix}
+
+        where :math:`B = L^{-1} K_{*}`, :math:`D = \\text{cholesky}(K_{**} +
+        \\alpha I - B^\\top B)`, :math:`K_{*} = \\text{kernel}(X, X_{new})`, and
+        :math:`K_{**} = \\text{kernel}(X_{new}, X_{new})`. Adding `k` examples to
+        a GP fit on `N` examples takes :math:`O(N^2 k)` time rather than the
+        :math:`O((N + k)^3)` needed to refit.
+
+        Parameters
+        ----------
+        X_new : :py:class:`ndarray <numpy.ndarray>` of shape `(k, M)`
+            The new training examples.
+        y_new : :py:class:`ndarray <numpy.ndarray>` of shape `(k, O)`
+            The training targets for the examples in `X_new`.
+        """
+        P = self.parameters
+        if P["GP_chol"] is None:
+            return self.fit(X_new, y_new)
+
+        X, y, K, L = P["X"], P["y"], P["GP_cov"], P["GP_chol"]
+        alpha = self.hyperparameters["alpha"]
+
+        K_star = self.kernel(X, X_new)
+        K_star_star = self.kernel(X_new, X_new)
+
+        B = solve_triangular(L, K_star, lower=True)
+        D = cholesky(K_star_star + np.eye(X_new.shape[0]) * alpha - B.T @ B)
+        L = np.block([[L, np.zeros_like(K_star)], [B.T, D]])
+
+        P["X"] = np.vstack([X, X_new])
+        P["y"] = np.concatenate([y, y_new])
+        P["GP_cov"] = np.block([[K, K_star], [K_star.T, K_star_star]])
+        P["GP_mean"] = np.zeros(P["X"].shape[0])
+        P["GP_chol"] = L
+        P["K_inv_y"] = self._chol_solve(L, P["y"])
+
+    @staticmethod
+    def _chol_solve(L, b):
+        """Solve :math:`L L^\\top x = b` for `x` given the lower triangular `L`"""
+        z = solve_triangular(L, b, lower=True)
+        return solve_triangular(L, z, trans=1, lower=True)
 
     def predict(self, X, conf_interval=0.95, return_cov=False):
         """
@@ -89,18 +318,16 @@ class GPRegression:
             K^*  &=  \\text{kernel}(X, X^*) \\\\
             K^{**}  &=  \\text{kernel}(X^*, X^*)
 
-        NB. This implementation uses the inefficient but general purpose
-        `np.linalg.inv` routine to invert :math:`(K + \\alpha I)`. A more
-        efficient way is to rely on the fact that `K` (and hence also :math:`K
-        + \\alpha I`) is symmetric positive (semi-)definite and take the inner
-        product of the inverse of its (lower) Cholesky decompositions:
+        Rather than inverting :math:`K + \\alpha I`, the mean and covariance
+        are computed from its cached Cholesky factor `L` using triangular
+        solves, following Algorithm 2.1 in Rasmussen & Williams (2006):
 
         .. math::
 
-            Q^{-1} = \\text{cholesky}(Q)^{-1 \\top} \\text{cholesky}(Q)^{-1}
+            \\mu^*  &=  K^* L^{-\\top} L^{-1} y \\\\
+            \\text{cov}^*  &=  K^{**} - V^\\top V
 
-        For more details on a production-grade implementation, see Algorithm
-        2.1 in Rasmussen & Williams (2006).
+        where :math:`V = L^{-1} K^{*\\top}`.
 
         Parameters
         ----------
@@ -133,24 +360,23 @@ class GPRegression:
 
         X_star = X
         X = self.parameters["X"]
-        y = self.parameters["y"]
-        K = self.parameters["GP_cov"]
-        alpha = self.hyperparameters["alpha"]
+        L = self.parameters["GP_chol"]
 
         K_star = self.kernel(X_star, X)
-        K_star_star = self.kernel(X_star, X_star)
-
-        sig = np.eye(K.shape[0]) * alpha
-        K_y_inv = inv(K + sig)
+        pp_mean = K_star @ self.parameters["K_inv_y"]
 
-        pp_mean = K_star @ K_y_inv @ y
-        pp_cov = K_star_star - K_star @ K_y_inv @ K_star.T
+        V = solve_triangular(L, K_star.T, lower=True)
+        if return_cov:
+            pp_cov = self.kernel(X_star, X_star) - V.T @ V
+            pp_var = np.diag(pp_cov)
+        else:
+            pp_var = _kernel_diag(self.kernel, X_star) - np.sum(V ** 2, axis=0)
 
         # if we can't use scipy, ignore the passed value for `conf_interval`
         # and return the 95% confidence bound.
         # (norm.ppf == inverse CDF for standard normal)
         percentile = 1.96 if not _SCIPY else norm.ppf(conf_interval)
-        conf = percentile * np.sqrt(np.diag(pp_cov))
+        conf = percentile * np.sqrt(np.maximum(pp_var, 0))
         return (pp_mean, conf) if not return_cov else (pp_mean, conf, pp_cov)
 
     def marginal_log_likelihood(self, kernel_params=None):
@@ -196,28 +422,31 @@ class GPRegression:
         y = self.parameters["y"]
         alpha = self.hyperparameters["alpha"]
 
-        K = self.parameters["GP_cov"]
+        L, K_inv_y = self.parameters["GP_chol"], self.parameters["K_inv_y"]
         if kernel_params is not None:
-            # create a new kernel with parameters `kernel_params` and recalc
+            # create a new kernel with parameters `kernel_params` and refactor
             # the GP covariance matrix
-            summary_dict = self.kernel.summary_dict()
+            summary_dict = self.kernel.summary()
+            summary_dict["parameters"] = dict(summary_dict["parameters"])
             summary_dict["parameters"].update(kernel_params)
             kernel = KernelInitializer(summary_dict)()
             K = kernel(X, X)
 
-        # add isotropic noise to kernel diagonal
-        K += np.eye(K.shape[0]) * alpha
+            # add isotropic noise to kernel diagonal
+            L = cholesky(K + np.eye(K.shape[0]) * alpha)
+            K_inv_y = self._chol_solve(L, y)
 
-        Kinv = inv(K)
-        Klogdet = -0.5 * slogdet(K)[1]
-        const = K.shape[0] / 2 * np.log(2 * np.pi)
+        # log det(K + alpha I) = 2 * sum(log(diag(L)))
+        Klogdet = -np.sum(np.log(np.diag(L)))
+        const = L.shape[0] / 2 * np.log(2 * np.pi)
 
         # handle both uni- and multidimensional target values
         if y.ndim == 1:
-            y = y[:, np.newaxis]
+            y, K_inv_y = y[:, np.newaxis], K_inv_y[:, np.newaxis]
 
         # sum over each dimension of y
-        marginal_ll = np.sum([Klogdet - 0.5 * _y.T @ Kinv @ _y - const for _y in y.T])
+        n_outputs = y.shape[1]
+        marginal_ll = n_outputs * (Klogdet - const) - 0.5 * np.sum(y * K_inv_y)
         return marginal_ll
 
     def sample(self, X, n_samples=1, dist="posterior_predictive"):
@@ -241,8 +470,6 @@ class GPRegression:
         samples : :py:class:`ndarray <numpy.ndarray>` of shape `(n_samples, O, N)`
             The generated samples for the points in `X`.
         """
-        mvnorm = np.random.multivariate_normal
-
         if dist == "prior":
             mu = np.zeros((X.shape[0], 1))
             cov = self.kernel(X, X)
@@ -254,5 +481,318 @@ class GPRegression:
         if mu.ndim == 1:
             mu = mu[:, np.newaxis]
 
-        samples = np.array([mvnorm(_mu, cov, size=n_samples) for _mu in mu.T])
-        return samples.swapaxes(0, 1)
+        # factor the covariance once and reuse it for every output dimension
+        C = _jittered_cholesky(cov)
+        Z = np.random.standard_normal((n_samples, mu.shape[1], X.shape[0]))
+        return mu.T[np.newaxis] + Z @ C.T
+
+
+def _kmeans_plus_plus(X, n_centers, rng=None):
+    """
+    Choose `n_centers` rows of `X` using the k-means++ seeding procedure.
+
+    Notes
+    -----
+    The first center is chosen uniformly at random. Each subsequent center is
+    chosen with probability proportional to the squared distance between a
+    point and its closest existing center, which spreads the centers out over
+    the data [1]_.
+
+    References
+    ----------
+    .. [1] Arthur, D., & Vassilvitskii, S. (2007). "k-means++: the advantages
+       of careful seeding". *Proceedings of the 18th Annual ACM-SIAM Symposium
+       on Discrete Algorithms*, 1027-1035.
+
+    Parameters
+    ----------
+    X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+        The data to choose centers from.
+    n_centers : int
+        The number of centers to choose.
+    rng : :py:class:`Generator <numpy.random.Generator>` or None
+        The random number generator to use. If None, use a new generator with
+        a random seed. Default is None.
+
+    Returns
+    -------
+    centers : :py:class:`ndarray <numpy.ndarray>` of shape `(n_centers,)`
+        The row indices in `X` of the chosen centers.
+    """
+    rng = np.random.default_rng(rng)
+    centers = [rng.integers(X.shape[0])]
+    closest = np.sum((X - X[centers[0]]) ** 2, axis=1)
+    for _ in range(n_centers - 1):
+        total = closest.sum()
+        if total > 0:
+            center = rng.choice(X.shape[0], p=closest / total)
+        else:
+            # every point coincides with a center already
+            center = rng.integers(X.shape[0])
+        centers.append(center)
+        closest = np.minimum(closest, np.sum((X - X[center]) ** 2, axis=1))
+    return np.array(centers)
+
+
+class SparseGPRegression:
+    def __init__(
+        self,
+        kernel="RBFKernel",
+        alpha=1e-10,
+        n_inducing=100,
+        inducing="kmeans++",
+        approximation="fitc",
+        chunk_size=4096,
+        seed=None,
+    ):
+        """
+        A sparse Gaussian Process (GP) regression model which summarizes the
+        training data with a small set of inducing points.
+
+        Notes
+        -----
+        Given `M` inducing points `Z`, the GP covariance matrix is replaced by
+        the low-rank (Nystrom) approximation
+
+        .. math::
+
+            K \\approx Q = K_{fu} K_{uu}^{-1} K_{uf}
+
+        where :math:`K_{fu} = \\text{kernel}(X, Z)` and :math:`K_{uu} =
+        \\text{kernel}(Z, Z)`. The noisy covariance of the training targets is
+        then :math:`Q + \\Lambda`, where
+
+        .. math::
+
+            \\Lambda = \\alpha I + \\text{diag}(K - Q)
+
+        for the fully independent training conditional (FITC) approximation
+        [1]_, and :math:`\\Lambda = \\alpha I` for the deterministic training
+        conditional (DTC) approximation, which uses the Nystrom approximation
+        alone [2]_. In both cases, fitting takes :math:`O(N M^2)` time and
+        predicting takes :math:`O(M^2)` time per point, compared to
+        :math:`O(N^3)` and :math:`O(N^2)` for
+        :class:`~numpy_ml.nonparametric.GPRegression`.
+
+        References
+        ----------
+        .. [1] Snelson, E., & Ghahramani, Z. (2006). "Sparse Gaussian processes
+           using pseudo-inputs". *Advances in Neural Information Processing
+           Systems, 18*, 1257-1264.
+        .. [2] Quiñonero-Candela, J., & Rasmussen, C. E. (2005). "A unifying
+           view of sparse approximate Gaussian process regression". *J. Mach.
+           Learn. Res., 6*, 1939-1959.
+
+        Parameters
+        ----------
+        kernel : str
+            The kernel to use in fitting the GP prior. Default is 'RBFKernel'.
+        alpha : float
+            An isotropic noise term for the diagonal in the GP covariance, `K`.
+            Default is 1e-10.
+        n_inducing : int
+            The number of inducing points, `M`. If larger than the number of
+            training examples, every training example is used. Default is 100.
+        inducing : {'kmeans++', 'random'}
+            How to choose the inducing points from the training data. 'kmeans++'
+            uses k-means++ seeding to spread them over the data, while 'random'
+            picks a random subset. Default is 'kmeans++'.
+        approximation : {'fitc', 'dtc'}
+            The sparse approximation to use. Default is 'fitc'.
+        chunk_size : int
+            The number of training examples to process at once during
+            :meth:`fit`, bounding the working memory at `O(M * chunk_size)`.
+            Default is 4096.
+        seed : int or None
+            Seed for the random number generator used to choose the inducing
+            points. Default is None.
+        """
+        if inducing not in ["kmeans++", "random"]:
+            raise ValueError("Unrecognized inducing: '{}'".format(inducing))
+        if approximation not in ["fitc", "dtc"]:
+            raise ValueError("Unrecognized approximation: '{}'".format(approximation))
+
+        self.rng = np.random.default_rng(seed)
+        self.kernel = KernelInitializer(kernel)()
+        self.parameters = {
+            "Z": None,
+            "L_uu": None,
+            "L_A": None,
+            "weights": None,
+            "mll": None,
+            "X": None,
+            "y": None,
+        }
+        self.hyperparameters = {
+            "kernel": str(self.kernel),
+            "alpha": alpha,
+            "n_inducing": n_inducing,
+            "inducing": inducing,
+            "approximation": approximation,
+            "chunk_size": chunk_size,
+        }
+
+    def fit(self, X, y):
+        """
+        Choose the inducing points and fit the sparse GP to the training data.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            A training dataset of `N` examples, each with dimensionality `M`.
+        y : :py:class:`ndarray <numpy.ndarray>` of shape `(N, O)`
+            A collection of real-valued training targets for the
+            examples in `X`, each with dimension `O`.
+        """
+        H = self.hyperparameters
+        n_inducing = min(H["n_inducing"], X.shape[0])
+        if H["inducing"] == "kmeans++":
+            Z = X[_kmeans_plus_plus(X, n_inducing, self.rng)]
+        else:
+            Z = X[self.rng.choice(X.shape[0], n_inducing, replace=False)]
+
+        self.parameters["X"] = X
+        self.parameters["y"] = y
+        self.parameters["Z"] = Z
+        self.parameters.update(self._factor(self.kernel, X, y, Z))
+
+    def _factor(self, kernel, X, y, Z):
+        """
+        Compute the Cholesky factors and weights of the sparse GP along with
+        the marginal log likelihood of the training targets, streaming over
+        the training examples in chunks.
+        """
+        H = self.hyperparameters
+        chunk_size = H["chunk_size"]
+        Y = y.reshape(X.shape[0], -1)
+        N, O = Y.shape
+
+        L_uu = _jittered_cholesky(kernel(Z, Z))
+
+        # accumulate A = I + V inv(Lambda) V^T and b = V inv(Lambda) y, where
+        # V = inv(L_uu) K_uf, one chunk of training examples at a time
+        A, b = np.eye(Z.shape[0]), np.zeros((Z.shape[0], O))
+        lam_logdet, y_lam_y = 0, 0
+        for start in range(0, N, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            X_chunk, Y_chunk = X[chunk], Y[chunk]
+            V = solve_triangular(L_uu, kernel(Z, X_chunk), lower=True)
+
+            lam = np.full(X_chunk.shape[0], H["alpha"], dtype=float)
+            if H["approximation"] == "fitc":
+                q_diag = np.sum(V ** 2, axis=0)
+                lam += np.maximum(_kernel_diag(kernel, X_chunk) - q_diag, 0)
+
+            V_lam = V / lam
+            A += V_lam @ V.T
+            b += V_lam @ Y_chunk
+            lam_logdet += np.sum(np.log(lam))
+            y_lam_y += np.sum(Y_chunk ** 2 / lam[:, None])
+
+        L_A = cholesky(A)
+        c = solve_triangular(L_A, b, lower=True)
+        weights = solve_triangular(L_A, c, trans=1, lower=True)
+        weights = solve_triangular(L_uu, weights, trans=1, lower=True)
+
+        # by the matrix determinant lemma and the Woodbury identity,
+        # log det(Q + Lambda) = log det(Lambda) + log det(A) and
+        # y^T inv(Q + Lambda) y = y^T inv(Lambda) y - c^T c
+        logdet = lam_logdet + 2 * np.sum(np.log(np.diag(L_A)))
+        quad = y_lam_y - np.sum(c ** 2)
+        mll = -0.5 * O * logdet - 0.5 * quad - O * N / 2 * np.log(2 * np.pi)
+
+        weights = weights if y.ndim > 1 else weights[:, 0]
+        return {"L_uu": L_uu, "L_A": L_A, "weights": weights, "mll": mll}
+
+    def predict(self, X, conf_interval=0.95, return_cov=False):
+        """
+        Return the MAP estimate for :math:`y^*`, corresponding the mean/mode of
+        the (approximate) posterior predictive distribution, :math:`p(y^* \\mid
+        x^*, X, y)`.
+
+        Notes
+        -----
+        Under the sparse approximation, the posterior predictive distribution
+        is :math:`\\mathcal{N}(\\mu^*, \\text{cov}^*)` where
+
+        .. math::
+
+            \\mu^*  &=  K_{*u} \\Sigma K_{uf} \\Lambda^{-1} y \\\\
+            \\text{cov}^*  &=  K_{**} - Q_{**} + K_{*u} \\Sigma K_{u*}
+
+        and :math:`\\Sigma = (K_{uu} + K_{uf} \\Lambda^{-1} K_{fu})^{-1}`.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape (N, M)
+            The collection of datapoints to generate predictions on
+        conf_interval : float in (0, 1)
+            The percentage confidence bound to return for each prediction. If
+            the scipy package is not available, this value is always set to
+            0.95. Default is 0.95.
+        return_cov : bool
+            If True, also return the covariance (`cov*`) of the posterior
+            predictive distribution for the points in `X`. Default is False.
+
+        Returns
+        -------
+        y_pred : :py:class:`ndarray <numpy.ndarray>` of shape `(N, O)`
+            The predicted values for each point in `X`, each with
+            dimensionality `O`.
+        conf : :py:class:`ndarray <numpy.ndarray>` of shape `(N, O)`
+            The % conf_interval confidence bound for each `y_pred`. The conf %
+            confidence interval for the `i`'th prediction is ``[y[i] - conf[i],
+            y[i] + conf[i]]``.
+        cov : :py:class:`ndarray <numpy.ndarray>` of shape `(N, N)`
+            The covariance (`cov*`) of the posterior predictive distribution for
+            `X`. Only returned if `return_cov` is True.
+        """
+        if conf_interval != 0.95 and not _SCIPY:
+            fstr = "Cannot compute {}% confidence score without scipy.stats"
+            warnings.warn(fstr.format(conf_interval))
+
+        P = self.parameters
+        K_su = self.kernel(X, P["Z"])
+        pp_mean = K_su @ P["weights"]
+
+        V = solve_triangular(P["L_uu"], K_su.T, lower=True)
+        W = solve_triangular(P["L_A"], V, lower=True)
+        if return_cov:
+            pp_cov = self.kernel(X, X) - V.T @ V + W.T @ W
+            pp_var = np.diag(pp_cov)
+        else:
+            pp_var = _kernel_diag(self.kernel, X) - np.sum(V ** 2, axis=0)
+            pp_var += np.sum(W ** 2, axis=0)
+
+        percentile = 1.96 if not _SCIPY else norm.ppf(conf_interval)
+        conf = percentile * np.sqrt(np.maximum(pp_var, 0))
+        return (pp_mean, conf) if not return_cov else (pp_mean, conf, pp_cov)
+
+    def marginal_log_likelihood(self, kernel_params=None):
+        """
+        Compute the log of the (approximate) marginal likelihood,
+        :math:`\\log \\mathcal{N}(y \\mid 0, Q + \\Lambda)`.
+
+        Parameters
+        ----------
+        kernel_params : dict
+            Parameters for the kernel function. If None, calculate the
+            marginal likelihood under the kernel parameters defined at model
+            initialization. Default is None.
+
+        Returns
+        -------
+        marginal_log_likelihood : float
+            The approximate log likelihood of the training targets given the
+            kernel parameterized by `kernel_params`, the inducing points, and
+            the training inputs, marginalized over all functions `f`.
+        """
+        P = self.parameters
+        if kernel_params is None:
+            return P["mll"]
+
+        summary_dict = self.kernel.summary()
+        summary_dict["parameters"] = dict(summary_dict["parameters"])
+        summary_dict["parameters"].update(kernel_params)
+        kernel = KernelInitializer(summary_dict)()
+        return self._factor(kernel, P["X"], P["y"], P["Z"])["mll"]
@@ -1,8 +1,21 @@
-from ..utils.kernels import KernelInitializer
+import numpy as np
+
+from ..utils.kernels import KernelInitializer, RBFKernel
+from ..utils.data_structures import BallTree
 
 
 class KernelRegression:
-    def __init__(self, kernel=None):
+    def __init__(
+        self,
+        kernel=None,
+        approximate=False,
+        atol=0,
+        rtol=1e-6,
+        leaf_size=40,
+        truncate=None,
+        chunk_size=None,
+        max_memory=None,
+    ):
         """
         A Nadaraya-Watson kernel regression model.
 
@@ -32,9 +45,60 @@ class KernelRegression:
         kernel : str, :doc:`Kernel <numpy_ml.utils.kernels>` object, or dict
             The kernel to use. If None, default to
             :class:`~numpy_ml.utils.kernels.LinearKernel`. Default is None.
+        approximate : bool
+            Whether to index the training data with a
+            :class:`~numpy_ml.utils.data_structures.BallTree` and approximate
+            the numerator and denominator of the regression using
+            :meth:`~numpy_ml.utils.data_structures.BallTree.kernel_density`
+            rather than computing the full `(N, N')` kernel matrix. Requires an
+            :class:`~numpy_ml.utils.kernels.RBFKernel` with a scalar `sigma`.
+            Default is False.
+        atol : float
+            The absolute error tolerance for the approximate kernel sums. Only
+            used if `approximate` is True. Default is 0.
+        rtol : float
+            The relative error tolerance for the approximate kernel sums. Only
+            used if `approximate` is True. Default is 1e-6.
+        leaf_size : int
+            The maximum number of datapoints at each leaf of the ball tree.
+            Only used if `approximate` is True or `truncate` is not None.
+            Default is 40.
+        truncate : float or None
+            If not None, treat the kernel as zero for training points more
+            than `truncate` * `sigma` away from a query, and find the
+            remaining points with
+            :meth:`~numpy_ml.utils.data_structures.BallTree.query_radius`.
+            Queries with no training points within this distance are
+            predicted as NaN. Requires an
+            :class:`~numpy_ml.utils.kernels.RBFKernel` with a scalar `sigma`.
+            Default is None.
+        chunk_size : int or None
+            The number of rows of `X` to generate predictions for at once,
+            so that the full kernel matrix between the training data and `X`
+            is never materialized. If None, use `max_memory` to choose the
+            chunk size. Default is None.
+        max_memory : int or None
+            A bound, in bytes, on the size of the `(N, chunk_size)` float64
+            kernel block for each chunk. Only used if `chunk_size` is None.
+            This bounds the kernel matrix alone: the temporaries created while
+            evaluating the kernel (e.g., the pairwise distances for an
+            :class:`~numpy_ml.utils.kernels.RBFKernel`) take additional memory
+            on the order of a few kernel blocks. If both `chunk_size` and
+            `max_memory` are None, predict on all rows of `X` at once. Default
+            is None.
         """
+        self._ball_tree = None
         self.parameters = {"X": None, "y": None}
-        self.hyperparameters = {"kernel": str(kernel)}
+        self.hyperparameters = {
+            "kernel": str(kernel),
+            "approximate": approximate,
+            "atol": atol,
+            "rtol": rtol,
+            "leaf_size": leaf_size,
+            "truncate": truncate,
+            "chunk_size": chunk_size,
+            "max_memory": max_memory,
+        }
         self.kernel = KernelInitializer(kernel)()
 
     def fit(self, X, y):
@@ -48,7 +112,11 @@ class KernelRegression:
         y : :py:class:`ndarray <numpy.ndarray>` of shape `(N, ...)`
             Predicted targets for the `N` rows in `X`
         """
+        H = self.hyperparameters
         self.parameters = {"X": X, "y": y}
+        if H["approximate"] or H["truncate"] is not None:
+            self._ball_tree = BallTree(leaf_size=H["leaf_size"])
+            self._ball_tree.fit(X)
 
     def predict(self, X):
         """
@@ -64,7 +132,82 @@ class KernelRegression:
         y : :py:class:`ndarray <numpy.ndarray>` of shape `(N', ...)`
             Predicted targets for the `N'` rows in `X`
         """
-        K = self.kernel
-        P = self.parameters
-        sim = K(P["X"], X)
-        return (sim * P["y"][:, None]).sum(axis=0) / sim.sum(axis=0)
+        P, H = self.parameters, self.hyperparameters
+        if H["approximate"]:
+            return self._predict_approximate(X)
+
+        y = P["y"]
+        Y = y.reshape(len(y), -1)
+        preds = np.zeros((X.shape[0], Y.shape[1]))
+
+        # compute the numerator and denominator of the regression one chunk
+        # of queries at a time so only a single kernel block is in memory
+        chunk_size = self._chunk_size(X.shape[0])
+        for start in range(0, X.shape[0], chunk_size):
+            X_chunk = X[start : start + chunk_size]
+            if H["truncate"] is not None:
+                num, den = self._truncated_sums(X_chunk, Y)
+            else:
+                sim = self.kernel(P["X"], X_chunk)
+                num, den = sim.T @ Y, sim.sum(axis=0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                preds[start : start + chunk_size] = num / den[:, None]
+        return preds.reshape((X.shape[0],) + y.shape[1:])
+
+    def _chunk_size(self, n_queries):
+        """
+        The number of queries to generate predictions for at once. Under
+        `max_memory`, only the float64 kernel block is counted.
+        """
+        H = self.hyperparameters
+        if H["chunk_size"] is not None:
+            return H["chunk_size"]
+        if H["max_memory"] is not None:
+            bytes_per_query = 8 * self.parameters["X"].shape[0]
+            return max(1, H["max_memory"] // bytes_per_query)
+        return max(1, n_queries)
+
+    def _rbf_sigma(self):
+        """The scalar bandwidth of the RBF kernel, for the tree-based modes"""
+        if self.kernel.hyperparameters["id"] != "RBFKernel":
+            raise ValueError("Tree-based kernel regression requires an RBFKernel")
+
+        sigma = self.kernel.parameters["sigma"]
+        sigma = np.sqrt(self.parameters["X"].shape[1] / 2) if sigma is None else sigma
+        if np.ndim(sigma) != 0:
+            raise ValueError("Tree-based kernel regression requires a scalar sigma")
+        return sigma
+
+    def _truncated_sums(self, X, Y):
+        """
+        Compute the numerator and denominator of the regression for each row
+        of `X` using only the training points within `truncate` * `sigma`.
+        """
+        sigma = self._rbf_sigma()
+        radius = self.hyperparameters["truncate"] * sigma
+        ixs, dists = self._ball_tree.query_radius(X, radius, return_distance=True)
+
+        counts = np.array([len(i) for i in ixs])
+        ixs, dists = np.concatenate(ixs).astype(int), np.concatenate(dists)
+        rows = np.repeat(np.arange(X.shape[0]), counts)
+
+        # the RBF kernel between two points depends only on their distance
+        sim = RBFKernel(sigma=sigma)(np.zeros((1, 1)), dists[:, None])[0]
+        den = np.bincount(rows, weights=sim, minlength=X.shape[0])
+        num = np.zeros((X.shape[0], Y.shape[1]))
+        np.add.at(num, rows, sim[:, None] * Y[ixs])
+        return num, den
+
+    def _predict_approximate(self, X):
+        """
+        Compute the numerator and denominator of the regression for each row
+        of `X` as weighted kernel density estimates over the ball tree.
+        """
+        P, H = self.parameters, self.hyperparameters
+        y = P["y"]
+        weights = np.column_stack([np.ones(len(y)), y.reshape(len(y), -1)])
+        sums = self._ball_tree.kernel_density(
+            X, kernel=self.kernel, atol=H["atol"], rtol=H["rtol"], weights=weights
+        )
+        preds = sums[:, 1:] / sums[:, :1]
+        return preds.reshape((X.shape[0],) + y.shape[1:])
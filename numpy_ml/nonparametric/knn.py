@@ -1,18 +1,25 @@
 """A k-Nearest Neighbors (KNN) model for both classiciation and regression."""
-from collections import Counter
-
 import numpy as np
 
-from ..utils.data_structures import BallTree
+from ..utils.data_structures import BallTree, RandomProjectionForest
 
 
 class KNN:
     def __init__(
-        self, k=5, leaf_size=40, classifier=True, metric=None, weights="uniform",
+        self,
+        k=5,
+        leaf_size=40,
+        classifier=True,
+        metric=None,
+        weights="uniform",
+        index="ball_tree",
+        n_trees=10,
+        ef=None,
+        seed=None,
     ):
         """
-        A `k`-nearest neighbors (kNN) model relying on a ball tree for efficient
-        computation.
+        A `k`-nearest neighbors (kNN) model relying on a ball tree or an
+        approximate nearest neighbor index for efficient computation.
 
         Parameters
         ----------
@@ -33,8 +40,34 @@ class KNN:
             assigns uniform weights to each neighbor, while 'distance' assigns
             weights proportional to the inverse of the distance from the query
             point. Default is 'uniform'.
+        index : {'ball_tree', 'ann'}
+            The index used to find the nearest neighbors of each query.
+            'ball_tree' finds the exact neighbors using a
+            :class:`~numpy_ml.utils.data_structures.BallTree`, while 'ann'
+            finds approximate neighbors using a
+            :class:`~numpy_ml.utils.data_structures.RandomProjectionForest`,
+            which is much faster for high-dimensional data. Default is
+            'ball_tree'.
+        n_trees : int
+            The number of trees in the forest. Only used if `index` is 'ann'.
+            Default is 10.
+        ef : int or None
+            The number of forest leaves to search for each query. Only used
+            if `index` is 'ann'. If None, search one leaf per tree. Default
+            is None.
+        seed : int or None
+            Seed for the forest's random hyperplanes. Only used if `index` is
+            'ann'. Default is None.
         """
-        self._ball_tree = BallTree(leaf_size=leaf_size, metric=metric)
+        if index == "ball_tree":
+            self._index = BallTree(leaf_size=leaf_size, metric=metric)
+        elif index == "ann":
+            self._index = RandomProjectionForest(
+                n_trees=n_trees, leaf_size=leaf_size, metric=metric, seed=seed
+            )
+        else:
+            raise ValueError("Unrecognized index: '{}'".format(index))
+
         self.hyperparameters = {
             "id": "KNN",
             "k": k,
@@ -42,6 +75,10 @@ class KNN:
             "classifier": classifier,
             "metric": str(metric),
             "weights": weights,
+            "index": index,
+            "n_trees": n_trees,
+            "ef": ef,
+            "seed": seed,
         }
 
     def fit(self, X, y):
@@ -57,7 +94,11 @@ class KNN:
         """
         if X.ndim != 2:
             raise Exception("X must be two-dimensional")
-        self._ball_tree.fit(X, y)
+        if self.hyperparameters["k"] > X.shape[0]:
+            fstr = "k = {} exceeds the number of training examples ({})"
+            raise ValueError(fstr.format(self.hyperparameters["k"], X.shape[0]))
+        self._index.fit(X, y)
+        self._y = y
 
     def predict(self, X):
         r"""
@@ -73,29 +114,34 @@ class KNN:
         y : numpy array of shape `(N', *)`
             Predicted targets for the `N'` rows in `X`.
         """
-        predictions = []
         H = self.hyperparameters
-        for x in X:
-            pred = None
-            nearest = self._ball_tree.nearest_neighbors(H["k"], x)
-            targets = [n.val for n in nearest]
+        if H["k"] > len(self._y):
+            fstr = "k = {} exceeds the number of training examples ({})"
+            raise ValueError(fstr.format(H["k"], len(self._y)))
+
+        if H["index"] == "ann":
+            dists, ixs = self._index.query(X, H["k"], ef=H["ef"])
+        else:
+            dists, ixs = self._index.query(X, H["k"])
+
+        if H["weights"] == "uniform":
+            weights = np.ones_like(dists)
+        elif H["weights"] == "distance":
+            # for consistency with sklearn, a query which coincides with one or
+            # more training points is assigned to those points alone
+            with np.errstate(divide="ignore"):
+                weights = 1 / dists
+            exact = np.isinf(weights)
+            has_exact = exact.any(axis=1)
+            weights[has_exact] = exact[has_exact]
+        weights /= weights.sum(axis=1, keepdims=True)
 
-            if H["classifier"]:
-                if H["weights"] == "uniform":
-                    # for consistency with sklearn / scipy.stats.mode, return
-                    # the smallest class ID in the event of a tie
-                    counts = Counter(targets).most_common()
-                    pred, _ = sorted(counts, key=lambda x: (-x[1], x[0]))[0]
-                elif H["weights"] == "distance":
-                    best_score = -np.inf
-                    for label in set(targets):
-                        scores = [1 / n.distance for n in nearest if n.val == label]
-                        pred = label if np.sum(scores) > best_score else pred
-            else:
-                if H["weights"] == "uniform":
-                    pred = np.mean(targets)
-                elif H["weights"] == "distance":
-                    weights = [1 / n.distance for n in nearest]
-                    pred = np.average(targets, weights=weights)
-            predictions.append(pred)
-        return np.array(predictions)
+        if H["classifier"]:
+            # for consistency with sklearn / scipy.stats.mode, return the
+            # smallest class ID in the event of a tie
+            classes, labels = np.unique(self._y, return_inverse=True)
+            labels = labels.reshape(self._y.shape)[ixs]
+            scores = np.zeros((X.shape[0], len(classes)))
+            np.add.at(scores, (np.arange(X.shape[0])[:, None], labels), weights)
+            return classes[scores.argmax(axis=1)]
+        return np.einsum("nk,nk...->n...", weights, self._y[ixs])
@@ -0,0 +1,92 @@
+# flake8: noqa
+import numpy as np
+
+from scipy.stats import multivariate_normal
+
+from numpy_ml.gmm import GMM
+from numpy_ml.gmm.gmm import _log_gaussian_pdf_chol
+
+
+def random_covariance(d):
+    W = np.random.randn(d, d)
+    return W @ W.T + d * np.eye(d)
+
+
+def test_log_gaussian_pdf(N=10):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        n_ex = np.random.randint(1, 100)
+        d = np.random.randint(1, 10)
+        X = np.random.randn(n_ex, d)
+        mu = np.random.randn(d)
+        sigma = random_covariance(d)
+
+        L = np.linalg.cholesky(sigma)
+        gold = multivariate_normal(mu, sigma).logpdf(X).reshape(-1)
+        np.testing.assert_allclose(_log_gaussian_pdf_chol(X, mu, L), gold)
+        np.testing.assert_allclose(_log_gaussian_pdf_chol(X[0], mu, L), gold[0])
+
+        print("PASSED")
+        i += 1
+
+
+def test_gmm_em_step(N=10):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        n_ex = np.random.randint(2, 100)
+        d = np.random.randint(1, 5)
+        C = np.random.randint(1, 5)
+
+        gmm = GMM(C=C)
+        gmm.X = np.random.randn(n_ex, d)
+        gmm.N, gmm.d = gmm.X.shape
+        gmm._initialize_params()
+        gmm.mu = np.random.randn(C, d)
+        gmm.sigma = np.array([random_covariance(d) for _ in range(C)])
+        X, pi, mu, sigma = gmm.X, gmm.pi, gmm.mu, gmm.sigma
+
+        # E-step, one example and component at a time
+        gold_Q = np.zeros((n_ex, C))
+        for n in range(n_ex):
+            for c in range(C):
+                pdf = multivariate_normal(mu[c], sigma[c]).pdf(X[n])
+                gold_Q[n, c] = pi[c] * pdf
+            gold_Q[n] /= gold_Q[n].sum()
+
+        gmm._E_step()
+        np.testing.assert_allclose(gmm.Q, gold_Q)
+
+        # M-step
+        gold_pi = gold_Q.sum(axis=0) / n_ex
+        gold_mu = np.zeros((C, d))
+        gold_sigma = np.zeros((C, d, d))
+        for c in range(C):
+            n_c = gold_Q[:, c].sum()
+            gold_mu[c] = sum(gold_Q[n, c] * X[n] for n in range(n_ex)) / n_c
+            for n in range(n_ex):
+                diff = X[n] - gold_mu[c]
+                gold_sigma[c] += gold_Q[n, c] * np.outer(diff, diff) / n_c
+
+        gmm._M_step()
+        np.testing.assert_allclose(gmm.pi, gold_pi)
+        np.testing.assert_allclose(gmm.mu, gold_mu, atol=1e-10)
+        np.testing.assert_allclose(gmm.sigma, gold_sigma, atol=1e-10)
+
+        # the lower bound must use the densities under the updated
+        # parameters, not those cached during the E-step
+        eps = np.finfo(float).eps
+        gold_vlb = 0
+        for n in range(n_ex):
+            for c in range(C):
+                log_pdf = multivariate_normal(gold_mu[c], gold_sigma[c]).logpdf(X[n])
+                q = gold_Q[n, c]
+                gold_vlb += q * (log_pdf + np.log(gold_pi[c] + eps))
+                gold_vlb -= q * np.log(q + eps)
+        np.testing.assert_allclose(gmm.likelihood_lower_bound(), gold_vlb)
+
+        print("PASSED")
+        i += 1
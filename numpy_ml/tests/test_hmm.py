@@ -0,0 +1,187 @@
+# flake8: noqa
+from itertools import product
+
+import numpy as np
+
+from scipy.special import logsumexp
+
+from numpy_ml.hmm import MultinomialHMM
+
+
+def random_hmm(n_states, n_obs):
+    A = np.random.rand(n_states, n_states)
+    B = np.random.rand(n_states, n_obs)
+    pi = np.random.rand(n_states)
+    return A / A.sum(axis=1, keepdims=True), B / B.sum(axis=1, keepdims=True), pi / pi.sum()
+
+
+def brute_force_paths(hmm, obs):
+    """
+    Enumerate every latent state sequence for `obs`, returning the sequences
+    and the log joint probability of each with `obs` under `hmm`.
+    """
+    log_A, log_B, log_pi = hmm._log_params()
+    paths = np.array(list(product(range(hmm.N), repeat=len(obs))))
+    log_probs = log_pi[paths[:, 0]] + log_B[paths, obs].sum(axis=1)
+    log_probs += log_A[paths[:, :-1], paths[:, 1:]].sum(axis=1)
+    return paths, log_probs
+
+
+def test_hmm_log_likelihood_decode(N=10):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        n_states = np.random.randint(1, 4)
+        n_obs = np.random.randint(1, 5)
+        n_seqs = np.random.randint(1, 10)
+        hmm = MultinomialHMM(*random_hmm(n_states, n_obs))
+
+        lengths = np.random.randint(1, 7, size=n_seqs)
+        seqs = [np.random.randint(0, n_obs, size=l) for l in lengths]
+
+        gold_ll, gold_path_probs, path_log_probs = [], [], []
+        for obs in seqs:
+            paths, log_probs = brute_force_paths(hmm, obs)
+            gold_ll.append(logsumexp(log_probs))
+            gold_path_probs.append(log_probs.max())
+            path_log_probs.append(dict(zip(map(tuple, paths), log_probs)))
+
+        # sequences of varying length, either as a list or a padded array
+        padded = np.zeros((n_seqs, lengths.max()), dtype=int)
+        for j, obs in enumerate(seqs):
+            padded[j, : len(obs)] = obs
+
+        batch_size = np.random.randint(1, n_seqs + 1)
+        for O, L in [(seqs, None), (padded, lengths)]:
+            ll = hmm.log_likelihood(O, lengths=L, batch_size=batch_size)
+            np.testing.assert_allclose(ll, gold_ll, atol=1e-10)
+
+            # a padded array with a single row is treated as a single sequence
+            paths, path_probs = hmm.decode(O, lengths=L, batch_size=batch_size)
+            if L is not None and n_seqs == 1:
+                paths = [paths]
+            np.testing.assert_allclose(path_probs, gold_path_probs, atol=1e-10)
+
+            # ties between paths may be broken either way, so check that each
+            # decoded path achieves the maximum probability
+            for path, log_probs, gold in zip(paths, path_log_probs, gold_path_probs):
+                np.testing.assert_allclose(log_probs[tuple(path)], gold, atol=1e-10)
+
+        # a single sequence returns scalars
+        ll = hmm.log_likelihood(seqs[0])
+        path, path_prob = hmm.decode(seqs[0])
+        np.testing.assert_allclose(ll, gold_ll[0], atol=1e-10)
+        np.testing.assert_allclose(path_prob, gold_path_probs[0], atol=1e-10)
+        np.testing.assert_allclose(
+            path_log_probs[0][tuple(path)], gold_path_probs[0], atol=1e-10
+        )
+
+        print("PASSED")
+        i += 1
+
+
+def test_hmm_fit(N=5):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        n_states = np.random.randint(1, 4)
+        n_obs = np.random.randint(1, 5)
+        n_seqs = np.random.randint(1, 10)
+        hmm = MultinomialHMM(*random_hmm(n_states, n_obs))
+
+        lengths = np.random.randint(1, 7, size=n_seqs)
+        seqs = [np.random.randint(0, n_obs, size=l) for l in lengths]
+        padded = np.zeros((n_seqs, lengths.max()), dtype=int)
+        for j, obs in enumerate(seqs):
+            padded[j, : len(obs)] = obs
+
+        # expected counts, weighting the counts along every latent state
+        # sequence by its posterior probability
+        gold_start = np.zeros(n_states)
+        gold_trans = np.zeros((n_states, n_states))
+        gold_emit = np.zeros((n_states, n_obs))
+        gold_ll = 0
+        for obs in seqs:
+            paths, log_probs = brute_force_paths(hmm, obs)
+            ll = logsumexp(log_probs)
+            post = np.exp(log_probs - ll)[:, None]
+            np.add.at(gold_start, paths[:, 0], post[:, 0])
+            np.add.at(gold_trans, (paths[:, :-1], paths[:, 1:]), post)
+            np.add.at(gold_emit, (paths, obs), post)
+            gold_ll += ll
+
+        batch_size = np.random.randint(1, n_seqs + 1)
+        start, trans, emit, ll = hmm._Estep(padded, lengths, batch_size)
+        np.testing.assert_allclose(start, gold_start, atol=1e-10)
+        np.testing.assert_allclose(trans, gold_trans, atol=1e-10)
+        np.testing.assert_allclose(emit, gold_emit, atol=1e-10)
+        np.testing.assert_allclose(ll, gold_ll, atol=1e-10)
+
+        # fitting on a list of sequences with a pool of workers should match
+        # fitting serially on the padded array
+        latent_states, obs_types = list(range(n_states)), list(range(n_obs))
+
+        np.random.seed(i)
+        serial = MultinomialHMM()
+        serial.fit(padded, latent_states, obs_types, lengths=lengths, tol=1e-3)
+
+        np.random.seed(i)
+        parallel = MultinomialHMM()
+        parallel.fit(seqs, latent_states, obs_types, tol=1e-3, n_jobs=2)
+
+        np.testing.assert_allclose(parallel.A, serial.A, atol=1e-10)
+        np.testing.assert_allclose(parallel.B, serial.B, atol=1e-10)
+        np.testing.assert_allclose(parallel.pi, serial.pi, atol=1e-10)
+
+        print("PASSED")
+        i += 1
+
+
+def sample_sequences(A, B, pi, n_seqs, n_steps):
+    """Draw `n_seqs` observation sequences of length `n_steps` from an HMM"""
+    states = np.zeros((n_seqs, n_steps), dtype=int)
+    states[:, 0] = (np.random.rand(n_seqs, 1) < np.cumsum(pi)).argmax(axis=1)
+    for t in range(1, n_steps):
+        cdf = np.cumsum(A[states[:, t - 1]], axis=1)
+        states[:, t] = (np.random.rand(n_seqs, 1) < cdf).argmax(axis=1)
+    cdf = np.cumsum(B[states], axis=2)
+    return (np.random.rand(n_seqs, n_steps, 1) < cdf).argmax(axis=2)
+
+
+def test_hmm_fit_online(N=3):
+    np.random.seed(12345)
+
+    A = np.array([[0.9, 0.1], [0.2, 0.8]])
+    B = np.array([[0.8, 0.1, 0.1], [0.1, 0.1, 0.8]])
+    pi = np.array([0.7, 0.3])
+
+    i = 0
+    while i < N:
+        O = sample_sequences(A, B, pi, 4000, 30)
+        minibatch_size = 10
+
+        # learn from a stream over the first half of the sequences, then keep
+        # the model up to date with the second half
+        hmm = MultinomialHMM()
+        hmm.fit_online(
+            (o for o in O[:2000]), [0, 1], [0, 1, 2], minibatch_size=minibatch_size
+        )
+        for j in range(2000, 4000, minibatch_size):
+            hmm.partial_fit(O[j : j + minibatch_size])
+            np.testing.assert_allclose(hmm.A.sum(axis=1), 1)
+            np.testing.assert_allclose(hmm.B.sum(axis=1), 1)
+            np.testing.assert_allclose(hmm.pi.sum(), 1)
+
+        # the learned states may be a permutation of the true ones
+        perm = [0, 1] if hmm.B[0, 0] > hmm.B[1, 0] else [1, 0]
+        np.testing.assert_allclose(hmm.A[np.ix_(perm, perm)], A, atol=0.05)
+        np.testing.assert_allclose(hmm.B[perm], B, atol=0.05)
+
+        # each sequence carries a single observation of its starting state,
+        # so the prior is estimated from far fewer examples
+        np.testing.assert_allclose(hmm.pi[perm], pi, atol=0.1)
+
+        print("PASSED")
+        i += 1
@@ -3,10 +3,13 @@ import numpy as np
 
 from sklearn.neighbors import KNeighborsRegressor, KNeighborsClassifier
 from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, WhiteKernel
 
 from numpy_ml.nonparametric.knn import KNN
-from numpy_ml.nonparametric.gp import GPRegression
+from numpy_ml.nonparametric.gp import GPRegression, SparseGPRegression
+from numpy_ml.nonparametric.kernel_regression import KernelRegression
 from numpy_ml.utils.distance_metrics import euclidean
+from numpy_ml.utils.kernels import RBFKernel
 
 
 def test_knn_regression(N=15):
@@ -57,7 +60,7 @@ def test_knn_clf(N=15):
         k = np.random.randint(1, N)
         n_classes = np.random.randint(2, 10)
         ls = np.min([np.random.randint(1, 10), N - 1])
-        weights = "uniform"
+        weights = np.random.choice(["uniform", "distance"])
 
         X = np.random.rand(N, M)
         X_test = np.random.rand(N, M)
@@ -84,6 +87,93 @@ def test_knn_clf(N=15):
         i += 1
 
 
+def test_knn_ann(N=15):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        N = np.random.randint(2, 100)
+        M = np.random.randint(2, 100)
+        k = np.random.randint(1, N)
+        classifier = np.random.choice([True, False])
+        weights = np.random.choice(["uniform", "distance"])
+
+        X = np.random.rand(N, M)
+        X_test = np.random.rand(N, M)
+        y = np.random.randint(0, 5, size=N) if classifier else np.random.rand(N)
+
+        # when every point fits in a single leaf, the forest search is exact
+        ann = KNN(k=k, leaf_size=N, classifier=classifier, weights=weights, index="ann")
+        exact = KNN(k=k, classifier=classifier, weights=weights)
+        ann.fit(X, y)
+        exact.fit(X, y)
+        np.testing.assert_almost_equal(ann.predict(X_test), exact.predict(X_test))
+
+        # asking for more neighbors than there are training examples is an error
+        try:
+            KNN(k=N + 1, index=np.random.choice(["ball_tree", "ann"])).fit(X, y)
+            assert False, "expected a ValueError for k > N"
+        except ValueError:
+            pass
+        print("PASSED")
+        i += 1
+
+
+def test_kernel_regression_approximate(N=5):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        N = np.random.randint(2, 1000)
+        M = np.random.randint(1, 5)
+        sigma = np.random.uniform(0.05, 1)
+        X = np.random.rand(N, M)
+        X_test = np.random.rand(np.random.randint(1, 100), M)
+        y = np.random.rand(N)
+
+        kernel = "RBFKernel(sigma={})".format(sigma)
+        exact = KernelRegression(kernel=kernel)
+        approx = KernelRegression(kernel=kernel, approximate=True, rtol=1e-8)
+        exact.fit(X, y)
+        approx.fit(X, y)
+
+        np.testing.assert_allclose(approx.predict(X_test), exact.predict(X_test), rtol=1e-6)
+        print("PASSED")
+        i += 1
+
+
+def test_kernel_regression_chunked(N=5):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        N = np.random.randint(2, 500)
+        M = np.random.randint(1, 5)
+        sigma = np.random.uniform(0.05, 1)
+        X = np.random.rand(N, M)
+        X_test = np.random.rand(np.random.randint(1, 100), M)
+        y = np.random.rand(N, np.random.randint(1, 3))
+
+        kernel = "RBFKernel(sigma={})".format(sigma)
+        exact = KernelRegression(kernel=kernel)
+        chunked = KernelRegression(kernel=kernel, chunk_size=np.random.randint(1, 20))
+        budget = KernelRegression(kernel=kernel, max_memory=8 * N * 7)
+        truncated = KernelRegression(kernel=kernel, truncate=40)
+        for model in [exact, chunked, budget, truncated]:
+            model.fit(X, y)
+
+        gold = exact.predict(X_test)
+        sim = RBFKernel(sigma=sigma)(X, X_test)
+        np.testing.assert_allclose(gold, (sim.T @ y) / sim.sum(axis=0)[:, None])
+        np.testing.assert_allclose(chunked.predict(X_test), gold)
+        np.testing.assert_allclose(budget.predict(X_test), gold)
+
+        # with a cutoff of 40 standard deviations, no contribution is dropped
+        np.testing.assert_allclose(truncated.predict(X_test), gold)
+        print("PASSED")
+        i += 1
+
+
 def test_gp_regression(N=15):
     np.random.seed(12345)
 
@@ -117,3 +207,132 @@ def test_gp_regression(N=15):
 
         print("PASSED")
         i += 1
+
+
+def test_gp_optimize(N=5):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        N = np.random.randint(10, 100)
+        M = np.random.randint(1, 4)
+        J = np.random.randint(1, 3)
+        alpha = np.random.uniform(0.1, 1)
+        sigma = np.random.uniform(0.5, 2, size=M)
+
+        X = np.random.rand(N, M)
+        y = np.sin(6 * X[:, :1]) + 0.1 * np.random.randn(N, J)
+
+        gp = GPRegression(kernel=RBFKernel(sigma=sigma.copy()), alpha=alpha)
+        gp.fit(X, y)
+        init_mll = gp.marginal_log_likelihood()
+        gp.fit(X, y, optimize=True)
+
+        # noise is learned by sklearn through a WhiteKernel term
+        gold = GaussianProcessRegressor(
+            kernel=RBF(sigma) + WhiteKernel(alpha), alpha=0, normalize_y=False
+        )
+        gold.fit(X, y)
+
+        mll = gp.marginal_log_likelihood()
+        assert mll >= init_mll
+        np.testing.assert_allclose(mll, gold.log_marginal_likelihood_value_, rtol=1e-4)
+        print("PASSED")
+        i += 1
+
+
+def test_gp_update(N=15):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        alpha = np.random.rand()
+        N = np.random.randint(3, 100)
+        M = np.random.randint(2, 100)
+        J = np.random.randint(1, 3)
+        n_first = np.random.randint(1, N - 1)
+
+        X = np.random.rand(N, M)
+        y = np.random.rand(N, J)
+        X_test = np.random.rand(np.random.randint(1, N), M)
+
+        gp = GPRegression(kernel="RBFKernel(sigma=1)", alpha=alpha)
+        gp.fit(X, y)
+
+        # adding examples one block at a time should match refitting
+        gp_online = GPRegression(kernel="RBFKernel(sigma=1)", alpha=alpha)
+        gp_online.fit(X[:n_first], y[:n_first])
+        gp_online.update(X[n_first:], y[n_first:])
+
+        preds, conf, cov = gp.predict(X_test, return_cov=True)
+        preds_online, conf_online = gp_online.predict(X_test)
+        np.testing.assert_almost_equal(preds, preds_online)
+        np.testing.assert_almost_equal(conf, conf_online)
+
+        K = gp.kernel(X, X) + alpha * np.eye(N)
+        K_star = gp.kernel(X_test, X)
+        gold_cov = gp.kernel(X_test, X_test) - K_star @ np.linalg.inv(K) @ K_star.T
+        np.testing.assert_almost_equal(cov, gold_cov)
+
+        mll = gp_online.marginal_log_likelihood()
+        gold_mll = sum(
+            -0.5 * np.linalg.slogdet(K)[1]
+            - 0.5 * _y @ np.linalg.inv(K) @ _y
+            - N / 2 * np.log(2 * np.pi)
+            for _y in y.T
+        )
+        np.testing.assert_almost_equal(mll, gold_mll)
+
+        # updating a GP that has not been fit is the same as fitting it
+        gp_new = GPRegression(kernel="RBFKernel(sigma=1)", alpha=alpha)
+        gp_new.update(X, y)
+        np.testing.assert_almost_equal(gp_new.predict(X_test)[0], preds)
+
+        print("PASSED")
+        i += 1
+
+
+def test_sparse_gp_regression(N=15):
+    np.random.seed(12345)
+
+    i = 0
+    while i < N:
+        alpha = np.random.uniform(0.1, 1)
+        N = np.random.randint(2, 100)
+        M = np.random.randint(2, 10)
+        J = np.random.randint(1, 3)
+        approximation = np.random.choice(["fitc", "dtc"])
+
+        X = np.random.rand(N, M)
+        y = np.random.rand(N, J)
+        X_test = np.random.rand(np.random.randint(1, N + 1), M)
+
+        gp = GPRegression(kernel="RBFKernel(sigma=1)", alpha=alpha)
+        gp.fit(X, y)
+
+        # when every training example is an inducing point, the sparse GP is
+        # exact
+        sparse = SparseGPRegression(
+            kernel="RBFKernel(sigma=1)",
+            alpha=alpha,
+            n_inducing=N,
+            inducing=np.random.choice(["kmeans++", "random"]),
+            approximation=approximation,
+            chunk_size=np.random.randint(1, 20),
+            seed=i,
+        )
+        sparse.fit(X, y)
+
+        np.testing.assert_array_equal(
+            np.sort(sparse.parameters["Z"], axis=0), np.sort(X, axis=0)
+        )
+        for mine, gold in zip(
+            sparse.predict(X_test, return_cov=True), gp.predict(X_test, return_cov=True)
+        ):
+            np.testing.assert_almost_equal(mine, gold, decimal=5)
+
+        np.testing.assert_almost_equal(
+            sparse.marginal_log_likelihood(), gp.marginal_log_likelihood(), decimal=5
+        )
+        print("PASSED")
+        i += 1
@@ -1,4 +1,9 @@
 # flake8: noqa
+import os
+import tempfile
+import tracemalloc
+import warnings
+
 import numpy as np
 
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
@@ -8,7 +13,14 @@ from sklearn.datasets import make_regression, make_blobs
 from sklearn.model_selection import train_test_split
 
 from numpy_ml.trees.gbdt import GradientBoostedDecisionTree
-from numpy_ml.trees.dt import DecisionTree, Node, Leaf
+from numpy_ml.trees.dt import (
+    DecisionTree,
+    FlatTree,
+    Node,
+    Leaf,
+    bin_features,
+    partition,
+)
 from numpy_ml.trees.rf import RandomForest
 from numpy_ml.utils.testing import random_tensor
 
@@ -67,6 +79,210 @@ def compare_trees(mine, gold):
             raise ValueError("Nodes at depth {} are not equal".format(depth))
 
 
+def traverse(tree, x, node, prob=False):
+    """Predict the target for a single example `x` by recursing from `node`"""
+    if isinstance(node, Leaf):
+        if tree.classifier:
+            return node.value if prob else node.value.argmax()
+        return node.value
+    if np.isnan(x[node.feature]):
+        go_left = node.missing_left
+    else:
+        go_left = x[node.feature] <= node.threshold
+    return traverse(tree, x, node.left if go_left else node.right, prob)
+
+
+def mse(y):
+    """
+    Mean squared error for decision tree (ie., mean) predictions
+    """
+    return np.mean((y - np.mean(y)) ** 2)
+
+
+def entropy(y):
+    """
+    Entropy of a label sequence
+    """
+    hist = np.bincount(y)
+    ps = hist / np.sum(hist)
+    return -np.sum([p * np.log2(p) for p in ps if p > 0])
+
+
+def gini(y):
+    """
+    Gini impurity (local entropy) of a label sequence
+    """
+    hist = np.bincount(y)
+    N = np.sum(hist)
+    return 1 - sum([(i / N) ** 2 for i in hist])
+
+
+def impurity_gain(criterion, Y, split_thresh, feat_values):
+    """
+    Compute the impurity gain associated with a given split directly from the
+    labels on either side.
+
+    IG(split) = loss(parent) - weighted_avg[loss(left_child), loss(right_child)]
+    """
+    loss = {"entropy": entropy, "gini": gini, "mse": mse}[criterion]
+    parent_loss = loss(Y)
+
+    # generate split
+    left = np.argwhere(feat_values <= split_thresh).flatten()
+    right = np.argwhere(feat_values > split_thresh).flatten()
+
+    if len(left) == 0 or len(right) == 0:
+        return 0
+
+    # compute the weighted avg. of the loss for the children
+    n = len(Y)
+    n_l, n_r = len(left), len(right)
+    e_l, e_r = loss(Y[left]), loss(Y[right])
+    child_loss = (n_l / n) * e_l + (n_r / n) * e_r
+
+    # impurity gain is difference in loss before vs. after split
+    return parent_loss - child_loss
+
+
+def test_DecisionTree_segment(N=10):
+    np.random.seed(12345)
+
+    def brute_force_segment(tree, X, Y, feat_idxs):
+        best_gain = -np.inf
+        split_idx, split_thresh = None, None
+        for i in feat_idxs:
+            levels = np.unique(X[:, i])
+            thresholds = (levels[:-1] + levels[1:]) / 2 if len(levels) > 1 else levels
+            gains = np.array(
+                [impurity_gain(tree.criterion, Y, t, X[:, i]) for t in thresholds]
+            )
+            if gains.max() > best_gain:
+                split_idx = i
+                best_gain = gains.max()
+                split_thresh = thresholds[gains.argmax()]
+        return split_idx, split_thresh
+
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(2, 100)
+        n_feats = np.random.randint(1, 10)
+
+        # use a small number of levels per feature to exercise ties
+        X = np.random.randint(0, 10, size=(n_ex, n_feats)).astype(float)
+
+        classifier = np.random.choice([True, False])
+        if classifier:
+            Y = np.random.randint(0, np.random.randint(2, 5), size=n_ex)
+            criterion = np.random.choice(["entropy", "gini"])
+        else:
+            Y = np.random.randn(n_ex)
+            criterion = "mse"
+
+        tree = DecisionTree(classifier=classifier, criterion=criterion)
+        tree.n_classes = max(Y) + 1 if classifier else None
+
+        feat_idxs = np.arange(n_feats)
+        mine = tree._segment(X, Y, feat_idxs)
+        gold = brute_force_segment(tree, X, Y, feat_idxs)
+
+        # ties between features may be broken differently due to rounding, so
+        # compare the gain achieved by each split
+        gain_mine = impurity_gain(criterion, Y, mine[1], X[:, mine[0]])
+        gain_gold = impurity_gain(criterion, Y, gold[1], X[:, gold[0]])
+        np.testing.assert_almost_equal(gain_mine, gain_gold)
+        print("PASSED")
+        i += 1
+
+
+def test_DecisionTree_binned(N=10):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(2, 100)
+        n_feats = np.random.randint(1, 10)
+        X = np.random.randint(0, 20, size=(n_ex, n_feats)).astype(float)
+
+        # codes should preserve the ordering of the thresholds. code 0 is
+        # reserved for missing values
+        max_bins = np.random.randint(2, 30)
+        X_binned, bin_edges = bin_features(X, max_bins)
+        assert X_binned.min() >= 1
+        for j, edges in enumerate(bin_edges):
+            assert len(edges) < max_bins - 1
+            for b, e in enumerate(edges):
+                np.testing.assert_array_equal(X_binned[:, j] <= b + 1, X[:, j] <= e)
+
+        classifier = np.random.choice([True, False])
+        if classifier:
+            Y = np.random.randint(0, np.random.randint(2, 5), size=n_ex)
+            criterion = np.random.choice(["entropy", "gini"])
+        else:
+            Y = np.random.randn(n_ex)
+            criterion = "mse"
+
+        # with at least as many bins as unique values, the best binned split
+        # should be as good as the best exact split
+        exact = DecisionTree(classifier=classifier, criterion=criterion, max_depth=1)
+        binned = DecisionTree(
+            classifier=classifier, criterion=criterion, max_depth=1, max_bins=256
+        )
+        exact.fit(X, Y)
+        binned.fit(X, Y)
+
+        if classifier:
+            loss_exact = accuracy_score(exact.predict(X), Y)
+            loss_binned = accuracy_score(binned.predict(X), Y)
+        else:
+            loss_exact = mean_squared_error(exact.predict(X), Y)
+            loss_binned = mean_squared_error(binned.predict(X), Y)
+
+        np.testing.assert_almost_equal(loss_exact, loss_binned)
+        print("PASSED")
+        i += 1
+
+
+def test_DecisionTree_flat(N=10):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(2, 100)
+        n_feats = np.random.randint(1, 10)
+        max_depth = np.random.randint(1, 8)
+        X = np.random.randn(n_ex, n_feats)
+        X_test = np.random.randn(n_ex, n_feats)
+
+        classifier = np.random.choice([True, False])
+        if classifier:
+            Y = np.random.randint(0, np.random.randint(2, 5), size=n_ex)
+            criterion = np.random.choice(["entropy", "gini"])
+        else:
+            Y = np.random.randn(n_ex)
+            criterion = "mse"
+
+        tree = DecisionTree(
+            classifier=classifier, criterion=criterion, max_depth=max_depth
+        )
+        tree.fit(X, Y)
+
+        # vectorized predictions should match a recursive traversal
+        gold = np.array([traverse(tree, x, tree.root) for x in X_test])
+        np.testing.assert_allclose(tree.predict(X_test), gold)
+        if classifier:
+            gold = np.array([traverse(tree, x, tree.root, prob=True) for x in X_test])
+            np.testing.assert_allclose(tree.predict_class_probs(X_test), gold)
+
+        # the flat arrays should round-trip through disk
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fpath = os.path.join(tmpdir, "tree.npz")
+            tree.flat.save(fpath)
+            flat = FlatTree.load(fpath)
+
+        np.testing.assert_array_equal(flat.apply(X_test), tree.apply(X_test))
+        np.testing.assert_allclose(flat.value, tree.flat.value)
+        print("PASSED")
+        i += 1
+
+
 def test_DecisionTree(N=1):
     i = 1
     np.random.seed(12345)
@@ -252,6 +468,90 @@ def test_RandomForest(N=1):
         i += 1
 
 
+def test_RandomForest_n_jobs(N=2):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(10, 100)
+        n_feats = np.random.randint(2, 10)
+        n_trees = np.random.randint(2, 10)
+        X = np.random.randn(n_ex, n_feats)
+        Y = np.random.randint(0, 3, size=n_ex)
+
+        # forests fit with the same master seed should be identical regardless
+        # of the number of processes used
+        preds = []
+        for n_jobs in [1, 2]:
+            rf = RandomForest(
+                n_trees=n_trees,
+                max_depth=4,
+                n_feats=n_feats // 2 + 1,
+                n_jobs=n_jobs,
+                seed=i,
+            )
+            rf.fit(X, Y)
+            preds.append(np.array([t.predict(X) for t in rf.trees]))
+            np.testing.assert_array_equal(rf.predict(X), rf._vote(preds[-1]))
+
+        np.testing.assert_array_equal(preds[0], preds[1])
+        print("PASSED")
+        i += 1
+
+
+def test_RandomForest_oob(N=2):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(100, 200)
+        n_feats = np.random.randint(2, 10)
+        X = np.random.randn(n_ex, n_feats)
+
+        # only the first feature is informative
+        classifier = np.random.choice([True, False])
+        if classifier:
+            Y = (X[:, 0] > 0).astype(int)
+            criterion = "gini"
+        else:
+            Y = 3 * X[:, 0]
+            criterion = "mse"
+
+        rf = RandomForest(
+            n_trees=20,
+            max_depth=4,
+            n_feats=n_feats,
+            classifier=classifier,
+            criterion=criterion,
+            oob_score=True,
+            seed=i,
+        )
+        rf.fit(X, Y)
+
+        np.testing.assert_almost_equal(rf.feature_importances.sum(), 1)
+        assert rf.feature_importances.argmax() == 0
+        assert rf.permutation_importances.argmax() == 0
+        assert rf.oob_error < (0.2 if classifier else 0.2 * np.var(Y))
+
+        # with two examples, a single tree's bootstrap sample may contain both
+        X, Y = np.random.randn(2, n_feats), np.array([0, 1])
+        n_missing = 0
+        for seed in range(10):
+            rf = RandomForest(1, 2, n_feats, oob_score=True, seed=seed)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                rf.fit(X, Y)
+            if rf.oob_error is None:
+                assert rf.permutation_importances is None
+                assert len(caught) == 1
+                n_missing += 1
+            else:
+                assert np.isfinite(rf.oob_error)
+                assert np.all(np.isfinite(rf.permutation_importances))
+                assert len(caught) == 0
+        assert 0 < n_missing < 10
+        print("PASSED")
+        i += 1
+
+
 def test_gbdt(N=1):
     np.random.seed(12345)
     i = 1
@@ -353,3 +653,243 @@ def test_gbdt(N=1):
 
         print("PASSED")
         i += 1
+
+
+def test_gbdt_early_stopping(N=2):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(50, 100)
+        n_feats = np.random.randint(2, 10)
+        n_iter = np.random.randint(5, 20)
+        X = np.random.randn(n_ex, n_feats)
+        X_val = np.random.randn(n_ex, n_feats)
+        Y = X[:, 0] + np.random.randn(n_ex)
+        Y_val = X_val[:, 0] + np.random.randn(n_ex)
+
+        gbdt = GradientBoostedDecisionTree(
+            n_iter=n_iter, max_depth=3, classifier=False, loss="mse"
+        )
+        gbdt.fit(X, Y, X_val, Y_val, early_stopping_rounds=2)
+
+        best = gbdt.best_iteration
+        assert len(gbdt.learners) == best + 1
+        assert np.argmin(gbdt.val_losses) == best
+
+        # staged predictions should match predictions with `n_iter_limit`
+        staged = list(gbdt.staged_predict(X_val))
+        assert len(staged) == best + 1
+        for j, preds in enumerate(staged):
+            np.testing.assert_allclose(preds, gbdt.predict(X_val, n_iter_limit=j + 1))
+        np.testing.assert_allclose(staged[-1], gbdt.predict(X_val))
+        print("PASSED")
+        i += 1
+
+
+def test_gbdt_subsample(N=2):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(50, 100)
+        n_feats = np.random.randint(2, 10)
+        X = np.random.randn(n_ex, n_feats)
+        Y = (X[:, 0] > 0).astype(int)
+
+        preds = []
+        for _ in range(2):
+            gbdt = GradientBoostedDecisionTree(
+                n_iter=10,
+                max_depth=3,
+                learning_rate=0.5,
+                subsample=0.5,
+                colsample=0.5,
+                seed=i,
+            )
+            gbdt.fit(X, Y)
+            preds.append(gbdt.predict(X))
+
+        # fits with the same seed should be identical
+        np.testing.assert_array_equal(preds[0], preds[1])
+        assert accuracy_score(Y, preds[0]) > 0.8
+        print("PASSED")
+        i += 1
+
+
+def test_DecisionTree_multi_output(N=5):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(2, 100)
+        n_feats = np.random.randint(1, 10)
+        n_out = np.random.randint(1, 5)
+        max_depth = np.random.randint(1, 5)
+        X = np.random.randn(n_ex, n_feats)
+        y = np.random.randn(n_ex)
+
+        # a multi-output tree on `n_out` copies of y should match a
+        # single-output tree on y
+        single = DecisionTree(classifier=False, criterion="mse", max_depth=max_depth)
+        multi = DecisionTree(classifier=False, criterion="mse", max_depth=max_depth)
+        single.fit(X, y)
+        multi.fit(X, np.tile(y[:, None], (1, n_out)))
+
+        preds = multi.predict(X)
+        assert preds.shape == (n_ex, n_out)
+        for k in range(n_out):
+            np.testing.assert_allclose(preds[:, k], single.predict(X))
+        print("PASSED")
+        i += 1
+
+
+def test_gbdt_multi_output(N=2):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(50, 100)
+        n_feats = np.random.randint(2, 10)
+        n_classes = np.random.randint(2, 5)
+        X, Y = make_blobs(
+            n_samples=n_ex, centers=n_classes, n_features=n_feats, random_state=i
+        )
+
+        gbdt = GradientBoostedDecisionTree(
+            n_iter=5, max_depth=3, learning_rate=0.5, multi_output=True
+        )
+        gbdt.fit(X, Y)
+
+        # one tree should be shared across all classes on each iteration
+        for learners in gbdt.learners[1:]:
+            assert all(t is learners[0] for t in learners)
+            assert learners[0].flat.value.shape[1] == n_classes
+
+        assert accuracy_score(Y, gbdt.predict(X)) > 0.8
+        print("PASSED")
+        i += 1
+
+
+def test_DecisionTree_idxs(N=5):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(2, 100)
+        n_feats = np.random.randint(1, 10)
+        max_depth = np.random.randint(1, 8)
+        X = np.random.randn(n_ex, n_feats)
+        Y = np.random.randint(0, 3, size=n_ex)
+        idxs = np.random.choice(n_ex, n_ex, replace=True)
+        max_bins = np.random.choice([None, 16])
+
+        # fitting on (repeated) row indices should grow the same tree as
+        # fitting on a copy of the selected rows
+        on_idxs = DecisionTree(max_depth=max_depth, seed=i, max_bins=max_bins)
+        on_copy = DecisionTree(max_depth=max_depth, seed=i, max_bins=max_bins)
+        if max_bins is None:
+            leaves_idxs = on_idxs._fit(X, Y, idxs)
+            leaves_copy = on_copy._fit(X[idxs], Y[idxs])
+        else:
+            X_binned, bin_edges = bin_features(X, max_bins)
+            leaves_idxs = on_idxs._fit_binned(X_binned, bin_edges, Y, idxs)
+            leaves_copy = on_copy._fit_binned(X_binned[idxs], bin_edges, Y[idxs])
+
+        np.testing.assert_array_equal(on_idxs.flat.feature, on_copy.flat.feature)
+        np.testing.assert_allclose(on_idxs.flat.threshold, on_copy.flat.threshold)
+        np.testing.assert_allclose(on_idxs.predict(X), on_copy.predict(X))
+        np.testing.assert_array_equal(leaves_idxs[idxs], leaves_copy)
+
+        # the leaf assignments returned while fitting should match the tree
+        np.testing.assert_array_equal(leaves_copy, on_copy.apply(X[idxs]))
+        print("PASSED")
+        i += 1
+
+
+def test_DecisionTree_partition(N=5):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(1, 100)
+        idxs = np.random.randint(0, 100, size=n_ex)
+        is_left = np.random.rand(n_ex) < 0.5
+        gold = np.concatenate([idxs[is_left], idxs[~is_left]])
+        gold_n_left = is_left.sum()
+
+        # partitioning a segment should stably reorder it in place, leaving
+        # the entries outside the segment untouched
+        buf = np.concatenate([[-1], idxs, [-1]])
+        seg = buf[1:-1]
+        scratch = np.empty(n_ex + np.random.randint(0, 10), dtype=idxs.dtype)
+        n_left = partition(seg, is_left, scratch)
+        assert n_left == gold_n_left
+        np.testing.assert_array_equal(seg, gold)
+        np.testing.assert_array_equal(buf[[0, -1]], [-1, -1])
+
+        # growing a tree should not copy the rows of `X` at any node: the
+        # working memory is a few columns' worth, far less than `X` itself
+        X = np.random.randn(5000, 400)
+        Y = np.random.randint(0, 3, size=5000)
+        tree = DecisionTree(max_depth=3, seed=i)
+        tracemalloc.start()
+        tree._fit(X, Y)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert peak < X.nbytes / 4
+        print("PASSED")
+        i += 1
+
+
+def test_DecisionTree_no_split(N=5):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(2, 100)
+        n_feats = np.random.randint(1, 10)
+        max_depth = np.random.choice([None, np.random.randint(1, 10)])
+        max_bins = np.random.choice([None, 16])
+        classifier = np.random.choice([True, False])
+
+        # when every feature is constant, no split separates the examples
+        X = np.tile(np.random.rand(1, n_feats), (n_ex, 1))
+        Y = np.random.randint(0, 3, n_ex) if classifier else np.random.randn(n_ex)
+        Y[:2] = [0, 1]
+
+        criterion = "entropy" if classifier else "mse"
+        tree = DecisionTree(
+            classifier=classifier,
+            criterion=criterion,
+            max_depth=max_depth,
+            max_bins=max_bins,
+        )
+        tree.fit(X, Y)
+
+        assert tree.depth == 0
+        assert isinstance(tree.root, Leaf)
+        print("PASSED")
+        i += 1
+
+
+def test_DecisionTree_missing(N=5):
+    np.random.seed(12345)
+    i = 1
+    while i <= N:
+        n_ex = np.random.randint(10, 100)
+        n_feats = np.random.randint(1, 10)
+        X = np.random.randn(n_ex, n_feats)
+        Y = np.random.randint(0, 2, size=n_ex)
+
+        # the class is determined by whether the first feature is missing
+        X[np.random.rand(n_ex, n_feats) < 0.3] = np.nan
+        X[:, 0] = np.where(Y == 1, np.nan, np.random.randn(n_ex))
+
+        for max_bins in [None, 16]:
+            tree = DecisionTree(max_depth=1, criterion="gini", max_bins=max_bins)
+            tree.fit(X, Y)
+            assert tree.root.feature == 0
+            np.testing.assert_array_equal(tree.predict(X), Y)
+
+            # missing values should follow the learned default direction
+            # through both the recursive and the vectorized traversals
+            X_test = np.random.randn(n_ex, n_feats)
+            X_test[np.random.rand(n_ex, n_feats) < 0.3] = np.nan
+            gold = np.array([traverse(tree, x, tree.root) for x in X_test])
+            np.testing.assert_array_equal(tree.predict(X_test), gold)
+        print("PASSED")
+        i += 1
@@ -1,8 +1,12 @@
 # flake8: noqa
+import tempfile
+from functools import partial
+
 import numpy as np
 
 import scipy
 import networkx as nx
+from scipy.spatial.distance import cdist
 
 from sklearn.neighbors import BallTree as sk_BallTree
 from sklearn.metrics.pairwise import rbf_kernel as sk_rbf
@@ -10,9 +14,16 @@ from sklearn.metrics.pairwise import linear_kernel as sk_linear
 from sklearn.metrics.pairwise import polynomial_kernel as sk_poly
 
 
-from numpy_ml.utils.distance_metrics import euclidean
+from numpy_ml.utils.distance_metrics import (
+    euclidean,
+    manhattan,
+    chebyshev,
+    minkowski,
+    hamming,
+    pairwise,
+)
 from numpy_ml.utils.kernels import LinearKernel, PolynomialKernel, RBFKernel
-from numpy_ml.utils.data_structures import BallTree
+from numpy_ml.utils.data_structures import BallTree, RandomProjectionForest
 from numpy_ml.utils.graphs import (
     DiGraph,
     UndirectedGraph,
@@ -91,6 +102,45 @@ def test_radial_basis_kernel(N=1):
         i += 1
 
 
+def test_kernel_gradient(N=5):
+    np.random.seed(12345)
+    i = 0
+    while i < N:
+        N = np.random.randint(1, 50)
+        C = np.random.randint(1, 10)
+        X = np.random.rand(N, C)
+
+        kernels = [
+            LinearKernel(c0=np.random.rand()),
+            PolynomialKernel(
+                gamma=np.random.rand(), d=np.random.randint(1, 5), c0=np.random.rand()
+            ),
+            RBFKernel(sigma=np.random.uniform(0.5, 2)),
+            RBFKernel(sigma=np.random.uniform(0.5, 2, size=C)),
+        ]
+
+        # compare the analytic gradients to central finite differences
+        eps = 1e-6
+        for kernel in kernels:
+            K, grads = kernel.gradient(X)
+            np.testing.assert_almost_equal(K, kernel(X, X))
+            for name, (value, dK) in grads.items():
+                value = np.asarray(value, dtype=float)
+                dK = dK.reshape(value.size, N, N)
+                for j in range(value.size):
+                    step = np.zeros(value.size)
+                    step[j] = eps
+                    kernel.parameters[name] = (value.ravel() + step).reshape(value.shape)
+                    K_plus = kernel(X, X)
+                    kernel.parameters[name] = (value.ravel() - step).reshape(value.shape)
+                    K_minus = kernel(X, X)
+                    kernel.parameters[name] = value
+                    fd = (K_plus - K_minus) / (2 * eps)
+                    np.testing.assert_allclose(dK[j], fd, rtol=1e-5, atol=1e-7)
+        print("PASSED")
+        i += 1
+
+
 #######################################################################
 #                          Distance Metrics                           #
 #######################################################################
@@ -110,6 +160,49 @@ def test_euclidean(N=1):
         i += 1
 
 
+def test_pairwise(N=5):
+    np.random.seed(12345)
+    i = 0
+    while i < N:
+        N = np.random.randint(1, 200)
+        M = np.random.randint(1, 200)
+        C = np.random.randint(1, 20)
+        X = np.random.rand(N, C)
+        Y = np.random.rand(M, C)
+
+        # repeated rows should be at distance exactly 0
+        n_shared = min(N, M, 5)
+        Y[:n_shared] = X[:n_shared]
+
+        metrics = [
+            (euclidean, "euclidean", {}),
+            (manhattan, "cityblock", {}),
+            (chebyshev, "chebyshev", {}),
+            (partial(minkowski, p=3), "minkowski", {"p": 3}),
+        ]
+        for metric, gold_metric, kwargs in metrics:
+            gold = cdist(X, Y, gold_metric, **kwargs)
+            for dtype, tol in [(np.float32, 1e-5), (np.float64, 1e-10)]:
+                mine = pairwise(
+                    X,
+                    Y,
+                    metric,
+                    block_size=np.random.choice([None, np.random.randint(1, 50)]),
+                    dtype=dtype,
+                    n_jobs=np.random.choice([1, 2]),
+                )
+                assert mine.dtype == dtype
+                np.testing.assert_allclose(mine, gold, rtol=tol, atol=tol)
+                np.testing.assert_array_equal(np.diag(mine[:n_shared, :n_shared]), 0)
+
+        X_int = np.random.randint(0, 3, size=(N, C))
+        out = np.empty((N, N))
+        pairwise(X_int, metric=hamming, out=out)
+        np.testing.assert_allclose(out, cdist(X_int, X_int, "hamming"))
+        print("PASSED")
+        i += 1
+
+
 #######################################################################
 #                           Data Structures                           #
 #######################################################################
@@ -154,6 +247,207 @@ def test_ball_tree(N=1):
         i += 1
 
 
+def test_ball_tree_build(N=1):
+    np.random.seed(12345)
+    i = 0
+    while i < N:
+        N = np.random.randint(2, 500)
+        M = np.random.randint(2, 20)
+        ls = np.random.randint(1, 20)
+        X = np.random.rand(N, M)
+        y = np.arange(N)
+
+        # the batched build for a built-in metric should produce the same tree
+        # as evaluating the metric one point at a time
+        BT = BallTree(leaf_size=ls, metric=euclidean)
+        BT.fit(X, y)
+        BT_loop = BallTree(leaf_size=ls, metric=lambda a, b: euclidean(a, b))
+        BT_loop.fit(X, y)
+
+        for attr in ["centroids", "radii", "idx_array", "left", "right"]:
+            np.testing.assert_almost_equal(getattr(BT, attr), getattr(BT_loop, attr))
+
+        # every point below a node lies inside its ball, and the targets are
+        # permuted along with the data
+        for node in range(BT.n_nodes):
+            points = BT.data[BT.node_start[node] : BT.node_end[node]]
+            dists = euclidean(points, BT.centroids[node])
+            assert np.all(dists <= BT.radii[node] + 1e-12)
+        np.testing.assert_array_equal(BT.data, X[BT.idx_array])
+        np.testing.assert_array_equal(BT.targets, y[BT.idx_array])
+
+        print("PASSED")
+        i += 1
+
+
+def test_ball_tree_save(N=1):
+    np.random.seed(12345)
+    i = 0
+    while i < N:
+        N = np.random.randint(2, 500)
+        M = np.random.randint(2, 20)
+        k = np.random.randint(1, N)
+        X = np.random.rand(N, M)
+        X_test = np.random.rand(10, M)
+
+        BT = BallTree(leaf_size=np.random.randint(1, 20))
+        BT.fit(X, np.random.rand(N))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            BT.save(tmpdir)
+            BT_mmap = BallTree.load(tmpdir)
+            assert isinstance(BT_mmap.data, np.memmap)
+            assert BT_mmap.leaf_size == BT.leaf_size
+
+            for mine, theirs in zip(BT.query(X_test, k), BT_mmap.query(X_test, k)):
+                np.testing.assert_array_equal(mine, theirs)
+            np.testing.assert_array_equal(BT.targets, BT_mmap.targets)
+            del BT_mmap
+
+        print("PASSED")
+        i += 1
+
+
+def test_ball_tree_query(N=5):
+    np.random.seed(12345)
+    metrics = {"euclidean": euclidean, "manhattan": manhattan, "chebyshev": chebyshev}
+
+    i = 0
+    while i < N:
+        N = np.random.randint(2, 500)
+        M = np.random.randint(2, 20)
+        k = np.random.randint(1, N)
+        ls = np.random.randint(1, 20)
+        metric = np.random.choice(list(metrics.keys()))
+
+        X = np.random.rand(N, M)
+        X_test = np.random.rand(np.random.randint(1, 100), M)
+
+        BT = BallTree(leaf_size=ls, metric=metrics[metric])
+        BT.fit(X)
+        dists, ixs = BT.query(X_test, k, batch_size=np.random.randint(1, 50))
+
+        sk = sk_BallTree(X, leaf_size=ls, metric=metric)
+        gold_dists, gold_ixs = sk.query(X_test, k=k)
+
+        np.testing.assert_almost_equal(dists, gold_dists)
+        np.testing.assert_array_equal(ixs, gold_ixs)
+        print("PASSED")
+        i += 1
+
+
+def test_ball_tree_query_radius(N=5):
+    np.random.seed(12345)
+    i = 0
+    while i < N:
+        N = np.random.randint(2, 500)
+        M = np.random.randint(2, 5)
+        ls = np.random.randint(1, 20)
+        X = np.random.rand(N, M)
+        X_test = np.random.rand(np.random.randint(1, 100), M)
+        r = np.random.rand(len(X_test)) * 0.5
+
+        BT = BallTree(leaf_size=ls)
+        BT.fit(X)
+        ixs, dists = BT.query_radius(X_test, r, return_distance=True)
+        ixs_only = BT.query_radius(X_test, r)
+
+        sk = sk_BallTree(X, leaf_size=ls)
+        gold_ixs, gold_dists = sk.query_radius(
+            X_test, r, return_distance=True, sort_results=True
+        )
+        for j in range(len(X_test)):
+            np.testing.assert_array_equal(ixs[j], gold_ixs[j])
+            np.testing.assert_almost_equal(dists[j], gold_dists[j])
+            np.testing.assert_array_equal(np.sort(ixs_only[j]), np.sort(gold_ixs[j]))
+
+        print("PASSED")
+        i += 1
+
+
+def test_ball_tree_kernel_density(N=5):
+    np.random.seed(12345)
+    i = 0
+    while i < N:
+        N = np.random.randint(2, 1000)
+        M = np.random.randint(1, 5)
+        X = np.random.rand(N, M)
+        X_test = np.random.rand(np.random.randint(1, 100), M)
+        weights = np.random.rand(N, 2)
+        bandwidth = np.random.uniform(0.01, 1)
+        rtol = np.random.choice([0, 1e-6, 1e-3])
+
+        BT = BallTree(leaf_size=np.random.randint(1, 20))
+        BT.fit(X)
+        mine = BT.kernel_density(X_test, bandwidth=bandwidth, rtol=rtol)
+        mine_w = BT.kernel_density(X_test, bandwidth=bandwidth, weights=weights)
+
+        K = RBFKernel(sigma=bandwidth)(X_test, X)
+        gold = K.mean(axis=1)
+        assert np.all(np.abs(mine - gold) <= rtol * gold + 1e-12)
+        np.testing.assert_almost_equal(mine_w, K @ weights / N)
+
+        print("PASSED")
+        i += 1
+
+
+def test_random_projection_forest(N=5):
+    np.random.seed(12345)
+    i = 0
+    while i < N:
+        n_points = np.random.randint(100, 2000)
+        M = np.random.randint(2, 50)
+        k = np.random.randint(1, 10)
+        centers = np.random.randn(20, M) * 3
+        X = centers[np.random.randint(0, 20, n_points)] + np.random.randn(n_points, M)
+        X_new = centers[np.random.randint(0, 20, 100)] + np.random.randn(100, M)
+        X_test = centers[np.random.randint(0, 20, 50)] + np.random.randn(50, M)
+
+        RPF = RandomProjectionForest(n_trees=10, leaf_size=20, seed=i)
+        RPF.fit(X)
+        RPF.add(X_new)
+        dists, ixs = RPF.query(X_test, k, ef=30)
+
+        X_all = np.vstack([X, X_new])
+        assert np.all(np.bincount(RPF.leaf_of.ravel()) <= 20)
+        np.testing.assert_almost_equal(
+            dists, np.linalg.norm(X_test[:, None] - X_all[ixs], axis=-1)
+        )
+        assert np.all(np.diff(dists, axis=1) >= 0)
+
+        gold = sk_BallTree(X_all).query(X_test, k, return_distance=False)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ixs, gold)])
+        assert recall >= 0.9
+
+        # every indexed point shares a leaf with itself
+        _, self_ixs = RPF.query(X_all, 1)
+        np.testing.assert_array_equal(self_ixs[:, 0], np.arange(len(X_all)))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            RPF.save(tmpdir)
+            loaded = RandomProjectionForest.load(tmpdir)
+            loaded_dists, loaded_ixs = loaded.query(X_test, k, ef=30)
+            np.testing.assert_array_equal(loaded_ixs, ixs)
+            np.testing.assert_array_equal(loaded_dists, dists)
+            del loaded
+
+        # targets must be added iff the forest was fit with them, one per point
+        y = np.random.randint(0, 3, size=len(X_all))
+        RPF_y = RandomProjectionForest(n_trees=2, leaf_size=20, seed=i)
+        RPF_y.fit(X, y[: len(X)])
+        for bad_forest, bad_y in [(RPF, y[len(X) :]), (RPF_y, None), (RPF_y, y)]:
+            try:
+                bad_forest.add(X_new, bad_y)
+                assert False, "expected a ValueError for mismatched targets"
+            except ValueError:
+                pass
+        RPF_y.add(X_new, y[len(X) :])
+        np.testing.assert_array_equal(RPF_y.targets, y)
+
+        print("PASSED")
+        i += 1
+
+
 #######################################################################
 #                               Graphs                                #
 #######################################################################
@@ -3,10 +3,17 @@ import numpy as np
 
 class Node:
     def __init__(self, left, right, rule):
+        """
+        `rule` is a tuple of (feature, threshold) or (feature, threshold,
+        missing_left), where `missing_left` indicates whether examples with a
+        missing (NaN) value for `feature` are sent to the left child. If
+        omitted, missing values are sent to the right child.
+        """
         self.left = left
         self.right = right
         self.feature = rule[0]
         self.threshold = rule[1]
+        self.missing_left = rule[2] if len(rule) > 2 else False
 
 
 class Leaf:
@@ -18,6 +25,140 @@ class Leaf:
         self.value = value
 
 
+class FlatTree:
+    def __init__(self, feature, threshold, left, right, value, missing_left=None):
+        """
+        An array-backed representation of a trained decision tree.
+
+        Node `i` is a leaf iff ``left[i] == -1``. Otherwise, an example `x` is
+        sent to node ``left[i]`` if ``x[feature[i]] <= threshold[i]`` and to
+        node ``right[i]`` otherwise. If ``x[feature[i]]`` is missing (NaN), `x`
+        is sent to the left child iff ``missing_left[i]`` is True. The root is
+        node 0.
+
+        Parameters
+        ----------
+        feature : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The index of the feature used to split at each node (-1 for leaves).
+        threshold : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The split threshold at each node (NaN for leaves).
+        left : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The index of the left child of each node (-1 for leaves).
+        right : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The index of the right child of each node (-1 for leaves).
+        value : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)` or `(n_nodes, n_classes)`
+            The value stored at each leaf (zeros for internal nodes). For
+            multi-output regression trees, this has shape `(n_nodes, K)`.
+        missing_left : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)` or None
+            Whether examples with a missing value for the split feature are
+            sent to the left child of each node. If None, missing values are
+            always sent right. Default is None.
+        """
+        if missing_left is None:
+            missing_left = np.zeros(len(feature), dtype=bool)
+
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.missing_left = missing_left
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    def apply(self, X):
+        """
+        Return the index of the leaf each example in `X` is assigned to.
+
+        Rather than traversing the tree once per example, all examples are
+        advanced one level at a time until each has reached a leaf.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            A collection of `N` examples, each with `M` features
+
+        Returns
+        -------
+        leaves : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The index of the leaf node for each example in `X`.
+        """
+        node = np.zeros(X.shape[0], dtype=np.int64)
+        active = np.arange(X.shape[0]) if self.left[0] != -1 else node[:0]
+        while len(active) > 0:
+            cur = node[active]
+            vals = X[active, self.feature[cur]]
+            go_left = vals <= self.threshold[cur]
+
+            missing = np.isnan(vals)
+            if missing.any():
+                go_left[missing] = self.missing_left[cur[missing]]
+            node[active] = np.where(go_left, self.left[cur], self.right[cur])
+            active = active[self.left[node[active]] != -1]
+        return node
+
+    def save(self, fpath):
+        """Save the tree arrays to an uncompressed ``.npz`` file at `fpath`"""
+        np.savez(
+            fpath,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            value=self.value,
+            missing_left=self.missing_left,
+        )
+
+    @staticmethod
+    def load(fpath):
+        """Load a :class:`FlatTree` saved via :meth:`FlatTree.save`"""
+        with np.load(fpath) as arrays:
+            return FlatTree(**{k: arrays[k] for k in arrays.files})
+
+
+def flatten_tree(root):
+    """
+    Convert a tree of :class:`Node` and :class:`Leaf` objects into a
+    :class:`FlatTree` whose nodes are stored in depth-first (pre-)order.
+    """
+    feature, threshold, left, right, value = [], [], [], [], []
+    missing_left = []
+
+    def add(node):
+        idx = len(feature)
+        feature.append(-1)
+        threshold.append(np.nan)
+        left.append(-1)
+        right.append(-1)
+        value.append(None)
+        missing_left.append(False)
+
+        if isinstance(node, Leaf):
+            value[idx] = node.value
+            return idx
+
+        feature[idx] = node.feature
+        threshold[idx] = node.threshold
+        missing_left[idx] = node.missing_left
+        left[idx] = add(node.left)
+        right[idx] = add(node.right)
+        return idx
+
+    add(root)
+    leaf_value = next(v for v in value if v is not None)
+    value = [np.zeros_like(leaf_value) if v is None else v for v in value]
+    return FlatTree(
+        np.array(feature, dtype=np.int64),
+        np.array(threshold, dtype=np.float64),
+        np.array(left, dtype=np.int64),
+        np.array(right, dtype=np.int64),
+        np.array(value, dtype=np.float64),
+        np.array(missing_left, dtype=bool),
+    )
+
+
 class DecisionTree:
     def __init__(
         self,
@@ -26,6 +167,7 @@ class DecisionTree:
         n_feats=None,
         criterion="entropy",
         seed=None,
+        max_bins=None,
     ):
         """
         A decision tree model for regression and classification problems.
@@ -46,16 +188,25 @@ class DecisionTree:
             `classifier` is False, valid entries are {'mse'}. When `classifier`
             is True, valid entries are {'entropy', 'gini'}. Default is
             'entropy'.
-        seed : int or None
-            Seed for the random number generator. Default is None.
+        seed : int, :py:class:`Generator <numpy.random.Generator>`, or None
+            Seed for the tree's random number generator, which is used to
+            sample features at each split. If a Generator is passed, it is
+            used directly. Default is None.
+        max_bins : int or None
+            If not None, quantize each feature into at most `max_bins` bins
+            before fitting and search for splits using per-node histograms
+            over the bin codes rather than over the raw feature values. Must
+            be at most 65536. Default is None.
         """
-        if seed:
-            np.random.seed(seed)
+        self.rng = np.random.default_rng(seed)
 
         self.depth = 0
         self.root = None
+        self.flat = None
+        self.feature_importances = None
 
         self.n_feats = n_feats
+        self.max_bins = max_bins
         self.criterion = criterion
         self.classifier = classifier
         self.max_depth = max_depth if max_depth else np.inf
@@ -66,6 +217,8 @@ class DecisionTree:
             )
         if classifier and criterion == "mse":
             raise ValueError("`mse` is a valid criterion only when classifier = False.")
+        if max_bins is not None and not 2 <= max_bins <= 65536:
+            raise ValueError("`max_bins` must be between 2 and 65536.")
 
     def fit(self, X, Y):
         """
@@ -75,14 +228,128 @@ class DecisionTree:
         ----------
         X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
             The training data of `N` examples, each with `M` features
-        Y : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+        Y : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)` or `(N, K)`
             An array of integer class labels for each example in `X` if
             self.classifier = True, otherwise the set of target values for
-            each example in `X`.
+            each example in `X`. If self.classifier = False, `Y` may contain
+            `K` target values per example, in which case each leaf predicts
+            a vector of `K` values and the impurity of a split is the mean of
+            the MSEs for each output.
+        """
+        if self.max_bins is not None:
+            X_binned, bin_edges = bin_features(X, self.max_bins)
+            self._fit_binned(X_binned, bin_edges, Y)
+            return
+        self._fit(X, Y)
+
+    def _fit(self, X, Y, idxs=None):
         """
-        self.n_classes = max(Y) + 1 if self.classifier else None
-        self.n_feats = X.shape[1] if not self.n_feats else min(self.n_feats, X.shape[1])
-        self.root = self._grow(X, Y)
+        Fit a binary decision tree to the examples in `X` at the (possibly
+        repeated) row indices `idxs`.
+
+        The tree is grown by recursively partitioning a single copy of `idxs`
+        in place, so that each node corresponds to a contiguous segment of the
+        index array and `X` is never copied. Since the split search reads one
+        column of `X` at a time, passing a Fortran-ordered `X` (see
+        :func:`numpy.asfortranarray`) makes these reads contiguous.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            The training data of `N` examples, each with `M` features
+        Y : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)` or `(N, K)`
+            The class labels or target values for each example in `X`.
+        idxs : :py:class:`ndarray <numpy.ndarray>` of shape `(N',)` or None
+            The indices of the examples to fit the tree to. If None, use all
+            `N` examples. Default is None.
+
+
+        Returns
+        -------
+        train_leaves : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The index of the leaf in `self.flat` that each example was
+            assigned to while fitting, or -1 for examples not in `idxs`.
+        """
+        N, M = X.shape
+        idxs = np.arange(N) if idxs is None else np.array(idxs, dtype=np.int64)
+
+        self.n_classes = Y.max() + 1 if self.classifier else None
+        self.n_feats = M if not self.n_feats else min(self.n_feats, M)
+        self.feature_importances = np.zeros(M)
+
+        self._leaf_rows = []
+        self._scratch = np.empty_like(idxs)
+        self.root = self._grow(X, Y, idxs)
+        return self._finish_fit(N)
+
+    def _fit_binned(self, X_binned, bin_edges, Y, idxs=None):
+        """
+        Fit a binary decision tree to a dataset whose features have already
+        been quantized by :func:`bin_features`.
+
+        Parameters
+        ----------
+        X_binned : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            The bin code for each of the `M` features of each of the `N`
+            training examples.
+        bin_edges : list of length `M`
+            The upper bin edges for each feature, as returned by
+            :func:`bin_features`.
+        Y : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)` or `(N, K)`
+            An array of integer class labels for each example in `X` if
+            self.classifier = True, otherwise the set of target values for
+            each example in `X`. If self.classifier = False, `Y` may contain
+            `K` target values per example, in which case each leaf predicts
+            a vector of `K` values and the impurity of a split is the mean of
+            the MSEs for each output.
+        idxs : :py:class:`ndarray <numpy.ndarray>` of shape `(N',)` or None
+            The (possibly repeated) indices of the examples to fit the tree
+            to. If None, use all `N` examples. Default is None.
+
+
+        Returns
+        -------
+        train_leaves : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The index of the leaf in `self.flat` that each example was
+            assigned to while fitting, or -1 for examples not in `idxs`.
+        """
+        N, M = X_binned.shape
+        idxs = np.arange(N) if idxs is None else np.array(idxs, dtype=np.int64)
+
+        self.bin_edges = bin_edges
+        self.n_bins = max(len(e) for e in bin_edges) + 2
+        self.n_classes = Y.max() + 1 if self.classifier else None
+        self.n_feats = M if not self.n_feats else min(self.n_feats, M)
+        self.feature_importances = np.zeros(M)
+
+        stats = self._sufficient_stats(Y)
+        hist = self._histogram(X_binned, stats, idxs)
+
+        self._leaf_rows = []
+        self._scratch = np.empty_like(idxs)
+        self.root = self._grow_binned(X_binned, Y, stats, hist, idxs)
+        return self._finish_fit(N)
+
+    def _finish_fit(self, N):
+        """
+        Flatten the grown tree and scale the total impurity decrease
+        attributed to each feature so that the importances sum to 1. Returns
+        the leaf each of the `N` training examples was assigned to (-1 for
+        examples not used to fit the tree).
+        """
+        self.flat = flatten_tree(self.root)
+
+        # leaves are grown and flattened in the same depth-first order
+        train_leaves = np.full(N, -1, dtype=np.int64)
+        leaves = np.flatnonzero(self.flat.left == -1)
+        for leaf, rows in zip(leaves, self._leaf_rows):
+            train_leaves[rows] = leaf
+        self._leaf_rows, self._scratch = [], None
+
+        total = self.feature_importances.sum()
+        if total > 0:
+            self.feature_importances /= total
+        return train_leaves
 
     def predict(self, X):
         """
@@ -95,11 +362,12 @@ class DecisionTree:
 
         Returns
         -------
-        preds : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+        preds : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)` or `(N, K)`
             The integer class labels predicted for each example in `X` if
             self.classifier = True, otherwise the predicted target values.
         """
-        return np.array([self._traverse(x, self.root) for x in X])
+        preds = self.flat.value[self.flat.apply(X)]
+        return preds.argmax(axis=1) if self.classifier else preds
 
     def predict_class_probs(self, X):
         """
@@ -117,121 +385,428 @@ class DecisionTree:
             The class probabilities predicted for each example in `X`.
         """
         assert self.classifier, "`predict_class_probs` undefined for classifier = False"
-        return np.array([self._traverse(x, self.root, prob=True) for x in X])
-
-    def _grow(self, X, Y, cur_depth=0):
-        # if all labels are the same, return a leaf
-        if len(set(Y)) == 1:
-            if self.classifier:
-                prob = np.zeros(self.n_classes)
-                prob[Y[0]] = 1.0
-            return Leaf(prob) if self.classifier else Leaf(Y[0])
-
-        # if we have reached max_depth, return a leaf
-        if cur_depth >= self.max_depth:
-            v = np.mean(Y, axis=0)
-            if self.classifier:
-                v = np.bincount(Y, minlength=self.n_classes) / len(Y)
-            return Leaf(v)
+        return self.flat.value[self.flat.apply(X)]
+
+    def apply(self, X):
+        """
+        Return the index of the leaf in `self.flat` that each example in `X`
+        is assigned to.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            The training data of `N` examples, each with `M` features
+
+        Returns
+        -------
+        leaves : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The index of the leaf node for each example in `X`.
+        """
+        return self.flat.apply(X)
+
+    def _grow(self, X, Y, idxs, cur_depth=0):
+        # if all labels are the same, or we have reached max_depth, return a leaf
+        Y_node = Y[idxs]
+        if np.all(Y_node == Y_node[0]) or cur_depth >= self.max_depth:
+            return self._leaf(Y_node, idxs)
+
+        N, M = len(idxs), X.shape[1]
+        feat_idxs = self.rng.choice(M, self.n_feats, replace=False)
+
+        # greedily select the best split according to `criterion`. if no
+        # split leaves examples on both sides and decreases the impurity,
+        # return a leaf
+        feat, thresh, gain, missing_left = self._segment(X, Y_node, feat_idxs, idxs)
+        if feat is None:
+            return self._leaf(Y_node, idxs)
+        self.feature_importances[feat] += N * gain
 
         cur_depth += 1
         self.depth = max(self.depth, cur_depth)
 
-        N, M = X.shape
-        feat_idxs = np.random.choice(M, self.n_feats, replace=False)
+        vals = X[idxs, feat]
+        is_left = vals <= thresh
+        if missing_left:
+            is_left |= np.isnan(vals)
+        n_l = partition(idxs, is_left, self._scratch)
 
-        # greedily select the best split according to `criterion`
-        feat, thresh = self._segment(X, Y, feat_idxs)
-        l = np.argwhere(X[:, feat] <= thresh).flatten()
-        r = np.argwhere(X[:, feat] > thresh).flatten()
+        # grow the children that result from the split
+        left = self._grow(X, Y, idxs[:n_l], cur_depth)
+        right = self._grow(X, Y, idxs[n_l:], cur_depth)
+        return Node(left, right, (feat, thresh, missing_left))
+
+    def _grow_binned(self, X_binned, Y, stats, hist, idxs, cur_depth=0):
+        # if all labels are the same, or we have reached max_depth, return a leaf
+        Y_node = Y[idxs]
+        if np.all(Y_node == Y_node[0]) or cur_depth >= self.max_depth:
+            return self._leaf(Y_node, idxs)
+
+        N, M = len(idxs), X_binned.shape[1]
+        feat_idxs = self.rng.choice(M, self.n_feats, replace=False)
+
+        # greedily select the best split according to `criterion`. if no
+        # split leaves examples on both sides and decreases the impurity,
+        # return a leaf
+        feat, split_bin, gain, missing_left = self._segment_binned(hist, feat_idxs)
+        if feat is None:
+            return self._leaf(Y_node, idxs)
+        self.feature_importances[feat] += N * gain
+
+        cur_depth += 1
+        self.depth = max(self.depth, cur_depth)
+
+        # bin code 0 holds the missing values; real bin `b` has code `b + 1`
+        codes = X_binned[idxs, feat]
+        is_left = (codes <= split_bin + 1) & (codes > 0)
+        if missing_left:
+            is_left |= codes == 0
+        n_l = partition(idxs, is_left, self._scratch)
+        l, r = idxs[:n_l], idxs[n_l:]
+
+        # only compute the histogram for the smaller child directly; the
+        # larger child's histogram is the parent's minus its sibling's
+        if len(l) <= len(r):
+            hist_l = self._histogram(X_binned, stats, l)
+            hist_r = hist - hist_l
+        else:
+            hist_r = self._histogram(X_binned, stats, r)
+            hist_l = hist - hist_r
 
         # grow the children that result from the split
-        left = self._grow(X[l, :], Y[l], cur_depth)
-        right = self._grow(X[r, :], Y[r], cur_depth)
-        return Node(left, right, (feat, thresh))
+        left = self._grow_binned(X_binned, Y, stats, hist_l, l, cur_depth)
+        right = self._grow_binned(X_binned, Y, stats, hist_r, r, cur_depth)
+
+        # a split after the last bin separates the missing and present values
+        edges = self.bin_edges[feat]
+        thresh = edges[split_bin] if split_bin < len(edges) else np.inf
+        return Node(left, right, (feat, thresh, missing_left))
 
-    def _segment(self, X, Y, feat_idxs):
+    def _leaf(self, Y, idxs):
+        """
+        Return a leaf predicting the class distribution or mean of `Y`, and
+        record the indices of the training examples assigned to it.
+        """
+        self._leaf_rows.append(idxs)
+        if self.classifier:
+            return Leaf(np.bincount(Y, minlength=self.n_classes) / len(Y))
+        return Leaf(np.mean(Y, axis=0))
+
+    def _segment(self, X, Y, feat_idxs, idxs=None):
         """
         Find the optimal split rule (feature index and split threshold) for the
-        data according to `self.criterion`.
+        examples in `X` at row indices `idxs` (or all rows, if `idxs` is None)
+        with targets `Y` according to `self.criterion`, along with its
+        impurity gain.
+
+        Rather than re-evaluating the impurity of each candidate partition from
+        scratch, each feature is sorted once and the impurity gain for every
+        candidate threshold is computed from prefix sums of the sufficient
+        statistics for `self.criterion` (class counts for 'entropy' / 'gini',
+        the sum and sum of squares of the targets for 'mse'). This yields the
+        same split as an exhaustive search in :math:`O(N \\log N)` time per
+        feature.
+
+        Examples with a missing (NaN) value for a feature are sent to
+        whichever side of each candidate split yields the larger gain. The
+        final return value indicates whether this is the left side.
         """
         best_gain = -np.inf
-        split_idx, split_thresh = None, None
+        split_idx, split_thresh, split_missing_left = None, None, False
+
+        stats = self._sufficient_stats(Y)
         for i in feat_idxs:
-            vals = X[:, i]
-            levels = np.unique(vals)
-            thresholds = (levels[:-1] + levels[1:]) / 2 if len(levels) > 1 else levels
-            gains = np.array([self._impurity_gain(Y, t, vals) for t in thresholds])
+            vals = X[:, i] if idxs is None else X[idxs, i]
+
+            missing_stats = None
+            missing = np.isnan(vals)
+            if missing.any():
+                missing_stats = stats[missing].sum(axis=0)
+                vals, feat_stats = vals[~missing], stats[~missing]
+            else:
+                feat_stats = stats
+
+            order = np.argsort(vals, kind="mergesort")
+            gains, thresholds, missing_left = self._sweep_gains(
+                vals[order], feat_stats[order], missing_stats
+            )
 
             if gains.max() > best_gain:
                 split_idx = i
                 best_gain = gains.max()
                 split_thresh = thresholds[gains.argmax()]
+                split_missing_left = missing_left[gains.argmax()]
 
-        return split_idx, split_thresh
+        # no split leaves examples on both sides or improves the impurity
+        if best_gain <= 0:
+            return None, None, best_gain, False
+        return split_idx, split_thresh, best_gain, split_missing_left
+
+    def _segment_binned(self, hist, feat_idxs):
+        """
+        Find the optimal split rule (feature index and bin) for the data
+        summarized by the per-feature histograms in `hist` according to
+        `self.criterion`, along with its impurity gain and whether examples
+        with missing values are sent left. Examples in (real) bins less than
+        or equal to the returned bin are sent to the left child.
+        """
+        best_gain = -np.inf
+        split_idx, split_bin, split_missing_left = None, None, False
 
-    def _impurity_gain(self, Y, split_thresh, feat_values):
+        total = hist[0].sum(axis=0)
+        for i in feat_idxs:
+            # bin 0 of each histogram holds the examples with missing values
+            missing = hist[i, 0]
+            left = np.cumsum(hist[i, 1:], axis=0)
+            right = total - missing - left
+
+            gains = self._valid_split_gains(left, right + missing)
+            missing_left = np.zeros(len(gains), dtype=bool)
+            if self._stats_count(missing[None, :])[0] > 0:
+                gains_ml = self._valid_split_gains(left + missing, right)
+                missing_left = gains_ml > gains
+                gains = np.maximum(gains, gains_ml)
+
+            if gains.max() > best_gain:
+                split_idx = i
+                best_gain = gains.max()
+                split_bin = gains.argmax()
+                split_missing_left = missing_left[split_bin]
+
+        if best_gain <= 0:
+            return None, None, best_gain, False
+        return split_idx, split_bin, best_gain, split_missing_left
+
+    def _valid_split_gains(self, left, right):
+        """
+        Compute the impurity gain for each candidate split, assigning a gain
+        of -inf to splits that leave one side empty.
         """
-        Compute the impurity gain associated with a given split.
+        n_l, n_r = self._stats_count(left), self._stats_count(right)
+        valid = (n_l > 0) & (n_r > 0)
+
+        gains = np.full(len(left), -np.inf)
+        gains[valid] = self._split_gains(left[valid], right[valid])
+        return gains
+
+    def _histogram(self, X_binned, stats, idxs):
+        """
+        Sum the sufficient statistics in `stats` for the examples at row
+        indices `idxs` within each bin of each feature, returning an array of
+        shape `(M, n_bins, D)`.
+        """
+        M, D = X_binned.shape[1], stats.shape[1]
+        hist = np.empty((M, self.n_bins, D))
+        weights = stats[idxs].ravel()
+        offsets = np.arange(D)
+        for i in range(M):
+            codes = X_binned[idxs, i].astype(np.int64)
+            bins = (codes[:, None] * D + offsets).ravel()
+            counts = np.bincount(bins, weights=weights, minlength=self.n_bins * D)
+            hist[i] = counts.reshape(self.n_bins, D)
+        return hist
+
+    def _sufficient_stats(self, Y):
+        """
+        Return the per-example statistics whose sums determine the impurity
+        of a set of examples under `self.criterion`.
+        """
+        if self.classifier:
+            stats = np.zeros((len(Y), self.n_classes))
+            stats[np.arange(len(Y)), Y] = 1.0
+            return stats
+        return np.column_stack([np.ones(len(Y)), Y, Y ** 2])
+
+    def _stats_count(self, stats):
+        """Return the number of examples summarized by each row of `stats`"""
+        return stats.sum(axis=1) if self.classifier else stats[:, 0]
+
+    def _split_gains(self, left, right):
+        """
+        Compute the impurity gain for each candidate split, where `left` and
+        `right` hold the summed sufficient statistics for the examples on
+        either side of each split.
 
         IG(split) = loss(parent) - weighted_avg[loss(left_child), loss(right_child)]
         """
+        n_l, n_r = self._stats_count(left), self._stats_count(right)
+        n = n_l + n_r
+
+        parent_loss = self._stats_loss(left + right)
+        child_loss = (n_l / n) * self._stats_loss(left)
+        child_loss += (n_r / n) * self._stats_loss(right)
+        return parent_loss - child_loss
+
+    def _stats_loss(self, stats):
+        """
+        Compute the impurity of each set of examples summarized by the rows of
+        `stats` (the summed outputs of :meth:`_sufficient_stats`).
+        """
         if self.criterion == "entropy":
-            loss = entropy
+            return entropy_from_counts(stats)
         elif self.criterion == "gini":
-            loss = gini
+            return gini_from_counts(stats)
         elif self.criterion == "mse":
-            loss = mse
+            return mse_from_moments(stats)
+
+    def _sweep_gains(self, vals, stats, missing_stats=None):
+        """
+        Compute the impurity gain for every candidate threshold on a single
+        feature.
+
+        Parameters
+        ----------
+        vals : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The non-missing feature values for each example, sorted in
+            ascending order.
+        stats : :py:class:`ndarray <numpy.ndarray>` of shape `(N, D)`
+            The sufficient statistics for each example, in the same order as
+            `vals`.
+        missing_stats : :py:class:`ndarray <numpy.ndarray>` of shape `(D,)` or None
+            The summed sufficient statistics for the examples with a missing
+            value for the feature, or None if there are no such examples.
+            Default is None.
 
-        parent_loss = loss(Y)
+        Returns
+        -------
+        gains : :py:class:`ndarray <numpy.ndarray>` of shape `(U - 1,)`
+            The impurity gain associated with splitting at each threshold.
+        thresholds : :py:class:`ndarray <numpy.ndarray>` of shape `(U - 1,)`
+            The midpoints between each consecutive pair of the `U` unique
+            values in `vals`. If `vals` contains a single unique value, this
+            value is returned as the only threshold with a gain of -inf. If
+            `missing_stats` is not None, an additional threshold of `inf`
+            separating the missing from the non-missing values is appended.
+        missing_left : :py:class:`ndarray <numpy.ndarray>` of shape `(U - 1,)`
+            Whether the examples with missing values should be sent to the
+            left child for the split at each threshold.
+        """
+        cuts = np.flatnonzero(vals[1:] != vals[:-1])
+        thresholds = (vals[cuts] + vals[cuts + 1]) / 2
 
-        # generate split
-        left = np.argwhere(feat_values <= split_thresh).flatten()
-        right = np.argwhere(feat_values > split_thresh).flatten()
+        if missing_stats is None:
+            if len(cuts) == 0:
+                return np.array([-np.inf]), vals[:1], np.zeros(1, dtype=bool)
 
-        if len(left) == 0 or len(right) == 0:
-            return 0
+            cum_stats = np.cumsum(stats, axis=0)
+            left = cum_stats[cuts]
+            right = cum_stats[-1] - left
+            gains = self._split_gains(left, right)
+            return gains, thresholds, np.zeros(len(gains), dtype=bool)
 
-        # compute the weighted avg. of the loss for the children
-        n = len(Y)
-        n_l, n_r = len(left), len(right)
-        e_l, e_r = loss(Y[left]), loss(Y[right])
-        child_loss = (n_l / n) * e_l + (n_r / n) * e_r
+        if len(vals) == 0:
+            return np.array([-np.inf]), np.array([np.nan]), np.zeros(1, dtype=bool)
 
-        # impurity gain is difference in loss before vs. after split
-        ig = parent_loss - child_loss
-        return ig
+        # consider one additional split, which sends all the non-missing values
+        # left and the missing values right
+        cum_stats = np.cumsum(stats, axis=0)
+        left = np.vstack([cum_stats[cuts], cum_stats[-1]])
+        right = cum_stats[-1] - left
+        thresholds = np.append(thresholds, np.inf)
 
-    def _traverse(self, X, node, prob=False):
-        if isinstance(node, Leaf):
-            if self.classifier:
-                return node.value if prob else node.value.argmax()
-            return node.value
-        if X[node.feature] <= node.threshold:
-            return self._traverse(X, node.left, prob)
-        return self._traverse(X, node.right, prob)
+        gains = self._split_gains(left, right + missing_stats)
+        gains_ml = self._split_gains(left[:-1] + missing_stats, right[:-1])
+
+        missing_left = np.zeros(len(gains), dtype=bool)
+        missing_left[:-1] = gains_ml > gains[:-1]
+        gains[:-1] = np.maximum(gains[:-1], gains_ml)
+        return gains, thresholds, missing_left
+
+
+def partition(idxs, is_left, scratch):
+    """
+    Stably reorder `idxs` in place so that the entries for which `is_left` is
+    True precede those for which it is False, and return the number of
+    entries for which `is_left` is True.
+
+    The entries are gathered into `scratch`, a buffer with at least
+    ``len(idxs)`` entries that is allocated once per fit and shared by every
+    node, and then copied back, so no new index arrays are allocated. Note
+    that `is_left` is inverted in place.
+    """
+    n, n_left = len(idxs), np.count_nonzero(is_left)
+    buf = scratch[:n]
+    np.compress(is_left, idxs, out=buf[:n_left])
+    np.compress(np.logical_not(is_left, out=is_left), idxs, out=buf[n_left:])
+    idxs[:] = buf
+    return n_left
+
+
+def bin_features(X, max_bins):
+    """
+    Quantize each column of `X` into at most `max_bins` bins, one of which is
+    reserved for missing (NaN) values.
+
+    If a feature takes at most `max_bins` - 1 unique (non-missing) values,
+    the bin edges are placed halfway between consecutive values so that no
+    split is lost. Otherwise, the edges are placed at evenly spaced quantiles
+    of the feature.
+
+    Parameters
+    ----------
+    X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+        The data of `N` examples, each with `M` features.
+    max_bins : int
+        The maximum number of bins per feature. Must be at most 65536.
+
+    Returns
+    -------
+    X_binned : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+        The bin code for each feature of each example. The dtype is uint8 if
+        `max_bins` is at most 256, otherwise uint16. Missing values are
+        assigned code 0.
+    bin_edges : list of length `M`
+        The upper edges of all but the last (non-missing) bin for each
+        feature. An example with a non-missing value is assigned code `b + 1`
+        for feature `i` iff ``bin_edges[i][b - 1] < X[:, i] <=
+        bin_edges[i][b]``.
+    """
+    N, M = X.shape
+    dtype = np.uint8 if max_bins <= 256 else np.uint16
+    X_binned = np.empty((N, M), dtype=dtype)
+
+    bin_edges = []
+    for i in range(M):
+        missing = np.isnan(X[:, i])
+        present = X[~missing, i]
+
+        levels = np.unique(present)
+        if len(levels) <= max_bins - 1:
+            edges = (levels[:-1] + levels[1:]) / 2
+        else:
+            quantiles = np.linspace(0, 100, max_bins)[1:-1]
+            edges = np.unique(np.percentile(present, quantiles))
+
+        X_binned[:, i] = np.searchsorted(edges, X[:, i], side="left") + 1
+        X_binned[missing, i] = 0
+        bin_edges.append(edges)
+    return X_binned, bin_edges
 
 
-def mse(y):
+def mse_from_moments(moments):
     """
-    Mean squared error for decision tree (ie., mean) predictions
+    Mean squared error for decision tree (ie., mean) predictions, computed
+    from the rows of `moments`, each of which holds the count, the `K` sums,
+    and the `K` sums of squares for a set of (`K`-dimensional) target values.
+    For `K` > 1, the MSE is averaged over the output dimensions
     """
-    return np.mean((y - np.mean(y)) ** 2)
+    K = (moments.shape[1] - 1) // 2
+    n = moments[:, :1]
+    s, ss = moments[:, 1 : K + 1], moments[:, K + 1 :]
+    return np.maximum(ss / n - (s / n) ** 2, 0).mean(axis=1)
 
 
-def entropy(y):
+def entropy_from_counts(counts):
     """
-    Entropy of a label sequence
+    Entropy of the label distributions summarized by the rows of `counts`
     """
-    hist = np.bincount(y)
-    ps = hist / np.sum(hist)
-    return -np.sum([p * np.log2(p) for p in ps if p > 0])
+    ps = counts / counts.sum(axis=1, keepdims=True)
+    logs = np.log2(np.where(ps > 0, ps, 1))
+    return -np.sum(ps * logs, axis=1)
 
 
-def gini(y):
+def gini_from_counts(counts):
     """
-    Gini impurity (local entropy) of a label sequence
+    Gini impurity of the label distributions summarized by the rows of `counts`
     """
-    hist = np.bincount(y)
-    N = np.sum(hist)
-    return 1 - sum([(i / N) ** 2 for i in hist])
+    ps = counts / counts.sum(axis=1, keepdims=True)
+    return 1 - np.sum(ps ** 2, axis=1)
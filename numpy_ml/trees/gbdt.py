@@ -1,6 +1,6 @@
 import numpy as np
 
-from .dt import DecisionTree
+from .dt import DecisionTree, bin_features
 from .losses import MSELoss, CrossEntropyLoss
 
 
@@ -24,6 +24,11 @@ class GradientBoostedDecisionTree:
         learning_rate=1,
         loss="crossentropy",
         step_size="constant",
+        max_bins=None,
+        subsample=1.0,
+        colsample=1.0,
+        multi_output=False,
+        seed=None,
     ):
         """
         A gradient boosted ensemble of decision trees.
@@ -79,19 +84,47 @@ class GradientBoostedDecisionTree:
             a fixed weight of 1 for each learner. If "adaptive", use a step
             size computed via line-search on the current iteration's loss.
             Default is 'constant'.
+        max_bins : int or None
+            If not None, quantize each feature into at most `max_bins` bins
+            once before fitting and grow each weak learner using
+            histogram-based split search over the resulting bin codes.
+            Default is None.
+        subsample : float
+            Value in (0, 1] giving the fraction of the training examples,
+            drawn without replacement on each iteration, used to fit that
+            iteration's weak learners (i.e., stochastic gradient boosting).
+            Default is 1.
+        colsample : float
+            Value in (0, 1] giving the fraction of the features sampled at
+            each split of each weak learner (see the `n_feats` parameter of
+            :class:`~numpy_ml.trees.DecisionTree`). Default is 1.
+        multi_output : bool
+            If True, fit a single multi-output decision tree per iteration
+            whose leaves predict a value for every dimension / class of `Y`,
+            and whose splits minimize the MSE averaged across dimensions. If
+            False, fit a separate tree for each dimension on each iteration.
+            Default is False.
+        seed : int or None
+            Seed for the random number generator used to subsample examples
+            and features. Default is None.
         """
         self.loss = loss
         self.weights = None
         self.learners = None
         self.out_dims = None
         self.n_iter = n_iter
+        self.subsample = subsample
+        self.colsample = colsample
+        self.multi_output = multi_output
         self.base_estimator = None
+        self.rng = np.random.default_rng(seed)
+        self.max_bins = max_bins
         self.max_depth = max_depth
         self.step_size = step_size
         self.classifier = classifier
         self.learning_rate = learning_rate
 
-    def fit(self, X, Y):
+    def fit(self, X, Y, X_val=None, Y_val=None, early_stopping_rounds=None):
         """
         Fit the gradient boosted decision trees on a dataset.
 
@@ -103,20 +136,49 @@ class GradientBoostedDecisionTree:
             An array of integer class labels for each example in `X` if
             ``self.classifier = True``, otherwise the set of target values for
             each example in `X`.
+        X_val : :py:class:`ndarray <numpy.ndarray>` of shape (N', M) or None
+            An optional validation set. If provided, the loss on the
+            validation set after each iteration is stored in
+            `self.val_losses`. Default is None.
+        Y_val : :py:class:`ndarray <numpy.ndarray>` of shape (N',) or None
+            The targets for the examples in `X_val`. Default is None.
+        early_stopping_rounds : int or None
+            If not None, stop fitting once the validation loss has not
+            improved for `early_stopping_rounds` consecutive iterations, and
+            discard the learners fit after the iteration with the lowest
+            validation loss (`self.best_iteration`). Requires `X_val` and
+            `Y_val`. Default is None.
         """
         if self.loss == "mse":
             loss = MSELoss()
         elif self.loss == "crossentropy":
             loss = CrossEntropyLoss()
 
+        if early_stopping_rounds is not None and X_val is None:
+            raise ValueError("`early_stopping_rounds` requires a validation set")
+        if not (0 < self.subsample <= 1 and 0 < self.colsample <= 1):
+            raise ValueError("`subsample` and `colsample` must be in (0, 1]")
+
         # convert Y to one_hot if not already
         if self.classifier:
             Y = to_one_hot(Y.flatten())
         else:
             Y = Y.reshape(-1, 1) if len(Y.shape) == 1 else Y
 
+        X_binned = None
+        if self.max_bins is not None:
+            X_binned, bin_edges = bin_features(X, self.max_bins)
+
         N, M = X.shape
+        n_rows = max(1, int(round(self.subsample * N)))
+        n_feats = max(1, int(round(self.colsample * M)))
+
         self.out_dims = Y.shape[1]
+        if self.multi_output:
+            output_groups = [np.arange(self.out_dims)]
+        else:
+            output_groups = [np.array([k]) for k in range(self.out_dims)]
+
         self.learners = np.empty((self.n_iter, self.out_dims), dtype=object)
         self.weights = np.ones((self.n_iter, self.out_dims))
         self.weights[1:, :] *= self.learning_rate
@@ -129,33 +191,121 @@ class GradientBoostedDecisionTree:
             Y_pred[:, k] += t.predict(X)
             self.learners[0, k] = t
 
+        self.val_losses = []
+        self.best_iteration = 0
+        if X_val is not None:
+            if self.classifier:
+                Y_val = to_one_hot(Y_val.flatten(), self.out_dims)
+            else:
+                Y_val = Y_val.reshape(-1, 1) if len(Y_val.shape) == 1 else Y_val
+            Y_val_pred = self._predict_scores(X_val, n_iter_limit=1)
+            self.val_losses.append(self._loss(loss, Y_val, Y_val_pred))
+
         # incrementally fit each learner on the negative gradient of the loss
         # wrt the previous fit (pseudo-residuals)
         for i in range(1, self.n_iter):
-            for k in range(self.out_dims):
-                y, y_pred = Y[:, k], Y_pred[:, k]
+            # draw the subsample of examples used to fit this iteration's
+            # learners. examples outside the subsample must be run through
+            # each new learner to update their predictions
+            rows, oob = np.arange(N), None
+            if n_rows < N:
+                rows = np.sort(self.rng.choice(N, n_rows, replace=False))
+                oob = np.setdiff1d(np.arange(N), rows, assume_unique=True)
+
+            for cols in output_groups:
+                y, y_pred = Y[:, cols], Y_pred[:, cols]
                 neg_grad = -1 * loss.grad(y, y_pred)
+                if not self.multi_output:
+                    neg_grad = neg_grad[:, 0]
 
                 # use MSE as the surrogate loss when fitting to negative gradients
                 t = DecisionTree(
-                    classifier=False, max_depth=self.max_depth, criterion="mse"
+                    classifier=False,
+                    max_depth=self.max_depth,
+                    n_feats=n_feats,
+                    criterion="mse",
+                    max_bins=self.max_bins,
+                    seed=self.rng,
                 )
 
                 # fit current learner to negative gradients
-                t.fit(X, neg_grad)
-                self.learners[i, k] = t
+                if X_binned is not None:
+                    train_leaves = t._fit_binned(X_binned, bin_edges, neg_grad, rows)
+                else:
+                    train_leaves = t._fit(X, neg_grad, rows)
+                self.learners[i, cols] = t
+
+                # the learner's predictions on the subsample are the values of
+                # the leaves each example was assigned to while fitting
+                h_pred = np.empty((N, len(cols)))
+                leaves = train_leaves[rows]
+                h_pred[rows] = t.flat.value[leaves].reshape(-1, len(cols))
+                if oob is not None:
+                    h_pred[oob] = t.predict(X[oob]).reshape(-1, len(cols))
+
+                if X_val is not None:
+                    h_val = t.predict(X_val).reshape(-1, len(cols))
+
+                for j, k in enumerate(cols):
+                    # compute step size and weight for the current learner
+                    step = 1.0
+                    if self.step_size == "adaptive":
+                        step = loss.line_search(y[:, j], y_pred[:, j], h_pred[:, j])
+
+                    # update weights and our overall prediction for Y
+                    self.weights[i, k] *= step
+                    Y_pred[:, k] += self.weights[i, k] * h_pred[:, j]
+
+                    if X_val is not None:
+                        Y_val_pred[:, k] += self.weights[i, k] * h_val[:, j]
+
+            if X_val is None:
+                continue
+
+            self.val_losses.append(self._loss(loss, Y_val, Y_val_pred))
+            if self.val_losses[i] < self.val_losses[self.best_iteration]:
+                self.best_iteration = i
+            elif early_stopping_rounds is not None:
+                if i - self.best_iteration >= early_stopping_rounds:
+                    break
+
+        if early_stopping_rounds is not None:
+            self.learners = self.learners[: self.best_iteration + 1]
+            self.weights = self.weights[: self.best_iteration + 1]
+
+    def _loss(self, loss, Y, Y_pred):
+        """Total loss across all output dimensions"""
+        return sum(loss(Y[:, k], Y_pred[:, k]) for k in range(self.out_dims))
+
+    def _staged_scores(self, X, n_iter_limit=None):
+        """
+        Yield the model's (pre-argmax) predictions for `X` after each of the
+        first `n_iter_limit` iterations. The same array is updated in place
+        and re-yielded on each iteration.
+        """
+        n_iter = len(self.learners)
+        if n_iter_limit is not None:
+            n_iter = min(n_iter, n_iter_limit)
 
-                # compute step size and weight for the current learner
-                step = 1.0
-                h_pred = t.predict(X)
-                if self.step_size == "adaptive":
-                    step = loss.line_search(y, y_pred, h_pred)
+        Y_pred = np.zeros((X.shape[0], self.out_dims))
+        for i in range(n_iter):
+            # a single multi-output learner is shared by all output dimensions
+            if i > 0 and self.multi_output:
+                Y_pred += self.weights[i] * self.learners[i, 0].predict(X)
+                yield Y_pred
+                continue
 
-                # update weights and our overall prediction for Y
-                self.weights[i, k] *= step
-                Y_pred[:, k] += self.weights[i, k] * h_pred
+            for k in range(self.out_dims):
+                Y_pred[:, k] += self.weights[i, k] * self.learners[i, k].predict(X)
+            yield Y_pred
+
+    def _predict_scores(self, X, n_iter_limit=None):
+        Y_pred = np.zeros((X.shape[0], self.out_dims))
+        for Y_pred in self._staged_scores(X, n_iter_limit):
+            pass
+        return Y_pred
 
-    def predict(self, X):
+    def predict(self, X, n_iter_limit=None):
         """
         Use the trained model to classify or predict the examples in `X`.
 
@@ -163,6 +313,10 @@ class GradientBoostedDecisionTree:
         ----------
         X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
             The training data of `N` examples, each with `M` features
+        n_iter_limit : int or None
+            If not None, only use the learners from the first `n_iter_limit`
+            iterations (including the base estimator) when making
+            predictions. Default is None.
 
         Returns
         -------
@@ -170,12 +324,29 @@ class GradientBoostedDecisionTree:
             The integer class labels predicted for each example in `X` if
             ``self.classifier = True``, otherwise the predicted target values.
         """
-        Y_pred = np.zeros((X.shape[0], self.out_dims))
-        for i in range(self.n_iter):
-            for k in range(self.out_dims):
-                Y_pred[:, k] += self.weights[i, k] * self.learners[i, k].predict(X)
+        Y_pred = self._predict_scores(X, n_iter_limit)
 
         if self.classifier:
             Y_pred = Y_pred.argmax(axis=1)
 
         return Y_pred
+
+    def staged_predict(self, X):
+        """
+        Yield the model's predictions for the examples in `X` after each
+        boosting iteration, starting from the base estimator.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            The training data of `N` examples, each with `M` features
+
+        Yields
+        ------
+        preds : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The integer class labels predicted for each example in `X` if
+            ``self.classifier = True``, otherwise the predicted target values,
+            using the learners from all iterations up to the current one.
+        """
+        for Y_pred in self._staged_scores(X):
+            yield Y_pred.argmax(axis=1) if self.classifier else Y_pred.copy()
@@ -1,16 +1,116 @@
+import os
+import warnings
+from multiprocessing import Pool
+
 import numpy as np
-from .dt import DecisionTree
+from .dt import DecisionTree, bin_features
+
+
+def prediction_error(Y, Y_pred, classifier=True):
+    """
+    The misclassification rate (if `classifier` is True) or mean squared error
+    of the predictions `Y_pred` for targets `Y`.
+    """
+    if classifier:
+        return np.mean(Y != Y_pred)
+    return np.mean((Y - Y_pred) ** 2)
+
+
+#######################################################################
+#                          Parallel Workers                           #
+#######################################################################
+
+# data shared with each worker process when the pool is created, so that it
+# is not re-sent with every task
+_shared = {}
+
+# below this many (example, tree) pairs, starting a pool costs more than
+# predicting serially
+_MIN_PARALLEL_PREDICT = 2 ** 20
+
+
+def _init_worker(shared):
+    _shared.clear()
+    _shared.update(shared)
+
+
+def _fit_tree(seed):
+    """
+    Fit a single decision tree to a bootstrap sample of the shared data. If
+    ``_shared["oob_score"]`` is True, also return the indices of the
+    out-of-bag examples, the tree's predictions on them, and the permutation
+    importance of each feature on them.
+    """
+    X, Y, X_binned = _shared["X"], _shared["Y"], _shared["X_binned"]
+
+    N = len(Y)
+    rng = np.random.default_rng(seed)
+    idxs = rng.choice(N, N, replace=True)
+    tree = DecisionTree(seed=rng, **_shared["tree_kwargs"])
+
+    # fit on the bootstrap indices directly rather than a copy of the sample
+    if X_binned is not None:
+        tree._fit_binned(X_binned, _shared["bin_edges"], Y, idxs)
+    else:
+        tree._fit(X, Y, idxs)
+
+    if not _shared["oob_score"]:
+        return tree, None, None, None
+
+    oob = np.flatnonzero(np.bincount(idxs, minlength=N) == 0)
+    X_oob, Y_oob = X[oob], Y[oob]
+    oob_preds = tree.predict(X_oob)
+
+    # permutation importance: the increase in the tree's OOB error when the
+    # values of a feature are shuffled across the OOB examples
+    importances = np.zeros(X.shape[1])
+    if len(oob) > 0:
+        base_error = prediction_error(Y_oob, oob_preds, tree.classifier)
+        for j in range(X.shape[1]):
+            X_perm = X_oob.copy()
+            X_perm[:, j] = rng.permutation(X_perm[:, j])
+            perm_preds = tree.predict(X_perm)
+            perm_error = prediction_error(Y_oob, perm_preds, tree.classifier)
+            importances[j] = perm_error - base_error
+    return tree, oob, oob_preds, importances
 
 
-def bootstrap_sample(X, Y):
-    N, M = X.shape
-    idxs = np.random.choice(N, N, replace=True)
-    return X[idxs], Y[idxs]
+def _predict_tree(tree):
+    """Return a single tree's predictions on the shared data"""
+    return tree.predict(_shared["X"])
+
+
+def _map(func, items, n_jobs, **shared):
+    """
+    Apply `func` to each entry in `items`, serially if `n_jobs` is 1 or using
+    a pool of `n_jobs` processes otherwise. The keyword arguments in `shared`
+    are made available to `func` via the module-level `_shared` dict.
+    """
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    if n_jobs is None or n_jobs == 1:
+        _init_worker(shared)
+        try:
+            return [func(item) for item in items]
+        finally:
+            _shared.clear()
+
+    chunksize = max(1, len(items) // (4 * n_jobs))
+    with Pool(n_jobs, initializer=_init_worker, initargs=(shared,)) as pool:
+        return pool.map(func, items, chunksize=chunksize)
 
 
 class RandomForest:
     def __init__(
-        self, n_trees, max_depth, n_feats, classifier=True, criterion="entropy"
+        self,
+        n_trees,
+        max_depth,
+        n_feats,
+        classifier=True,
+        criterion="entropy",
+        max_bins=None,
+        n_jobs=1,
+        seed=None,
+        oob_score=False,
     ):
         """
         An ensemble (forest) of decision trees where each split is calculated
@@ -33,10 +133,38 @@ class RandomForest:
             learner. When ``classifier = False``, valid entries are {'mse'}.
             When ``classifier = True``, valid entries are {'entropy', 'gini'}.
             Default is 'entropy'.
+        max_bins : int or None
+            If not None, quantize each feature into at most `max_bins` bins
+            once before fitting and grow each tree using histogram-based split
+            search over the resulting bin codes. Default is None.
+        n_jobs : int or None
+            The number of processes to use when fitting and predicting with
+            the individual trees. If -1, use all available CPUs. If 1 or None,
+            run serially. Predictions for small inputs are always computed
+            serially, since starting the pool would dominate. Default is 1.
+        seed : int or None
+            Master seed for the forest. Each tree draws its bootstrap sample
+            and feature subsets from its own generator, seeded from a
+            sequence spawned from `seed`, so results do not depend on
+            `n_jobs`. Default is None.
+        oob_score : bool
+            Whether to use the examples left out of each tree's bootstrap
+            sample to estimate the generalization error of the forest
+            (`self.oob_error`) and the permutation importance of each feature
+            (`self.permutation_importances`) while fitting. If no example is
+            left out of any tree's bootstrap sample, both are set to None.
+            Default is False.
         """
         self.trees = []
+        self.oob_error = None
+        self.feature_importances = None
+        self.permutation_importances = None
         self.n_trees = n_trees
         self.n_feats = n_feats
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.oob_score = oob_score
+        self.max_bins = max_bins
         self.max_depth = max_depth
         self.criterion = criterion
         self.classifier = classifier
@@ -46,17 +174,69 @@ class RandomForest:
         Create `n_trees`-worth of bootstrapped samples from the training data
         and use each to fit a separate decision tree.
         """
-        self.trees = []
-        for _ in range(self.n_trees):
-            X_samp, Y_samp = bootstrap_sample(X, Y)
-            tree = DecisionTree(
-                n_feats=self.n_feats,
-                max_depth=self.max_depth,
-                criterion=self.criterion,
-                classifier=self.classifier,
-            )
-            tree.fit(X_samp, Y_samp)
-            self.trees.append(tree)
+        X_binned, bin_edges = None, None
+        if self.max_bins is not None:
+            X_binned, bin_edges = bin_features(X, self.max_bins)
+
+        tree_kwargs = {
+            "n_feats": self.n_feats,
+            "max_depth": self.max_depth,
+            "criterion": self.criterion,
+            "classifier": self.classifier,
+            "max_bins": self.max_bins,
+        }
+
+        seeds = np.random.SeedSequence(self.seed).spawn(self.n_trees)
+        results = _map(
+            _fit_tree,
+            seeds,
+            self.n_jobs,
+            X=X,
+            Y=Y,
+            X_binned=X_binned,
+            bin_edges=bin_edges,
+            tree_kwargs=tree_kwargs,
+            oob_score=self.oob_score,
+        )
+
+        self.trees = [tree for tree, _, _, _ in results]
+        importances = [t.feature_importances for t in self.trees]
+        self.feature_importances = np.mean(importances, axis=0)
+
+        if self.oob_score:
+            self._oob_estimates(Y, results)
+
+    def _oob_estimates(self, Y, results):
+        """
+        Aggregate the predictions of each tree on its out-of-bag examples into
+        an estimate of the forest's generalization error, and average the
+        per-tree permutation importances.
+        """
+        N = len(Y)
+        if self.classifier:
+            votes = np.zeros((N, max(Y) + 1))
+            for _, oob, preds, _ in results:
+                votes[oob, preds] += 1
+            has_oob = votes.sum(axis=1) > 0
+            oob_preds = votes[has_oob].argmax(axis=1)
+        else:
+            totals, counts = np.zeros(N), np.zeros(N)
+            for _, oob, preds, _ in results:
+                totals[oob] += preds
+                counts[oob] += 1
+            has_oob = counts > 0
+            oob_preds = totals[has_oob] / counts[has_oob]
+
+        if not has_oob.any():
+            warnings.warn("No out-of-bag examples; oob_error will be None")
+            self.oob_error, self.permutation_importances = None, None
+            return
+
+        self.oob_error = prediction_error(Y[has_oob], oob_preds, self.classifier)
+
+        # trees without out-of-bag examples have no permutation importances
+        importances = [imp for _, oob, _, imp in results if len(oob) > 0]
+        self.permutation_importances = np.mean(importances, axis=0)
 
     def predict(self, X):
         """
@@ -72,7 +252,10 @@ class RandomForest:
         y_pred : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
             Model predictions for each entry in `X`.
         """
-        tree_preds = np.array([[t._traverse(x, t.root) for x in X] for t in self.trees])
+        n_jobs = self.n_jobs
+        if len(X) * len(self.trees) < _MIN_PARALLEL_PREDICT:
+            n_jobs = 1
+        tree_preds = np.array(_map(_predict_tree, self.trees, n_jobs, X=X))
         return self._vote(tree_preds)
 
     def _vote(self, predictions):
@@ -1,10 +1,20 @@
+import os
 import heapq
 from copy import copy
+from functools import partial
 from collections import Hashable
 
 import numpy as np
 
-from .distance_metrics import euclidean
+from .kernels import KernelInitializer, RBFKernel
+from .distance_metrics import (
+    euclidean,
+    manhattan,
+    chebyshev,
+    minkowski,
+    hamming,
+    pairwise,
+)
 
 #######################################################################
 #                           Priority Queue                            #
@@ -173,25 +183,20 @@ class PriorityQueue:
 #######################################################################
 
 
-class BallTreeNode:
-    def __init__(self, centroid=None, X=None, y=None):
-        self.left = None
-        self.right = None
-        self.radius = None
-        self.is_leaf = False
-
-        self.data = X
-        self.targets = y
-        self.centroid = centroid
+# distance metrics which broadcast over the leading axes of their arguments
+_BATCHED_METRICS = {euclidean, manhattan, chebyshev, minkowski, hamming}
 
-    def __repr__(self):
-        fstr = "BallTreeNode(centroid={}, is_leaf={})"
-        return fstr.format(self.centroid, self.is_leaf)
 
-    def to_dict(self):
-        d = self.__dict__
-        d["id"] = "BallTreeNode"
-        return d
+def _pair_distances(metric, X, Y):
+    """
+    Compute the `(N, N')` matrix of `metric` distances between each row of `X`
+    and each row of `Y`. Built-in metrics are evaluated in blocks; any other
+    callable is evaluated one pair at a time.
+    """
+    func = metric.func if isinstance(metric, partial) else metric
+    if func in _BATCHED_METRICS:
+        return pairwise(X, Y, metric, dtype=np.float64)
+    return np.array([[metric(x, y) for y in Y] for x in X])
 
 
 class BallTree:
@@ -210,6 +215,11 @@ class BallTree:
         from the ball's center. Each leaf node in the tree defines a ball and
         enumerates all data points inside that ball.
 
+        The tree is stored as a collection of flat arrays. The training points
+        are permuted so that the points below each node occupy a contiguous
+        block ``data[node_start[i] : node_end[i]]``, and node `i` is a leaf
+        iff ``left[i] == -1``. The root is node 0.
+
         Parameters
         ----------
         leaf_size : int
@@ -219,6 +229,24 @@ class BallTree:
             None, use the :func:`~numpy_ml.utils.distance_metrics.euclidean`
             metric. Default is None.
 
+        Attributes
+        ----------
+        data : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            The training points, permuted into tree order.
+        targets : :py:class:`ndarray <numpy.ndarray>` of shape `(N, \\*)` or None
+            The targets associated with the entries in `data`.
+        idx_array : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)`
+            The row index in the original training array of each entry in
+            `data`.
+        node_start, node_end : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The range of entries in `data` below each node.
+        centroids : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes, M)`
+            The center of each node's ball.
+        radii : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The radius of each node's ball.
+        left, right : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The index of the left and right child of each node (-1 for leaves).
+
         References
         ----------
         .. [1] Omohundro, S. M. (1989). "Five balltree construction algorithms". *ICSI
@@ -227,10 +255,23 @@ class BallTree:
            high-dimensional nonparametric classification". *J. Mach. Learn. Res.,
            7*, 1135-1158.
         """
-        self.root = None
         self.leaf_size = leaf_size
         self.metric = metric if metric is not None else euclidean
 
+        self.data = None
+        self.targets = None
+        self.idx_array = None
+        self.node_start = None
+        self.node_end = None
+        self.centroids = None
+        self.radii = None
+        self.left = None
+        self.right = None
+
+    @property
+    def n_nodes(self):
+        return len(self.radii)
+
     def fit(self, X, y=None):
         """
         Build a ball tree recursively using the O(M log N) `k`-d construction
@@ -250,44 +291,500 @@ class BallTree:
             An array of target values / labels associated with the entries in
             `X`. Default is None.
         """
-        centroid, left_X, left_y, right_X, right_y = self._split(X, y)
-        self.root = BallTreeNode(centroid=centroid)
-        self.root.radius = np.max([self.metric(centroid, x) for x in X])
-        self.root.left = self._build_tree(left_X, left_y)
-        self.root.right = self._build_tree(right_X, right_y)
-
-    def _build_tree(self, X, y):
-        centroid, left_X, left_y, right_X, right_y = self._split(X, y)
-
-        if X.shape[0] <= self.leaf_size:
-            leaf = BallTreeNode(centroid=centroid, X=X, y=y)
-            leaf.radius = np.max([self.metric(centroid, x) for x in X])
-            leaf.is_leaf = True
-            return leaf
-
-        node = BallTreeNode(centroid=centroid)
-        node.radius = np.max([self.metric(centroid, x) for x in X])
-        node.left = self._build_tree(left_X, left_y)
-        node.right = self._build_tree(right_X, right_y)
-        return node
-
-    def _split(self, X, y=None):
-        # find the dimension with greatest variance
-        split_dim = np.argmax(np.var(X, axis=0))
+        self._nodes = []
+        self.idx_array = np.arange(X.shape[0])
+        self._build_tree(X, 0, X.shape[0])
+
+        start, end, centroids, radii, left, right = zip(*self._nodes)
+        self.node_start = np.array(start)
+        self.node_end = np.array(end)
+        self.centroids = np.array(centroids)
+        self.radii = np.array(radii)
+        self.left = np.array(left)
+        self.right = np.array(right)
+        del self._nodes
+
+        self.data = X[self.idx_array]
+        self.targets = y[self.idx_array] if y is not None else None
+
+    def _build_tree(self, X, start, end):
+        """
+        Add the node for entries `start` to `end` of ``self.idx_array`` (and,
+        recursively, its children) to the tree, reordering these entries so
+        that the points in the left child come first. Returns the index of
+        the new node.
+        """
+        rows = self.idx_array[start:end]
+        X_node = X[rows]
+        centroid, left, right = self._split(X_node)
+
+        node_id = len(self._nodes)
+        node = [start, end, centroid, self._radius(centroid, X_node), -1, -1]
+        self._nodes.append(node)
 
-        # sort X and y along split_dim
-        sort_ixs = np.argsort(X[:, split_dim])
-        X, y = X[sort_ixs], y[sort_ixs] if y is not None else None
+        if end - start > self.leaf_size:
+            self.idx_array[start:end] = rows[np.concatenate([left, right])]
+            node[4] = self._build_tree(X, start, start + len(left))
+            node[5] = self._build_tree(X, start + len(left), end)
+        return node_id
 
-        # divide at median value of split_dim
+    def _split(self, X):
+        """
+        Split the rows of `X` into two halves at the median value of the
+        feature with the greatest variance. Returns the median point (the
+        centroid) along with the row indices of the left and right halves.
+        The median always appears in the right half.
+        """
+        split_dim = np.argmax(np.var(X, axis=0))
+
+        # partitioning around the median only guarantees that entries before
+        # med_ix are <= the median and entries after it are >= the median,
+        # which is all a split needs
         med_ix = X.shape[0] // 2
-        centroid = X[med_ix]  # , split_dim
+        part_ixs = np.argpartition(X[:, split_dim], med_ix)
+        centroid = X[part_ixs[med_ix]]
+        return centroid, part_ixs[:med_ix], part_ixs[med_ix:]
+
+    def _distances(self, x, X):
+        """
+        Compute the distance between the vector `x` and each row of `X`.
+        Built-in metrics are evaluated on the whole array at once; any other
+        callable is evaluated one row at a time.
+        """
+        metric = self.metric
+        if isinstance(metric, partial):
+            metric = metric.func
+
+        if metric in _BATCHED_METRICS:
+            return self.metric(X, x)
+        return np.array([self.metric(x, xi) for xi in X])
+
+    def _radius(self, centroid, X):
+        """The distance from `centroid` to the farthest point in `X`"""
+        return np.max(self._distances(centroid, X))
+
+    def _pair_distances(self, X, Y):
+        """
+        Compute the `(N, N')` matrix of distances between each row of `X` and
+        each row of `Y`.
+        """
+        return _pair_distances(self.metric, X, Y)
+
+    def _leaf_points(self, node):
+        """The slice of ``self.data`` holding the points in leaf `node`"""
+        return slice(self.node_start[node], self.node_end[node])
+
+    def save(self, dirpath):
+        """
+        Save the tree arrays to the directory `dirpath`, one ``.npy`` file per
+        array. The metric is not saved.
+        """
+        os.makedirs(dirpath, exist_ok=True)
+        arrays = {
+            "data": self.data,
+            "idx_array": self.idx_array,
+            "node_start": self.node_start,
+            "node_end": self.node_end,
+            "centroids": self.centroids,
+            "radii": self.radii,
+            "left": self.left,
+            "right": self.right,
+            "leaf_size": np.array(self.leaf_size),
+        }
+        if self.targets is not None:
+            arrays["targets"] = self.targets
+
+        for name, arr in arrays.items():
+            np.save(os.path.join(dirpath, name + ".npy"), arr)
+
+    @staticmethod
+    def load(dirpath, metric=None, mmap_mode="r"):
+        """
+        Load a :class:`BallTree` saved via :meth:`BallTree.save`.
+
+        Parameters
+        ----------
+        dirpath : str
+            The directory the tree was saved to.
+        metric : :doc:`Distance metric <numpy_ml.utils.distance_metrics>` or None
+            The distance metric the tree was built with. If None, use the
+            :func:`~numpy_ml.utils.distance_metrics.euclidean` metric. Default
+            is None.
+        mmap_mode : {None, 'r', 'r+', 'c'}
+            Passed to :func:`numpy.load`. With the default 'r', the arrays are
+            memory-mapped read-only rather than read into memory, so processes
+            loading the same tree share a single copy of it. Default is 'r'.
+
+        Returns
+        -------
+        tree : :class:`BallTree` instance
+            The loaded tree.
+        """
+        def _load(name):
+            return np.load(os.path.join(dirpath, name + ".npy"), mmap_mode=mmap_mode)
+
+        tree = BallTree(leaf_size=int(_load("leaf_size")), metric=metric)
+        for name in [
+            "data",
+            "idx_array",
+            "node_start",
+            "node_end",
+            "centroids",
+            "radii",
+            "left",
+            "right",
+        ]:
+            setattr(tree, name, _load(name))
+
+        if os.path.exists(os.path.join(dirpath, "targets.npy")):
+            tree.targets = _load("targets")
+        return tree
+
+    def query(self, X, k, batch_size=1024):
+        """
+        Find the `k` nearest neighbors in the ball tree to each row of `X`.
+
+        Notes
+        -----
+        The queries in each batch descend the tree together. At each node the
+        queries whose current `k`-th nearest neighbor is closer than the ball
+        are dropped, and at each leaf the distances between the remaining
+        queries and the points in the leaf are computed as a single block and
+        merged into the running top-`k` arrays.
 
-        # split data into two halves at the centroid (median always appears on
-        # the right split)
-        left_X, left_y = X[:med_ix], y[:med_ix] if y is not None else None
-        right_X, right_y = X[med_ix:], y[med_ix:] if y is not None else None
-        return centroid, left_X, left_y, right_X, right_y
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N', M)`
+            The query vectors.
+        k : int
+            The number of closest points to return for each query.
+        batch_size : int
+            The maximum number of queries to send down the tree at once.
+            Larger batches amortize more of the traversal overhead at the cost
+            of larger leaf distance blocks. Default is 1024.
+
+        Returns
+        -------
+        distances : :py:class:`ndarray <numpy.ndarray>` of shape `(N', k)`
+            The distances from each query to its `k` nearest neighbors, in
+            ascending order.
+        indices : :py:class:`ndarray <numpy.ndarray>` of shape `(N', k)`
+            The row indices (in the array passed to :meth:`fit`) of the `k`
+            nearest neighbors of each query.
+        """
+        X = np.atleast_2d(X)
+        distances = np.full((X.shape[0], k), np.inf)
+        indices = np.full((X.shape[0], k), -1, dtype=int)
+
+        for start in range(0, X.shape[0], batch_size):
+            batch = slice(start, start + batch_size)
+            Q, best_d, best_i = X[batch], distances[batch], indices[batch]
+            q = np.arange(Q.shape[0])
+
+            # bound each query's k-th neighbor distance by the k-th closest
+            # point in the leaf it falls into before searching the full tree
+            bound = np.full(Q.shape[0], np.inf)
+            self._descend(0, Q, q, k, bound)
+
+            d = self._distances(self.centroids[0], Q)
+            self._query(0, Q, q, d, bound, best_d, best_i)
+        return distances, indices
+
+    def _descend(self, node, Q, q, k, bound):
+        """
+        Send each of the queries `Q[q]` down the tree toward its closest
+        centroid and set `bound` to the distance to the `k`-th closest point
+        in the leaf it reaches.
+        """
+        left, right = self.left[node], self.right[node]
+        if left == -1:
+            points = self.data[self._leaf_points(node)]
+            if len(points) >= k:
+                D = self._pair_distances(Q[q], points)
+                bound[q] = np.partition(D, k - 1, axis=1)[:, k - 1]
+            return
+
+        d_l = self._distances(self.centroids[left], Q[q])
+        d_r = self._distances(self.centroids[right], Q[q])
+        l_closest = d_l < d_r
+        if l_closest.any():
+            self._descend(left, Q, q[l_closest], k, bound)
+        if not l_closest.all():
+            self._descend(right, Q, q[~l_closest], k, bound)
+
+    def _query(self, node, Q, q, d, bound, best_d, best_i):
+        """
+        Update the running top-`k` arrays `best_d` and `best_i` for the
+        queries `Q[q]` with the points below `node`, given the distances `d`
+        from each of these queries to the node's centroid.
+        """
+        # drop queries which already have k neighbors closer than the ball
+        lower = d - self.radii[node]
+        keep = (lower < best_d[q, -1]) & (lower <= bound[q])
+        q, d = q[keep], d[keep]
+        if len(q) == 0:
+            return
+
+        left, right = self.left[node], self.right[node]
+        if left == -1:
+            k = best_d.shape[1]
+            points = self._leaf_points(node)
+            leaf_d = self._pair_distances(Q[q], self.data[points])
+            leaf_i = np.broadcast_to(self.idx_array[points], leaf_d.shape)
+            cand_d = np.hstack([best_d[q], leaf_d])
+            cand_i = np.hstack([best_i[q], leaf_i])
+            order = np.argsort(cand_d, axis=1, kind="stable")[:, :k]
+            best_d[q] = np.take_along_axis(cand_d, order, axis=1)
+            best_i[q] = np.take_along_axis(cand_i, order, axis=1)
+            return
+
+        # visit the child which is closer to most of the queries first so that
+        # their top-k arrays tighten before the farther child is checked
+        d_l = self._distances(self.centroids[left], Q[q])
+        d_r = self._distances(self.centroids[right], Q[q])
+        children = [(left, d_l), (right, d_r)]
+        if np.mean(d_l < d_r) < 0.5:
+            children = children[::-1]
+        for child, d_child in children:
+            self._query(child, Q, q, d_child, bound, best_d, best_i)
+
+    def query_radius(self, X, r, return_distance=False, batch_size=1024):
+        """
+        Find all points in the ball tree within distance `r` of each row of
+        `X`.
+
+        Notes
+        -----
+        Balls which lie entirely outside the query radius are skipped, and
+        balls which lie entirely inside it are returned whole without
+        computing any distances (unless `return_distance` is True).
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N', M)`
+            The query vectors.
+        r : float or :py:class:`ndarray <numpy.ndarray>` of shape `(N',)`
+            The radius to search within for all queries or for each query.
+        return_distance : bool
+            Whether to also return the distance from each query to each of
+            the points found. If True, the results for each query are sorted
+            by distance. Default is False.
+        batch_size : int
+            The maximum number of queries to send down the tree at once.
+            Default is 1024.
+
+        Returns
+        -------
+        indices : :py:class:`ndarray <numpy.ndarray>` of shape `(N',)`
+            An object array whose `i` th entry holds the row indices (in the
+            array passed to :meth:`fit`) of the points within `r` of ``X[i]``.
+        distances : :py:class:`ndarray <numpy.ndarray>` of shape `(N',)`
+            An object array whose `i` th entry holds the distances between
+            ``X[i]`` and the points in ``indices[i]``. Only returned if
+            `return_distance` is True.
+        """
+        X = np.atleast_2d(X)
+        r = np.broadcast_to(r, X.shape[0])
+
+        # (query id, point index, distance) arrays for each block of matches
+        found = []
+        for start in range(0, X.shape[0], batch_size):
+            batch = slice(start, start + batch_size)
+            Q, q = X[batch], np.arange(len(r[batch]))
+            d = self._distances(self.centroids[0], Q)
+
+            matches = []
+            self._query_radius(0, Q, q, d, r[batch], return_distance, matches)
+            found.extend((qs + start, ixs, ds) for qs, ixs, ds in matches)
+
+        queries = np.concatenate([f[0] for f in found] + [np.zeros(0, dtype=int)])
+        idxs = np.concatenate([f[1] for f in found] + [np.zeros(0, dtype=int)])
+        if return_distance:
+            dists = np.concatenate([f[2] for f in found] + [np.zeros(0)])
+            order = np.lexsort((dists, queries))
+        else:
+            order = np.argsort(queries, kind="stable")
+
+        splits = np.cumsum(np.bincount(queries, minlength=X.shape[0]))[:-1]
+        indices = np.empty(X.shape[0], dtype=object)
+        indices[:] = np.split(idxs[order], splits)
+        if not return_distance:
+            return indices
+
+        distances = np.empty(X.shape[0], dtype=object)
+        distances[:] = np.split(dists[order], splits)
+        return indices, distances
+
+    def _query_radius(self, node, Q, q, d, r, return_distance, matches):
+        """
+        Append the points below `node` within distance `r` of each of the
+        queries `Q[q]` to `matches`, given the distances `d` from each of
+        these queries to the node's centroid.
+        """
+        keep = d - self.radii[node] <= r[q]
+        q, d = q[keep], d[keep]
+        if len(q) == 0:
+            return
+
+        points = self._leaf_points(node)
+        idxs = self.idx_array[points]
+        if not return_distance:
+            # the whole ball lies within the radius of these queries
+            inside = d + self.radii[node] <= r[q]
+            if inside.any():
+                q_in = q[inside]
+                q_rep = np.repeat(q_in, len(idxs))
+                matches.append((q_rep, np.tile(idxs, len(q_in)), None))
+                q, d = q[~inside], d[~inside]
+                if len(q) == 0:
+                    return
+
+        left, right = self.left[node], self.right[node]
+        if left == -1:
+            D = self._pair_distances(Q[q], self.data[points])
+            rows, cols = np.nonzero(D <= r[q][:, None])
+            matches.append((q[rows], idxs[cols], D[rows, cols]))
+            return
+
+        for child in [left, right]:
+            d_child = self._distances(self.centroids[child], Q[q])
+            self._query_radius(child, Q, q, d_child, r, return_distance, matches)
+
+    def kernel_density(
+        self,
+        X,
+        kernel="RBFKernel",
+        bandwidth=None,
+        atol=0,
+        rtol=0,
+        weights=None,
+        batch_size=1024,
+    ):
+        """
+        Estimate the kernel density of the points in the ball tree at each
+        row of `X`.
+
+        Notes
+        -----
+        The kernel density estimate at a query point **x** is
+
+        .. math::
+
+            \\hat{f}(\mathbf{x}) = \\frac{1}{N} \sum_i w_i k(\mathbf{x}, \mathbf{x}_i)
+
+        The kernel value at every point in a ball lies between the kernel
+        evaluated at the nearest and farthest points of the ball. If these
+        bounds are close enough, the ball's contribution is approximated from
+        them without visiting the points inside it. Balls are pruned so that
+        the error in the unweighted estimate is at most ``atol + rtol * f(x)``.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N', M)`
+            The query vectors.
+        kernel : str, :doc:`Kernel <numpy_ml.utils.kernels>` object, or dict
+            The kernel to use. Currently only
+            :class:`~numpy_ml.utils.kernels.RBFKernel` with a scalar `sigma`
+            is supported, and the ball tree must use the
+            :func:`~numpy_ml.utils.distance_metrics.euclidean` metric. Note
+            that the RBF kernel is not normalized. Default is 'RBFKernel'.
+        bandwidth : float or None
+            The kernel bandwidth. If not None, this overrides the `sigma`
+            parameter of `kernel`. Default is None.
+        atol : float
+            The absolute error tolerance. Default is 0.
+        rtol : float
+            The relative error tolerance. Default is 0.
+        weights : :py:class:`ndarray <numpy.ndarray>` of shape `(N,)` or `(N, W)` or None
+            The weight of each point passed to :meth:`fit`. If two-dimensional,
+            a separate estimate is computed for each column. If None, use unit
+            weights. Default is None.
+        batch_size : int
+            The maximum number of queries to send down the tree at once.
+            Default is 1024.
+
+        Returns
+        -------
+        density : :py:class:`ndarray <numpy.ndarray>` of shape `(N',)` or `(N', W)`
+            The kernel density estimate at each row of `X`.
+        """
+        kernel = KernelInitializer(kernel)()
+        if kernel.hyperparameters["id"] != "RBFKernel":
+            raise ValueError("kernel_density only supports RBFKernel")
+        if self.metric is not euclidean:
+            raise ValueError("kernel_density requires the euclidean metric")
+
+        X = np.atleast_2d(X)
+        N, M = self.data.shape
+        sigma = kernel.parameters["sigma"] if bandwidth is None else bandwidth
+        sigma = np.sqrt(M / 2) if sigma is None else sigma
+        if np.ndim(sigma) != 0:
+            raise ValueError("kernel_density requires a scalar bandwidth")
+        kernel = RBFKernel(sigma=sigma)
+
+        W = np.ones((N, 1)) if weights is None else np.asarray(weights, dtype=float)
+        W = W.reshape(N, -1)[self.idx_array]
+
+        # prefix sums give the total weight below any node in O(1)
+        W_cum = np.vstack([np.zeros((1, W.shape[1])), np.cumsum(W, axis=0)])
+        weight_sums, tol = (W, W_cum), (atol, rtol)
+
+        sums = np.zeros((X.shape[0], W.shape[1]))
+        for start in range(0, X.shape[0], batch_size):
+            batch = slice(start, start + batch_size)
+            Q = X[batch]
+            q, lower = np.arange(Q.shape[0]), np.zeros(Q.shape[0])
+            d = self._distances(self.centroids[0], Q)
+            self._kernel_sums(0, kernel, Q, q, d, weight_sums, tol, sums[batch], lower)
+
+        density = sums / N
+        return density.ravel() if weights is None or np.ndim(weights) == 1 else density
+
+    def _kernel_sums(self, node, kernel, Q, q, d, weights, tol, sums, lower):
+        """
+        Add the weighted kernel sums between the queries `Q[q]` and the
+        points below `node` to `sums`, given the distances `d` from each of
+        these queries to the node's centroid. `lower` holds a running lower
+        bound on each query's unweighted kernel sum.
+        """
+        (W, W_cum), (atol, rtol) = weights, tol
+        N = W.shape[0]
+        start, end = self.node_start[node], self.node_end[node]
+
+        # bound the kernel value at each point in the ball by its value at
+        # the nearest and farthest possible distances from each query
+        radius = self.radii[node]
+        d_near = np.maximum(d - radius, 0)
+        k_max = kernel(np.zeros((1, 1)), d_near[:, None])[0]
+        k_min = kernel(np.zeros((1, 1)), (d + radius)[:, None])[0]
+
+        # approximate the ball by the midpoint of the bounds if the error this
+        # introduces is within this ball's share of the tolerance
+        prune = k_max - k_min <= 2 * (atol + rtol * lower[q] / N)
+        if prune.any():
+            k_mid = (k_max[prune] + k_min[prune]) / 2
+            sums[q[prune]] += k_mid[:, None] * (W_cum[end] - W_cum[start])
+            lower[q[prune]] += k_min[prune] * (end - start)
+            q, d = q[~prune], d[~prune]
+            if len(q) == 0:
+                return
+
+        left, right = self.left[node], self.right[node]
+        if left == -1:
+            K = kernel(Q[q], self.data[start:end])
+            sums[q] += K @ W[start:end]
+            lower[q] += K.sum(axis=1)
+            return
+
+        # visit the child which is closer to most of the queries first so
+        # that their lower bounds grow as quickly as possible
+        d_l = self._distances(self.centroids[left], Q[q])
+        d_r = self._distances(self.centroids[right], Q[q])
+        children = [(left, d_l), (right, d_r)]
+        if np.mean(d_l < d_r) < 0.5:
+            children = children[::-1]
+        for child, d_child in children:
+            self._kernel_sums(child, kernel, Q, q, d_child, weights, tol, sums, lower)
 
     def nearest_neighbors(self, k, x):
         """
@@ -311,33 +808,546 @@ class BallTree:
         """
         # maintain a max-first priority queue with priority = distance to x
         PQ = PriorityQueue(capacity=k, heap_order="max")
-        nearest = self._knn(k, x, PQ, self.root)
+        nearest = self._knn(k, x, PQ, 0)
         for n in nearest:
-            n.distance = self.metric(x, n.key)
+            n.distance = -n.priority
         return nearest
 
-    def _knn(self, k, x, PQ, root):
+    def _knn(self, k, x, PQ, node):
         dist = self.metric
-        dist_to_ball = dist(x, root.centroid) - root.radius
-        dist_to_farthest_neighbor = dist(x, PQ.peek()["key"]) if len(PQ) > 0 else np.inf
+        dist_to_ball = dist(x, self.centroids[node]) - self.radii[node]
+
+        # the queue priority is already the distance to the farthest neighbor
+        dist_to_farthest_neighbor = PQ.peek()["priority"] if len(PQ) > 0 else np.inf
 
         if dist_to_ball >= dist_to_farthest_neighbor and len(PQ) == k:
             return PQ
-        if root.is_leaf:
-            targets = [None] * len(root.data) if root.targets is None else root.targets
-            for point, target in zip(root.data, targets):
-                dist_to_x = dist(x, point)
-                if len(PQ) == k and dist_to_x < dist_to_farthest_neighbor:
-                    PQ.push(key=point, val=target, priority=dist_to_x)
-                else:
-                    PQ.push(key=point, val=target, priority=dist_to_x)
+
+        left, right = self.left[node], self.right[node]
+        if left == -1:
+            points = self._leaf_points(node)
+            data = self.data[points]
+            targets = [None] * len(data)
+            if self.targets is not None:
+                targets = self.targets[points]
+            dists = self._distances(x, data)
+            for point, target, dist_to_x in zip(data, targets, dists):
+                PQ.push(key=point, val=target, priority=dist_to_x)
         else:
-            l_closest = dist(x, root.left.centroid) < dist(x, root.right.centroid)
-            PQ = self._knn(k, x, PQ, root.left if l_closest else root.right)
-            PQ = self._knn(k, x, PQ, root.right if l_closest else root.left)
+            l_closest = dist(x, self.centroids[left]) < dist(x, self.centroids[right])
+            PQ = self._knn(k, x, PQ, left if l_closest else right)
+            PQ = self._knn(k, x, PQ, right if l_closest else left)
         return PQ
 
 
+#######################################################################
+#                      Random Projection Forest                       #
+#######################################################################
+
+
+class RandomProjectionForest:
+    def __init__(self, n_trees=10, leaf_size=40, metric=None, seed=None):
+        """
+        A forest of random projection trees for approximate nearest neighbor
+        search.
+
+        Notes
+        -----
+        Each tree recursively splits the data points with the hyperplane
+        bisecting two centers found by a few iterations of 2-means on a sample
+        of the points below the node, starting from two random points [1]_
+        [2]_.
+        A query is routed to one leaf in every tree, and optionally to the
+        leaves on the far side of the splits it lies closest to [2]_. The
+        distances from the query to the points in these leaves are computed
+        exactly. Since the cost of a query depends on the number of leaves
+        searched rather than on the volume of the data each node covers, the
+        forest remains efficient for high-dimensional data where a
+        :class:`BallTree` degrades to a brute-force search, at the price of
+        missing some of the true nearest neighbors.
+
+        The trees are stored as a collection of flat arrays. Node ids are
+        shared across the trees, the root of tree `t` is node ``roots[t]``,
+        and node `i` is a leaf iff ``left[i] == -1``. Unlike
+        :class:`BallTree`, the data points are not permuted, so new points can
+        be added to the leaves without rebuilding the forest.
+
+        Parameters
+        ----------
+        n_trees : int
+            The number of trees in the forest. More trees increase the recall
+            of queries at the cost of memory and query time. Default is 10.
+        leaf_size : int
+            The maximum number of datapoints at each leaf. Default is 40.
+        metric : :doc:`Distance metric <numpy_ml.utils.distance_metrics>` or None
+            The distance metric used to rank the candidate neighbors. The
+            trees themselves partition the data by Euclidean geometry. If
+            None, use the :func:`~numpy_ml.utils.distance_metrics.euclidean`
+            metric. Default is None.
+        seed : int or None
+            Seed for the random hyperplanes. Default is None.
+
+        Attributes
+        ----------
+        data : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            The indexed points.
+        targets : :py:class:`ndarray <numpy.ndarray>` of shape `(N, \\*)` or None
+            The targets associated with the entries in `data`.
+        roots : :py:class:`ndarray <numpy.ndarray>` of shape `(n_trees,)`
+            The root node of each tree.
+        normals : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes, M)`
+            The unit normal vector of each node's splitting hyperplane.
+        offsets : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The offset of each node's splitting hyperplane. A point `x` goes
+            to the right child of node `i` iff ``x @ normals[i] > offsets[i]``.
+        left, right : :py:class:`ndarray <numpy.ndarray>` of shape `(n_nodes,)`
+            The index of the left and right child of each node (-1 for leaves).
+        leaf_of : :py:class:`ndarray <numpy.ndarray>` of shape `(n_trees, N)`
+            The leaf containing each point in each tree.
+
+        References
+        ----------
+        .. [1] Dasgupta, S., & Freund, Y. (2008). "Random projection trees and
+           low dimensional manifolds". *Proceedings of the 40th Annual ACM
+           Symposium on Theory of Computing*, 537-546.
+        .. [2] Bernhardsson, E. (2013). Annoy: Approximate nearest neighbors
+           in C++/Python. https://github.com/spotify/annoy
+        """
+        self.seed = seed
+        self.n_trees = n_trees
+        self.leaf_size = leaf_size
+        self.metric = metric if metric is not None else euclidean
+        self.rng = np.random.default_rng(seed)
+
+        self.data = None
+        self.targets = None
+        self.roots = None
+        self.normals = None
+        self.offsets = None
+        self.left = None
+        self.right = None
+        self.leaf_of = None
+        self._members = None
+        self._sq_norms = None
+
+    @property
+    def n_nodes(self):
+        return len(self.offsets)
+
+    def fit(self, X, y=None):
+        """
+        Build `n_trees` random projection trees on the points in `X`.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+            An array of `N` examples each with `M` features.
+        y : :py:class:`ndarray <numpy.ndarray>` of shape `(N, \\*)` or None
+            An array of target values / labels associated with the entries in
+            `X`. Default is None.
+        """
+        N, M = X.shape
+        self.data, self.targets = X, y
+        self.leaf_of = np.zeros((self.n_trees, N), dtype=int)
+
+        nodes = {"normals": [], "offsets": [], "left": [], "right": []}
+        roots = []
+        for tree in range(self.n_trees):
+            roots.append(self._new_node(nodes, M))
+            self._grow(tree, roots[-1], np.arange(N), nodes)
+
+        self.roots = np.array(roots)
+        self._set_nodes(nodes)
+
+    def add(self, X, y=None):
+        """
+        Add the points in `X` to the forest. Each point is routed to a leaf
+        in every tree, and leaves which grow past `leaf_size` points are
+        split.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N', M)`
+            The new points.
+        y : :py:class:`ndarray <numpy.ndarray>` of shape `(N', \\*)` or None
+            The targets associated with the entries in `X`. Must be provided
+            iff the forest was fit with targets. Default is None.
+        """
+        if self.data is None:
+            return self.fit(X, y)
+
+        if (y is None) != (self.targets is None):
+            fstr = "y must be provided iff the forest was fit with targets"
+            raise ValueError(fstr)
+        if y is not None and len(y) != len(X):
+            fstr = "X and y must have the same length, but got {} and {}"
+            raise ValueError(fstr.format(len(X), len(y)))
+
+        leaves = self._descend(X, np.tile(self.roots, (X.shape[0], 1)))
+        self.data = np.vstack([self.data, X])
+        if self.targets is not None:
+            self.targets = np.concatenate([self.targets, y])
+        self.leaf_of = np.hstack([self.leaf_of, leaves.T])
+
+        nodes = {
+            "normals": list(self.normals),
+            "offsets": list(self.offsets),
+            "left": list(self.left),
+            "right": list(self.right),
+        }
+        for tree in range(self.n_trees):
+            counts = np.bincount(self.leaf_of[tree], minlength=self.n_nodes)
+            overfull = np.flatnonzero(counts > self.leaf_size)
+            if len(overfull) == 0:
+                continue
+
+            rows = np.argsort(self.leaf_of[tree], kind="stable")
+            ends = np.cumsum(counts)
+            for leaf in overfull:
+                leaf_rows = rows[ends[leaf] - counts[leaf] : ends[leaf]]
+                self._grow(tree, leaf, leaf_rows, nodes)
+        self._set_nodes(nodes)
+
+    def _new_node(self, nodes, n_features):
+        """Append an empty leaf to the node lists in `nodes` and return its id"""
+        nodes["normals"].append(np.zeros(n_features))
+        nodes["offsets"].append(0.0)
+        nodes["left"].append(-1)
+        nodes["right"].append(-1)
+        return len(nodes["left"]) - 1
+
+    def _set_nodes(self, nodes):
+        """Store the node lists in `nodes` as flat arrays"""
+        self.normals = np.array(nodes["normals"])
+        self.offsets = np.array(nodes["offsets"])
+        self.left = np.array(nodes["left"])
+        self.right = np.array(nodes["right"])
+        self._members = None
+        self._sq_norms = None
+
+    def _grow(self, tree, node, rows, nodes):
+        """
+        Split the leaf `node` of `tree`, which holds the points ``data[rows]``,
+        until every leaf below it holds at most `leaf_size` points.
+        """
+        stack = [(node, rows)]
+        while stack:
+            node, rows = stack.pop()
+            if len(rows) <= self.leaf_size:
+                self.leaf_of[tree, rows] = node
+                continue
+
+            normal, offset, go_right = self._split(self.data[rows])
+            left = self._new_node(nodes, len(normal))
+            right = self._new_node(nodes, len(normal))
+            nodes["normals"][node] = normal
+            nodes["offsets"][node] = offset
+            nodes["left"][node], nodes["right"][node] = left, right
+            stack.extend([(left, rows[~go_right]), (right, rows[go_right])])
+
+    def _split(self, X, n_iter=3, sample_size=256):
+        """
+        Return the unit normal vector and offset of a hyperplane splitting the
+        rows of `X`, along with a mask of the rows on its positive side.
+
+        The hyperplane bisects two centers found by running `n_iter`
+        iterations of 2-means on a sample of the rows, starting from two
+        random rows. If it leaves fewer than 5% of the rows on either side,
+        it is moved to the median projection instead.
+        """
+        N = X.shape[0]
+        sample = X[self.rng.choice(N, min(N, sample_size), replace=False)]
+        c1, c2 = sample[:2].astype(float)
+        for _ in range(n_iter):
+            normal = c1 - c2
+            closer = sample @ normal > (c1 @ c1 - c2 @ c2) / 2
+            if closer.all() or not closer.any():
+                break
+            c1, c2 = sample[closer].mean(axis=0), sample[~closer].mean(axis=0)
+
+        normal = c1 - c2
+        if not np.any(normal):
+            normal = self.rng.standard_normal(X.shape[1])
+        normal /= np.linalg.norm(normal)
+
+        proj = X @ normal
+        offset = normal @ (c1 + c2) / 2
+        go_right = proj > offset
+        if not 0.05 <= go_right.mean() <= 0.95:
+            half = N // 2
+            part = np.argpartition(proj, half)
+            offset = (proj[part[:half]].max() + proj[part[half]]) / 2
+            go_right = proj > offset
+            go_right[part[half:]] = True
+        return normal, offset, go_right
+
+    def _descend(self, X, node, return_path=False):
+        """
+        Route each row of `X` from each of the nodes in the corresponding row
+        of `node` down to a leaf.
+
+        Returns
+        -------
+        leaves : :py:class:`ndarray <numpy.ndarray>` of shape `(N', L)`
+            The leaf reached from each entry in `node`.
+        margins, siblings : :py:class:`ndarray <numpy.ndarray>` of shape `(N', L, depth)`
+            The distance from the query to the splitting hyperplane and the
+            child not taken at each step of the descent. Steps past a leaf
+            have a margin of infinity. Only returned if `return_path` is True.
+        """
+        node = node.copy()
+        margins, siblings = [], []
+        active = self.left[node] != -1
+        while active.any():
+            q, t = np.nonzero(active)
+            nd = node[q, t]
+            margin = np.einsum("ij,ij->i", X[q], self.normals[nd]) - self.offsets[nd]
+            left, right = self.left[nd], self.right[nd]
+            node[q, t] = np.where(margin > 0, right, left)
+            active[q, t] = self.left[node[q, t]] != -1
+
+            if return_path:
+                margins.append(np.full(node.shape, np.inf))
+                siblings.append(np.zeros_like(node))
+                margins[-1][q, t] = np.abs(margin)
+                siblings[-1][q, t] = np.where(margin > 0, left, right)
+
+        if not return_path:
+            return node
+        shape = node.shape + (len(margins),)
+        margins = np.stack(margins, axis=-1) if margins else np.zeros(shape)
+        siblings = np.stack(siblings, axis=-1) if siblings else np.zeros(shape, int)
+        return node, margins, siblings
+
+    def _index_leaves(self):
+        """
+        Group the points by leaf so that the points in leaf `i` are
+        ``_members[_leaf_start[i] : _leaf_end[i]]``.
+        """
+        keys = self.leaf_of.ravel()
+        points = np.tile(np.arange(self.data.shape[0]), self.n_trees)
+        counts = np.bincount(keys, minlength=self.n_nodes)
+        self._members = points[np.argsort(keys, kind="stable")]
+        self._leaf_end = np.cumsum(counts)
+        self._leaf_start = self._leaf_end - counts
+
+    def _candidate_distances(self, Q, q, points):
+        """
+        Compute the distance between each query ``Q[q[i]]`` and candidate
+        ``data[points[i]]``, where `q` is sorted. Only the ordering of the
+        distances for each query needs to be exact.
+        """
+        metric = self.metric
+        if isinstance(metric, partial):
+            p = metric.keywords.get("p", metric.args[0] if metric.args else None)
+            metric = euclidean if metric.func is minkowski and p == 2 else metric
+
+        if metric is not euclidean:
+            return self._paired_distances(Q[q], self.data[points])
+
+        # for the Euclidean metric, rank the candidates of each query by
+        # ||x||^2 - 2 q^T x using one matrix-vector product per query, which
+        # avoids gathering a copy of the query for every candidate
+        if self._sq_norms is None:
+            self._sq_norms = np.einsum("ij,ij->i", self.data, self.data)
+
+        d = self._sq_norms[points].astype(float)
+        bounds = np.searchsorted(q, np.arange(Q.shape[0] + 1))
+        for i in range(Q.shape[0]):
+            rows = slice(bounds[i], bounds[i + 1])
+            d[rows] -= 2 * (self.data[points[rows]] @ Q[i])
+        return d
+
+    def _paired_distances(self, X, Y, chunk_size=2 ** 22):
+        """
+        Compute the distance between each row of `X` and the corresponding
+        row of `Y`, holding at most `chunk_size` entries of each in memory.
+        """
+        metric = self.metric
+        if isinstance(metric, partial):
+            metric = metric.func
+
+        if metric not in _BATCHED_METRICS:
+            return np.array([self.metric(x, y) for x, y in zip(X, Y)])
+
+        step = max(1, chunk_size // self.data.shape[1])
+        d = [
+            self.metric(X[i : i + step], Y[i : i + step])
+            for i in range(0, len(X), step)
+        ]
+        return np.concatenate(d) if len(d) > 0 else np.zeros(0)
+
+    def save(self, dirpath):
+        """
+        Save the forest arrays to the directory `dirpath`, one ``.npy`` file
+        per array. The metric and random state are not saved.
+        """
+        os.makedirs(dirpath, exist_ok=True)
+        arrays = {
+            "data": self.data,
+            "roots": self.roots,
+            "normals": self.normals,
+            "offsets": self.offsets,
+            "left": self.left,
+            "right": self.right,
+            "leaf_of": self.leaf_of,
+            "leaf_size": np.array(self.leaf_size),
+        }
+        if self.targets is not None:
+            arrays["targets"] = self.targets
+
+        for name, arr in arrays.items():
+            np.save(os.path.join(dirpath, name + ".npy"), arr)
+
+    @staticmethod
+    def load(dirpath, metric=None, mmap_mode="r", seed=None):
+        """
+        Load a :class:`RandomProjectionForest` saved via
+        :meth:`RandomProjectionForest.save`.
+
+        Parameters
+        ----------
+        dirpath : str
+            The directory the forest was saved to.
+        metric : :doc:`Distance metric <numpy_ml.utils.distance_metrics>` or None
+            The distance metric used to rank the candidate neighbors. If None,
+            use the :func:`~numpy_ml.utils.distance_metrics.euclidean` metric.
+            Default is None.
+        mmap_mode : {None, 'r', 'r+', 'c'}
+            Passed to :func:`numpy.load`. With the default 'r', the arrays are
+            memory-mapped read-only rather than read into memory. Calling
+            :meth:`add` copies the arrays into memory. Default is 'r'.
+        seed : int or None
+            Seed for the hyperplanes of any leaves split by :meth:`add`.
+            Default is None.
+
+        Returns
+        -------
+        forest : :class:`RandomProjectionForest` instance
+            The loaded forest.
+        """
+        def _load(name):
+            return np.load(os.path.join(dirpath, name + ".npy"), mmap_mode=mmap_mode)
+
+        roots = _load("roots")
+        forest = RandomProjectionForest(
+            n_trees=len(roots),
+            leaf_size=int(_load("leaf_size")),
+            metric=metric,
+            seed=seed,
+        )
+        forest.roots = roots
+        for name in ["data", "normals", "offsets", "left", "right", "leaf_of"]:
+            setattr(forest, name, _load(name))
+
+        if os.path.exists(os.path.join(dirpath, "targets.npy")):
+            forest.targets = _load("targets")
+        return forest
+
+    def query(self, X, k, ef=None, batch_size=256):
+        """
+        Find the (approximate) `k` nearest neighbors in the forest to each row
+        of `X`.
+
+        Notes
+        -----
+        The queries in each batch descend all of the trees together, tracking
+        the distance to each splitting hyperplane along the way. Beyond the
+        leaf it reaches in each tree, each query is also sent down the far
+        side of the ``ef - n_trees`` splits (across all trees) it passed
+        closest to. The points in all of these leaves are deduplicated and
+        their distances to the query computed exactly. Queries with fewer
+        than `k` candidates fall back to an exact search over all of the
+        points.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N', M)`
+            The query vectors.
+        k : int
+            The number of closest points to return for each query.
+        ef : int or None
+            The number of leaves to search for each query. Larger values
+            increase recall at the cost of query time. If None, search one
+            leaf per tree. Default is None.
+        batch_size : int
+            The maximum number of queries to send down the forest at once.
+            Default is 256.
+
+        Returns
+        -------
+        distances : :py:class:`ndarray <numpy.ndarray>` of shape `(N', k)`
+            The distances from each query to its `k` nearest neighbors, in
+            ascending order.
+        indices : :py:class:`ndarray <numpy.ndarray>` of shape `(N', k)`
+            The row indices (in :attr:`data`) of the `k` nearest neighbors of
+            each query.
+        """
+        X = np.atleast_2d(X)
+        N = self.data.shape[0]
+        n_extra = 0 if ef is None else max(ef - self.n_trees, 0)
+        distances = np.full((X.shape[0], k), np.inf)
+        indices = np.full((X.shape[0], k), -1, dtype=int)
+
+        if self._members is None:
+            self._index_leaves()
+
+        for start in range(0, X.shape[0], batch_size):
+            batch = slice(start, start + batch_size)
+            Q, best_d, best_i = X[batch], distances[batch], indices[batch]
+            n_queries = Q.shape[0]
+
+            roots = np.tile(self.roots, (n_queries, 1))
+            leaves, margins, siblings = self._descend(Q, roots, return_path=True)
+            if n_extra > 0:
+                # descend the far side of the splits closest to each query.
+                # queries with fewer splits than `n_extra` repeat a leaf,
+                # which is deduplicated below
+                margins = margins.reshape(n_queries, -1)
+                n_flip = min(n_extra, margins.shape[1])
+                closest = np.argpartition(margins, n_flip - 1, axis=1)[:, :n_flip]
+                flip = np.take_along_axis(siblings.reshape(n_queries, -1), closest, 1)
+                valid = np.isfinite(np.take_along_axis(margins, closest, 1))
+                flip = np.where(valid, flip, leaves[:, :1])
+                leaves = np.hstack([leaves, self._descend(Q, flip)])
+
+            # gather the unique (query, point) pairs from each query's leaves
+            leaves = leaves.ravel()
+            lo, hi = self._leaf_start[leaves], self._leaf_end[leaves]
+            sizes = hi - lo
+            offsets = np.repeat(lo - np.cumsum(sizes) + sizes, sizes)
+            points = self._members[offsets + np.arange(sizes.sum())]
+            q = np.repeat(np.arange(n_queries), len(leaves) // max(n_queries, 1))
+            pairs = np.unique(np.repeat(q, sizes) * N + points)
+            q, points = pairs // N, pairs % N
+
+            # keep the k closest candidates for each query
+            d = self._candidate_distances(Q, q, points)
+            order = np.lexsort((d, q))
+            q, points = q[order], points[order]
+            rank = _group_rank(q)
+            q, points, rank = q[rank < k], points[rank < k], rank[rank < k]
+            best_d[q, rank] = self._paired_distances(Q[q], self.data[points])
+            best_i[q, rank] = points
+
+            # exact search for any queries with fewer than k candidates
+            short = np.flatnonzero(best_i[:, -1] == -1)
+            if len(short) > 0:
+                D = _pair_distances(self.metric, Q[short], self.data)
+                order = np.argsort(D, axis=1, kind="stable")[:, :k]
+                best_d[short, : order.shape[1]] = np.take_along_axis(D, order, axis=1)
+                best_i[short, : order.shape[1]] = order
+        return distances, indices
+
+
+def _group_rank(groups):
+    """
+    Return the position of each entry of the sorted array `groups` within its
+    run of equal values.
+    """
+    return np.arange(len(groups)) - np.searchsorted(groups, groups)
+
+
 #######################################################################
 #                         Multinomial Sampler                         #
 #######################################################################
@@ -1,3 +1,7 @@
+import os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 
@@ -15,15 +19,17 @@ def euclidean(x, y):
 
     Parameters
     ----------
-    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)`
-        The two vectors to compute the distance between
+    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)` or `(..., N)`
+        The two vectors to compute the distance between. If either argument
+        has more than one dimension, the arguments are broadcast against each
+        other and the distance is computed along the last axis.
 
     Returns
     -------
-    d : float
+    d : float or :py:class:`ndarray <numpy.ndarray>`
         The L2 distance between **x** and **y**.
     """
-    return np.sqrt(np.sum((x - y) ** 2))
+    return np.sqrt(np.sum((x - y) ** 2, axis=-1))
 
 
 def manhattan(x, y):
@@ -40,15 +46,17 @@ def manhattan(x, y):
 
     Parameters
     ----------
-    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)`
-        The two vectors to compute the distance between
+    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)` or `(..., N)`
+        The two vectors to compute the distance between. If either argument
+        has more than one dimension, the arguments are broadcast against each
+        other and the distance is computed along the last axis.
 
     Returns
     -------
-    d : float
+    d : float or :py:class:`ndarray <numpy.ndarray>`
         The L1 distance between **x** and **y**.
     """
-    return np.sum(np.abs(x - y))
+    return np.sum(np.abs(x - y), axis=-1)
 
 
 def chebyshev(x, y):
@@ -65,15 +73,17 @@ def chebyshev(x, y):
 
     Parameters
     ----------
-    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)`
-        The two vectors to compute the distance between
+    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)` or `(..., N)`
+        The two vectors to compute the distance between. If either argument
+        has more than one dimension, the arguments are broadcast against each
+        other and the distance is computed along the last axis.
 
     Returns
     -------
-    d : float
+    d : float or :py:class:`ndarray <numpy.ndarray>`
         The Chebyshev distance between **x** and **y**.
     """
-    return np.max(np.abs(x - y))
+    return np.max(np.abs(x - y), axis=-1)
 
 
 def minkowski(x, y, p):
@@ -90,8 +100,10 @@ def minkowski(x, y, p):
 
     Parameters
     ----------
-    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)`
-        The two vectors to compute the distance between
+    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)` or `(..., N)`
+        The two vectors to compute the distance between. If either argument
+        has more than one dimension, the arguments are broadcast against each
+        other and the distance is computed along the last axis.
     p : float > 1
         The parameter of the distance function. When `p = 1`, this is the `L1`
         distance, and when `p=2`, this is the `L2` distance. For `p < 1`,
@@ -100,10 +112,10 @@ def minkowski(x, y, p):
 
     Returns
     -------
-    d : float
+    d : float or :py:class:`ndarray <numpy.ndarray>`
         The Minkowski-`p` distance between **x** and **y**.
     """
-    return np.sum(np.abs(x - y) ** p) ** (1 / p)
+    return np.sum(np.abs(x - y) ** p, axis=-1) ** (1 / p)
 
 
 def hamming(x, y):
@@ -120,13 +132,146 @@ def hamming(x, y):
 
     Parameters
     ----------
-    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)`
-        The two vectors to compute the distance between. Both vectors should be
-        integer-valued.
+    x,y : :py:class:`ndarray <numpy.ndarray>` s of shape `(N,)` or `(..., N)`
+        The two vectors to compute the distance between. If either argument
+        has more than one dimension, the arguments are broadcast against each
+        other and the distance is computed along the last axis. Both
+        vectors should be integer-valued.
 
     Returns
     -------
-    d : float
+    d : float or :py:class:`ndarray <numpy.ndarray>`
         The Hamming distance between **x** and **y**.
     """
-    return np.sum(x != y) / len(x)
+    return np.mean(x != y, axis=-1)
+
+
+def pairwise(
+    X,
+    Y=None,
+    metric=euclidean,
+    out=None,
+    block_size=None,
+    max_memory=2 ** 26,
+    dtype=np.float32,
+    n_jobs=1,
+):
+    """
+    Compute the matrix of distances between each row of `X` and each row of
+    `Y`, one tile at a time.
+
+    Notes
+    -----
+    For the Euclidean metric, each tile is computed using the expansion
+
+    .. math::
+
+        d(\mathbf{x}, \mathbf{y})^2 =
+            \mathbf{x}^\top \mathbf{x} - 2 \mathbf{x}^\top \mathbf{y} +
+            \mathbf{y}^\top \mathbf{y}
+
+    so that the bulk of the work is a single matrix product. Since this
+    expansion loses precision when **x** and **y** are close relative to
+    their norms, entries where :math:`d^2 < \sqrt{\epsilon} (\mathbf{x}^\top
+    \mathbf{x} + \mathbf{y}^\top \mathbf{y})` are recomputed directly, and
+    identical rows are always at distance 0. All other metrics are evaluated
+    by broadcasting each pair of row blocks against one another.
+
+    Parameters
+    ----------
+    X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, C)`
+        Collection of `N` input vectors.
+    Y : :py:class:`ndarray <numpy.ndarray>` of shape `(M, C)` or None
+        Collection of `M` input vectors. If None, use `X`. Default is None.
+    metric : function
+        The distance metric. Any of the functions in this module (or a
+        :func:`functools.partial` of :func:`minkowski`) are supported, as is
+        any function that reduces two broadcast arrays over their last axis.
+        Default is :func:`euclidean`.
+    out : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)` or None
+        An array to write the distances into, e.g., a memory-mapped array for
+        matrices that do not fit in memory. If not None, its dtype overrides
+        `dtype`. Default is None.
+    block_size : int or None
+        The number of rows of `X` and of `Y` in each tile. If None, use the
+        largest tile whose intermediate arrays fit within `max_memory`.
+        Default is None.
+    max_memory : int
+        The approximate number of bytes of scratch memory to use per tile
+        when `block_size` is None. Default is 64 MiB.
+    dtype : :py:class:`numpy.dtype`
+        The floating point type to compute and return the distances in.
+        The inputs are cast to this type before computing all metrics but
+        :func:`hamming`. Default is float32.
+    n_jobs : int or None
+        The number of threads to compute tiles with. If -1, use all available
+        CPUs. If 1 or None, compute the tiles serially. Default is 1.
+
+    Returns
+    -------
+    D : :py:class:`ndarray <numpy.ndarray>` of shape `(N, M)`
+        The pairwise distance matrix. Entry `(i, j)` contains the distance
+        between :math:`x_i` and :math:`y_j`.
+    """
+    Y = X if Y is None else Y
+    dtype = np.dtype(dtype if out is None else out.dtype)
+    out = np.empty((X.shape[0], Y.shape[0]), dtype=dtype) if out is None else out
+
+    func, kwargs = metric, {}
+    if isinstance(metric, partial):
+        func, kwargs = metric.func, dict(metric.keywords)
+        if metric.args:
+            kwargs["p"] = metric.args[0]
+
+    # hamming compares entries for equality, so leave its inputs uncast
+    if func is not hamming:
+        X, Y = np.asarray(X, dtype=dtype), np.asarray(Y, dtype=dtype)
+    N, M, C = X.shape[0], Y.shape[0], X.shape[1]
+
+    gemm = func is euclidean or (func is minkowski and kwargs.get("p") == 2)
+    if gemm:
+        XX, YY = np.einsum("ij,ij->i", X, X), np.einsum("ij,ij->i", Y, Y)
+
+    if block_size is None:
+        # the direct metrics hold a (block, block, C) array of differences
+        width = 2 if gemm else C + 1
+        block_size = int(np.sqrt(max_memory / (dtype.itemsize * width)))
+    block_size = max(1, block_size)
+
+    def tile(bounds):
+        (i0, i1), (j0, j1) = bounds
+        x, y = X[i0:i1], Y[j0:j1]
+        if gemm:
+            out[i0:i1, j0:j1] = _gemm_euclidean(x, y, XX[i0:i1], YY[j0:j1])
+        else:
+            out[i0:i1, j0:j1] = metric(x[:, None, :], y[None, :, :])
+
+    tiles = [
+        ((i, min(i + block_size, N)), (j, min(j + block_size, M)))
+        for i in range(0, N, block_size)
+        for j in range(0, M, block_size)
+    ]
+
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    if n_jobs is None or n_jobs == 1 or len(tiles) == 1:
+        for bounds in tiles:
+            tile(bounds)
+    else:
+        with ThreadPoolExecutor(n_jobs) as pool:
+            list(pool.map(tile, tiles))
+    return out
+
+
+def _gemm_euclidean(x, y, xx, yy):
+    """
+    Compute the Euclidean distances between the rows of `x` and `y` given
+    their squared norms `xx` and `yy`, recomputing entries that are small
+    relative to the norms directly.
+    """
+    norms = xx[:, None] + yy[None, :]
+    D2 = norms - 2 * (x @ y.T)
+
+    rows, cols = np.nonzero(D2 <= np.sqrt(np.finfo(D2.dtype).eps) * norms)
+    if len(rows) > 0:
+        D2[rows, cols] = np.sum((x[rows] - y[cols]) ** 2, axis=-1)
+    return np.sqrt(np.maximum(D2, 0, out=D2), out=D2)
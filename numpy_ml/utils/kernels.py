@@ -3,6 +3,8 @@ from abc import ABC, abstractmethod
 
 import numpy as np
 
+from .distance_metrics import euclidean, pairwise
+
 
 class KernelBase(ABC):
     def __init__(self):
@@ -18,6 +20,29 @@ class KernelBase(ABC):
         """Refer to documentation for the `_kernel` method"""
         return self._kernel(X, Y)
 
+    def gradient(self, X):
+        """
+        Compute the kernel's Gram matrix on `X` along with its gradient with
+        respect to each of the kernel's continuous parameters.
+
+        Parameters
+        ----------
+        X : :py:class:`ndarray <numpy.ndarray>` of shape `(N, C)`
+            Collection of `N` input vectors
+
+        Returns
+        -------
+        K : :py:class:`ndarray <numpy.ndarray>` of shape `(N, N)`
+            The Gram matrix, :math:`k(x_i, x_j)`.
+        grads : dict
+            A dictionary mapping each parameter name to a tuple ``(value,
+            dK)``, where `value` is the parameter's current value (with any
+            None defaults filled in) and `dK` is the derivative of `K` with
+            respect to it. If `value` is an array of shape `(C,)`, `dK` has
+            shape `(C, N, N)`.
+        """
+        raise NotImplementedError
+
     def __str__(self):
         P, H = self.parameters, self.hyperparameters
         p_str = ", ".join(["{}={}".format(k, v) for k, v in P.items()])
@@ -115,6 +140,12 @@ class LinearKernel(KernelBase):
         X, Y = kernel_checks(X, Y)
         return X @ Y.T + self.parameters["c0"]
 
+    def gradient(self, X):
+        """Refer to documentation for :meth:`KernelBase.gradient`"""
+        X, _ = kernel_checks(X, None)
+        K = self._kernel(X)
+        return K, {"c0": (self.parameters["c0"], np.ones_like(K))}
+
 
 class PolynomialKernel(KernelBase):
     def __init__(self, d=3, gamma=None, c0=1):
@@ -180,6 +211,18 @@ class PolynomialKernel(KernelBase):
         gamma = 1 / X.shape[1] if P["gamma"] is None else P["gamma"]
         return (gamma * (X @ Y.T) + P["c0"]) ** P["d"]
 
+    def gradient(self, X):
+        """Refer to documentation for :meth:`KernelBase.gradient`"""
+        P = self.parameters
+        X, _ = kernel_checks(X, None)
+        gamma = 1 / X.shape[1] if P["gamma"] is None else P["gamma"]
+
+        G = X @ X.T
+        base = gamma * G + P["c0"]
+        dK_dbase = P["d"] * base ** (P["d"] - 1)
+        grads = {"gamma": (gamma, dK_dbase * G), "c0": (P["c0"], dK_dbase)}
+        return base ** P["d"], grads
+
 
 class RBFKernel(KernelBase):
     def __init__(self, sigma=None):
@@ -237,6 +280,27 @@ class RBFKernel(KernelBase):
         sigma = np.sqrt(X.shape[1] / 2) if P["sigma"] is None else P["sigma"]
         return np.exp(-0.5 * pairwise_l2_distances(X / sigma, Y / sigma) ** 2)
 
+    def gradient(self, X):
+        """Refer to documentation for :meth:`KernelBase.gradient`"""
+        P = self.parameters
+        X, _ = kernel_checks(X, None)
+        sigma = np.sqrt(X.shape[1] / 2) if P["sigma"] is None else P["sigma"]
+        K = self._kernel(X)
+
+        # dK / dsigma_c = K * (x_c - y_c)^2 / sigma_c^3
+        if np.ndim(sigma) == 0:
+            D2 = pairwise_l2_distances(X / sigma, X / sigma) ** 2
+            dK = K * D2 / sigma
+        else:
+            sigma = np.asarray(sigma, dtype=float)
+            dK = np.array(
+                [
+                    K * (X[:, c, None] - X[None, :, c]) ** 2 / sigma[c] ** 3
+                    for c in range(X.shape[1])
+                ]
+            )
+        return K, {"sigma": (sigma, dK)}
+
 
 class KernelInitializer(object):
     def __init__(self, param=None):
@@ -322,8 +386,9 @@ def pairwise_l2_distances(X, Y):
                  &=  \sqrt{sum (x_i - y_j)^2} \\\\
                  &=  \sqrt{sum (x_i)^2 - 2 x_i y_j + (y_j)^2}
 
-    The code below computes the the third line using numpy broadcasting
-    fanciness to avoid any for loops.
+    The code below computes the the third line in tiles using
+    :func:`~numpy_ml.utils.distance_metrics.pairwise`, in single precision if
+    both `X` and `Y` are single precision and in double precision otherwise.
 
     Parameters
     ----------
@@ -339,6 +404,5 @@ def pairwise_l2_distances(X, Y):
         Pairwise distance matrix. Entry (i, j) contains the `L2` distance between
         :math:`x_i` and :math:`y_j`.
     """
-    D = -2 * X @ Y.T + np.sum(Y ** 2, axis=1) + np.sum(X ** 2, axis=1)[:, np.newaxis]
-    D[D < 0] = 0  # clip any value less than 0 (a result of numerical imprecision)
-    return np.sqrt(D)
+    dtype = np.result_type(X, Y, np.float32)
+    return pairwise(X, Y, euclidean, dtype=dtype)